@@ -0,0 +1,46 @@
+"""Compare the dice kernels: sorting the whole pool, selecting kept dice with a
+heap, counting faces, and what `dicecore.kernel` picks among them.
+
+Run from the repository root with `python -m benchmarks.dice`."""
+import argparse
+import statistics
+import time
+
+from dicelang import dicecore
+from dicelang.dicecore import Mode, Target
+
+POOLS = (10, 100, 500, 5000, 50000)
+KEEPS = (1, 3, 'half')
+KERNELS = {'sorting': dicecore.sorting, 'selected': dicecore.selected, 'counted': dicecore.counted,
+           'kernel': dicecore.kernel}
+
+
+def timed(action, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--repeats', type=int, default=5)
+    parser.add_argument('-s', '--sides', type=int, default=20)
+    parser.add_argument('--rolls', action='store_true', help='return roll lists (`r`) instead of sums (`d`)')
+    args = parser.parse_args()
+
+    print(f'{"":<16}' + ''.join(f'{name:>14}' for name in KERNELS) + f'{"speedup":>10}')
+    for dice in POOLS:
+        for keep in KEEPS:
+            n = dice // 2 if keep == 'half' else keep
+            timings = [timed(lambda: kernel(dice, args.sides, n, Mode.KEEP, Target.HIGHEST, not args.rolls), args.repeats)
+                       for kernel in KERNELS.values()]
+            label = f'{dice}d{args.sides}kh{n}'
+            print(f'{label:<16}' + ''.join(f'{t * 1000:11.3f} ms' for t in timings)
+                  + f'{timings[0] / timings[-1]:9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
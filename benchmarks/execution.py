@@ -0,0 +1,76 @@
+"""Time the execution of loop-heavy macros, excluding parsing.
+
+Run from the repository root with `python -m benchmarks.execution`."""
+import argparse
+import statistics
+import time
+
+from dicelang.interpreter import DicelangInterpreter
+from dicelang.lookup import BasicStore, CallStack
+from dicelang.parser import DicelangParser
+from dicelang.user_function import UserFunction
+
+MACROS = {
+    'ranges': 'total = 0; for i in [1 through 200] do for j in [1 through 20] do total += j * 2 ** 3; total',
+    'character sheet': '''
+        scores = {"str": 16, "dex": 14, "con": 13, "int": 10, "wis": 12, "cha": 8};
+        mods = {};
+        for name in ["str", "dex", "con", "int", "wis", "cha"] do
+            mods[name] = (scores[name] - 10) // 2;
+        checks = [];
+        for i in [0 to 300] do
+            checks = checks + [1d20 + mods["dex"] + (2 if i % 4 == 0 else 0)];
+        &checks''',
+    'strings': 'out = ""; for i in [0 to 500] do out = out + "ab" * 2 + "cd" * (3 $ 1 - 30); len(out)',
+    'attack loop': '''
+        hits = 0; hp = 10000;
+        while hp > 0 do begin
+            roll = 1d20 + 7;
+            if roll >= 10 + 5 then begin hits += 1; hp -= 2d6 + 4 end else 0
+        end;
+        hits''',
+    'user functions': '''
+        mod = (score) -> (score - 10) // 2;
+        check = (score, dc) -> begin t = 1d20 + mod(score); if t >= dc then 1 else 0 end;
+        passed = 0;
+        for i in [0 to 400] do passed += check(8 + i % 10, 12);
+        passed''',
+}
+
+
+def timed(action, repeats: int) -> list[float]:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--repeats', type=int, default=5)
+    parser.add_argument('--compile-after', type=int, default=UserFunction.compile_after,
+                        help='calls before a user function is compiled to bytecode; 0 disables it')
+    parser.add_argument('--seed', type=int, default=0, help='seed of every execution, so that all of them roll the same dice')
+    args = parser.parse_args()
+    UserFunction.compile_after = args.compile_after or None
+
+    dicelang = DicelangParser()
+    interpreters = {engine: DicelangInterpreter(CallStack(datastore=BasicStore()), engine=engine)
+                    for engine in DicelangInterpreter.Engines}
+    configurations = [(f'{engine}{" + opt" if optimize else ""}', interpreter, optimize)
+                      for engine, interpreter in interpreters.items() for optimize in (False, True)]
+    print(f'{"":<18}' + ''.join(f'{label:>16}' for label, *_ in configurations) + f'{"best speedup":>14}')
+    for label, code in MACROS.items():
+        timings = []
+        for _, interpreter, optimize in configurations:
+            tree = dicelang.parse_flattened(code, cache=None, optimizer=interpreter.optimizer if optimize else None)
+            if error := interpreter.execute(tree, seed=args.seed).error:
+                raise SystemExit(f'{label}: {error}')
+            timings.append(statistics.median(timed(lambda: interpreter.execute(tree, seed=args.seed), args.repeats)))
+        print(f'{label:<18}' + ''.join(f'{t * 1000:13.2f} ms' for t in timings) + f'{timings[0] / min(timings):13.2f}x')
+
+
+if __name__ == '__main__':
+    main()
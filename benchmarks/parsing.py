@@ -0,0 +1,70 @@
+"""Compare parsing with a separate flattening pass against the inlining grammar.
+
+Run from the repository root with `python -m benchmarks.parsing`."""
+import argparse
+import re
+import statistics
+import time
+
+from lark import Lark
+
+from dicelang.flattener import Flattener
+from dicelang.parser import DicelangParser
+
+CORPUS = ['1d20+7', '4d6kh3 repeat 6', 'max(1d20, 1d20) + 5', 'x.y[0](2).z * 3',
+          'a = 1d20 + 5; a >= 15 and a != 20',
+          'total = 0; for i in [1 through 10] do begin total += 1d6; if total > 20 then break total end; total',
+          'hp = 30; while hp > 0 do hp -= 2d6 + 3 if 1d20 >= 12 else 0; hp',
+          'f = (a, b=2) -> begin x = a; for i in [0 to b] do x *= 2; x end; f(3) repeat 4',
+          'not (1d6 > 3 or 1d6 < 2) xor 4d6kl3 ** 2 // 3 | 4 ^ 5 & 6']
+
+
+def count_trees(tree) -> int:
+    return sum(1 for _ in tree.iter_subtrees())
+
+
+def unflattened_grammar(grammar: str) -> str:
+    """The grammar as it was before passthrough rules were inlined (`?rule`)."""
+    rules = '|'.join(Flattener.passthrough_rules)
+    return re.sub(rf'^\?(?=(?:{rules})\b)', '', grammar, flags=re.M)
+
+
+def timed(action, repeats: int) -> list[float]:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    grammar = DicelangParser.read_grammar()
+    old = Lark(unflattened_grammar(grammar), parser='earley', start='start')
+    flattener = Flattener()
+    current = DicelangParser(use_cache=False)
+    earley = DicelangParser(fast=False, use_cache=False)
+
+    def before(code):
+        raw = old.parse(code)
+        return raw, flattener.transform(raw)
+
+    print(f'{"":<12}{"parse + flatten":>20}{"earley only":>20}{"with fast path":>20}{"trees before/after":>22}')
+    for code in CORPUS:
+        raw, flat = before(code)
+        after = current.parse(code)
+        allocated = count_trees(raw) + count_trees(flat)
+        columns = [statistics.median(timed(lambda: before(code), args.repeats)),
+                   statistics.median(timed(lambda: earley.parse(code), args.repeats)),
+                   statistics.median(timed(lambda: current.parse(code), args.repeats))]
+        label = code if len(code) <= 12 else code[:9] + '...'
+        print(f'{label:<12}' + ''.join(f'{t * 1000:17.2f} ms' for t in columns)
+              + f'{allocated:>13} / {count_trees(after):<6}')
+
+
+if __name__ == '__main__':
+    main()
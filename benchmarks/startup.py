@@ -0,0 +1,82 @@
+"""Measure how long Dicelang takes to become ready to parse.
+
+Run from the repository root with `python -m benchmarks.startup`."""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from dicelang.parser import DicelangParser
+
+IMPORT_PROBE = """
+import time
+start = time.perf_counter()
+import dicelang.user_function
+print(time.perf_counter() - start)
+"""
+
+
+def timed(action, repeats: int) -> list[float]:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def kernel_timings(repeats: int) -> dict[str, list[float]]:
+    grammar = DicelangParser.read_grammar()
+    original = DicelangParser.CacheDirectory
+    with tempfile.TemporaryDirectory() as directory:
+        DicelangParser.CacheDirectory = Path(directory)
+        try:
+            def cold():
+                DicelangParser.build_kernel(grammar)
+
+            def disk():
+                DicelangParser._kernels.clear()
+                DicelangParser.load_kernel(grammar)
+
+            def memory():
+                DicelangParser.load_kernel(grammar)
+
+            out = {'build (no cache)': timed(cold, repeats)}
+            DicelangParser.save_kernel(DicelangParser.build_kernel(grammar), DicelangParser.kernel_path(grammar))
+            out['load (disk cache)'] = timed(disk, repeats)
+            out['load (memory cache)'] = timed(memory, repeats)
+        finally:
+            DicelangParser.CacheDirectory = original
+            DicelangParser._kernels.clear()
+    return out
+
+
+def import_timings(repeats: int) -> list[float]:
+    """Time `import dicelang.user_function` in fresh interpreters, which builds or
+    loads both the script and function parsers. The first run warms the cache."""
+    subprocess.run([sys.executable, '-c', IMPORT_PROBE], check=True, capture_output=True)
+    timings = []
+    for _ in range(repeats):
+        done = subprocess.run([sys.executable, '-c', IMPORT_PROBE], check=True, capture_output=True, text=True)
+        timings.append(float(done.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def report(label: str, timings: list[float]) -> None:
+    print(f'{label:<28} min {min(timings) * 1000:9.2f} ms   median {statistics.median(timings) * 1000:9.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+    for label, timings in kernel_timings(args.repeats).items():
+        report(label, timings)
+    report('import (warm cache)', import_timings(args.repeats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Compare the throughput and latency of commands executed in-process with those
+executed by a pool of worker processes.
+
+Run from the repository root with `python -m benchmarks.workers`."""
+import argparse
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dicelang import script
+from dicelang.interpreter import DicelangInterpreter
+from dicelang.lookup import CallStack, PersistentStore
+from dicelang.workers import WorkerPool
+
+COMMANDS = ['1d20 + 7', '4d6kh3 repeat 6', '2d20kh1 + 5 >= 15', 'my hp = 40; my hp -= 2d6 + 3; my hp',
+            'total = 0; for i in [1 through 100] do total += 1d6; total', 'mods = {"str": 3}; 1d20 + mods["str"]',
+            'f = (n) -> n * 2 + 1d4; f(3) + f(4)']
+
+
+def percentile(timings: list[float], q: int) -> float:
+    return statistics.quantiles(timings, n=100)[q - 1]
+
+
+def run(execute, requests: int, threads: int) -> tuple[float, list[float]]:
+    """Throughput in commands per second, and the latency of each command."""
+    def timed(i: int) -> float:
+        start = time.perf_counter()
+        if error := execute(f'user{i % 8}', 'bench', 'general', COMMANDS[i % len(COMMANDS)]).error:
+            raise SystemExit(f'{COMMANDS[i % len(COMMANDS)]}: {error}')
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if threads == 1:
+        latencies = [timed(i) for i in range(requests)]
+    else:
+        with ThreadPoolExecutor(threads) as executor:
+            latencies = list(executor.map(timed, range(requests)))
+    return requests / (time.perf_counter() - start), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-w', '--workers', type=int, default=4)
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='commands submitted at once to the pool')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Path(directory) / 'bench.db'
+        interpreter = DicelangInterpreter(CallStack(PersistentStore(db)))
+
+        def in_process(*request):
+            return script.execute(*request, interpreter=interpreter)
+
+        start = time.perf_counter()
+        with WorkerPool(args.workers, db_location=db) as pool:
+            print(f'pool of {args.workers} workers started in {time.perf_counter() - start:.2f} s')
+            # Commands run in-process take turns, as they do on the event loop.
+            configurations = {'in-process': (in_process, 1), f'pool ({args.workers} workers)': (pool.execute, args.concurrency)}
+            print(f'{"":<20}{"commands/s":>12}{"p50":>12}{"p99":>12}')
+            for label, (execute, threads) in configurations.items():
+                run(execute, len(COMMANDS) * 2, threads)
+                throughput, latencies = run(execute, args.requests, threads)
+                print(f'{label:<20}{throughput:12.0f}{percentile(latencies, 50) * 1000:9.2f} ms'
+                      f'{percentile(latencies, 99) * 1000:9.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,17 @@ import stoat
 import configuration
 import helpfiles
 from messaging import reply
-from dicelang.script import execute
+from messaging.dispatch import Dispatcher
 from more_itertools import ilen
 from discord.ext.commands import Bot, Context, parameter
 
 MESSAGE_LIMIT = 2000
 COMMAND_PREFIX = prefix = configuration.data['bot']['prefix']
+WORKERS = configuration.data['bot'].get('workers', os.cpu_count() or 1)
+DB_LOCATION = 'persistence.db'
+
+# Started by main, once the service to connect to is known.
+dispatcher: Dispatcher | None = None
 
 stoat_bot = stoat.Client()
 
@@ -42,16 +47,16 @@ async def roll(ctx: Context, *, dicelang: str = parameter(description='An expres
         owner_id = str(owner.id)
         guild_id = str(ctx.guild.id) if ctx.guild is not None else str('dm'+owner_id)
         channel_id = str(ctx.channel.id)
-        result = execute(owner_id, guild_id, channel_id, dicelang)
+        result = await dispatcher.execute(owner_id, guild_id, channel_id, dicelang)
         try:
-            await ctx.reply(embed=reply.roll_embed(dicelang, owner, result))
+            await ctx.reply(embed=await dispatcher.render(reply.roll_embed, dicelang, owner, result))
         except reply.EmbedTooLarge:
             try:
-                await ctx.reply(content=reply.roll_content(dicelang, owner, result))
+                await ctx.reply(content=await dispatcher.render(reply.roll_content, dicelang, owner, result))
             except reply.ContentTooLarge:
                 try:
-                    await ctx.reply(content="Response too large. See attached file.",
-                                    file=discord.File(path := reply.roll_attachment(dicelang, owner, result)))
+                    path = await dispatcher.render(reply.roll_attachment, dicelang, owner, result)
+                    await ctx.reply(content="Response too large. See attached file.", file=discord.File(path))
                 except reply.AttachmentTooLarge:
                     await ctx.reply(content="Response too large (> 25MB) to attach. Try a more reasonable command.")
                 else:
@@ -94,13 +99,14 @@ async def s_on_message(event: stoat.MessageCreateEvent):
     if message.content.startswith(remove := f'{COMMAND_PREFIX}roll'):
         async with stoat_bot.user.typing():
             dicelang = message.content.removeprefix(remove).lstrip()
-            result = execute(str(owner.id), str(server), str(channel), dicelang)
+            result = await dispatcher.execute(str(owner.id), str(server), str(channel), dicelang)
             try:
-                await message.reply(reply.s_roll_content(dicelang, owner, result))
+                await message.reply(await dispatcher.render(reply.s_roll_content, dicelang, owner, result))
             except reply.ContentTooLarge:
                 try:
+                    path = await dispatcher.render(reply.roll_attachment, dicelang, owner, result)
                     await message.reply(content="Response too large. See attached file.",
-                                        attachments=[stoat.Upload(path := reply.roll_attachment(dicelang, owner, result))])
+                                        attachments=[stoat.Upload(path)])
                 except reply.AttachmentTooLarge:
                     await message.reply(content="Response too large (> 25MB) to attach. Try a more reasonable command.")
                 else:
@@ -113,14 +119,20 @@ async def s_on_message(event: stoat.MessageCreateEvent):
 
 
 def main():
+    global dispatcher
     parser = make_parser()
     args = parser.parse_args()
     discord_token = configuration.data['discord']['token']
     stoat_token = configuration.data['stoat']['token']
-    if args.service.casefold() == 'discord':
-        discord_bot.run(discord_token)
-    elif args.service.casefold() == 'stoat':
-        stoat_bot.run(stoat_token)
+    with Dispatcher(WORKERS, DB_LOCATION) as dispatcher:
+        print(f'Started {WORKERS} Dicelang worker(s).')
+        try:
+            if args.service.casefold() == 'discord':
+                discord_bot.run(discord_token)
+            elif args.service.casefold() == 'stoat':
+                stoat_bot.run(stoat_token)
+        finally:
+            print(f'Dicelang workers: {dispatcher.stats()}')
 
 
 if __name__ == '__main__':
@@ -2,6 +2,8 @@ import tomllib
 
 placeholder = """[bot]
 prefix = "+"
+# Processes that run Dicelang commands at once; one per CPU if left out.
+workers = 4
 
 [discord]
 token = "insert-token-here"
@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from dicelang import rng
+
+Weights = dict[int, int]
+
+
+class AliasTable:
+    """Walker's alias method over integer weights (in Vose's formulation), so an
+    outcome is drawn with a single random integer however many there are.
+
+    Each outcome gets a column of width `total`, holding itself up to its
+    `threshold` and its `alias` above it. The thresholds are exact integers, so
+    draws follow the weights exactly rather than up to float rounding."""
+    __slots__ = ('values', 'thresholds', 'aliases', 'total', 'size', 'bits')
+
+    def __init__(self, weights: Weights):
+        self.values = list(weights)
+        self.total = total = sum(weights.values())
+        n = len(self.values)
+        self.size = n * total
+        self.bits = self.size.bit_length()
+        scaled = [weight * n for weight in weights.values()]
+        self.thresholds = [total] * n
+        self.aliases = list(range(n))
+        small = [i for i, weight in enumerate(scaled) if weight < total]
+        large = [i for i, weight in enumerate(scaled) if weight >= total]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.thresholds[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] -= total - scaled[less]
+            (small if scaled[more] < total else large).append(more)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def draw(self) -> int:
+        # `randrange`, inlined: most of its cost is in the calls, not the random bits.
+        getrandbits = rng.current().getrandbits
+        while (drawn := getrandbits(self.bits)) >= self.size:
+            pass
+        column, height = divmod(drawn, self.total)
+        return self.values[column if height < self.thresholds[column] else self.aliases[column]]
+
+
+class SumTables:
+    """Least-recently-used cache of alias tables for the sums of dice pools, keyed
+    on the dice, sides, number kept or dropped, mode and target of a roll.
+
+    A pool's sum is only drawn from its table from the second time the current
+    generator rolls it, so pools rolled once never pay for a table, and whether a
+    table is used depends on the seed and the rolls made since, never on what
+    other executions left in the cache; seeded executions replay exactly. Only
+    pools of two or more dice (a single die is already one random number) and at
+    most `max_pool` dice times sides, whose exact weights are quick to compute,
+    get tables. The weights come from `weigh`, which is `distribution.pool` once
+    `distribution` is imported; until then, no tables are used."""
+
+    def __init__(self, max_entries: int = 256, max_pool: int = 256, enabled: bool = True):
+        self.max_entries = max_entries
+        self.max_pool = max_pool
+        self.enabled = enabled
+        self.weigh: Callable[..., Weights] | None = None
+        self.entries: OrderedDict[Hashable, AliasTable] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def draw(self, dice: int, sides: int, n: int, mode, target) -> int | None:
+        """A sum drawn from the table for the pool, or None if it isn't drawn from one."""
+        if not self.enabled or self.weigh is None or type(dice) is not int or type(sides) is not int \
+                or dice < 2 or not 0 < dice * sides <= self.max_pool:
+            return None
+        key = dice, sides, n, mode, target
+        if key not in (pools := rng.current().pools):
+            pools.add(key)
+            return None
+        with self.lock:
+            if (table := self.entries.get(key)) is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+        if table is None:
+            table = self.store(key, AliasTable(self.weigh(dice, sides, n, mode, target)))
+        return table.draw()
+
+    def store(self, key: Hashable, table: AliasTable) -> AliasTable:
+        with self.lock:
+            self.entries[key] = table
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return table
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def reset_counters(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Turn the tables off and drop every one built so far."""
+        self.enabled = False
+        self.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / lookups if (lookups := self.hits + self.misses) else 0.0
+
+    def stats(self) -> dict:
+        return {'entries': len(self.entries), 'outcomes': sum(map(len, self.entries.values())),
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hit_rate, 'enabled': self.enabled}
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(max_entries={self.max_entries}, max_pool={self.max_pool},'
+                f' enabled={self.enabled})')
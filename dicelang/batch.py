@@ -0,0 +1,200 @@
+import itertools
+import operator
+from numbers import Real
+from typing import Any, Callable
+
+from lark import Tree
+
+from dicelang import dicecore, memory, rng
+from dicelang.dicecore import Mode, Target
+from dicelang.optimizer import fuel_cost, is_pure
+
+# A plan computes the value of an expression for `n` repetitions at once: a list
+# of `n` values, or a single value if it is the same for every repetition.
+Plan = Callable[[Any, int], Any]
+
+_DICE = {'die_binary': (Mode.KEEP, Target.ALL), 'die_ternary_keep_high': (Mode.KEEP, Target.HIGHEST),
+         'die_ternary_keep_low': (Mode.KEEP, Target.LOWEST), 'die_ternary_drop_high': (Mode.DROP, Target.HIGHEST),
+         'die_ternary_drop_low': (Mode.DROP, Target.LOWEST)}
+# For real numbers, the interpreter's operators are Python's.
+_BINARY = {'addition': operator.add, 'subtraction': operator.sub, 'multiplication': operator.mul,
+           'division': operator.truediv, 'integer_division': operator.floordiv, 'remainder': operator.mod}
+_UNARY = {'unary_minus': operator.neg, 'unary_plus': operator.pos, 'boolean_not': operator.not_}
+
+
+class Unbatchable(Exception):
+    """Raised by a plan whose operands turn out not to suit it, e.g. a die with
+    a non-integer number of sides. The repetitions are then run one by one."""
+
+
+def apply(function: Callable, *operands) -> Any:
+    """Apply `function` to each repetition of `operands`, repeating single values."""
+    if not any(isinstance(o, list) for o in operands):
+        return function(*operands)
+    return list(map(function, *(o if isinstance(o, list) else itertools.repeat(o) for o in operands)))
+
+
+class BatchCompiler:
+    """Evaluates `expression repeat n` for all `n` repetitions at once, when the
+    expression is made only of dice, arithmetic, comparisons and constants.
+
+    Dice are rolled in bulk from random bytes and every operator is applied
+    elementwise with `map`, so a repetition costs a few C-level operations
+    rather than a walk of the tree. Other expressions, and repetitions fewer
+    than `MinRepeats`, are evaluated one by one. Plans are cached on the
+    repeated node, like the closures of `ClosureCompiler`."""
+    MinRepeats = 16
+    ChunkSize = 1 << 20  # The most dice rolled at once
+    ElementsPerFuel = 16  # Dice rolled, or values computed elementwise, for a unit of fuel
+
+    def __init__(self, interpreter_class):
+        self.interpreter_class = interpreter_class
+
+    def repeat(self, ip, tree: Tree, count, body: Callable[[Any], Any] | None = None) -> list:
+        """`[body(ip) for _ in range(count)]`, where `body` evaluates `tree`. `body`
+        uses as much fuel as visiting `tree` for every repetition would; a batch
+        uses a unit for every `ElementsPerFuel` dice it rolls or values it
+        computes, as it goes, on top of the fuel of the constants it visits."""
+        repetitions = len(range(count))
+        memory.reserve(repetitions * memory.Pointer, 'repetition')
+        if repetitions >= self.MinRepeats and (plan := self.plan(tree)) is not None:
+            try:
+                values = plan(ip, repetitions)
+            except Unbatchable:
+                pass
+            else:
+                return values if isinstance(values, list) else [values] * repetitions
+        if body is None:
+            return [ip.visit(tree) for _ in range(count)]
+        fuel = fuel_cost(tree)
+        results = []
+        for _ in range(count):
+            ip.burn(fuel)
+            results.append(body(ip))
+        return results
+
+    def plan(self, tree: Tree) -> Plan | None:
+        """The plan for a repeated expression, or None if it has no dice or can't
+        be evaluated in batches."""
+        try:
+            return tree.batch
+        except AttributeError:
+            pass
+        plan = None
+        if any(t.data in _DICE for t in tree.iter_subtrees()):
+            plan = self.compile(tree)
+        tree.batch = plan
+        return plan
+
+    def compile(self, tree: Tree) -> Plan | None:
+        data = tree.data
+        if is_pure(tree):
+            return self.constant(tree)
+        operands = [self.compile(c) for c in tree.children if isinstance(c, Tree)]
+        if data in _DICE:
+            return self.dice(tree) if all(is_pure(c) for c in tree.children if isinstance(c, Tree)) else None
+        if None in operands:
+            return None
+        if data in _BINARY or data in _UNARY:
+            return self.elementwise(_BINARY.get(data) or _UNARY[data], operands)
+        if data == 'compare_math':
+            return self.compare_math(tree, operands)
+        if data == 'boolean_and':
+            return self.short_circuit(operator.truth, operands)
+        if data == 'boolean_or':
+            return self.short_circuit(operator.not_, operands)
+        if not hasattr(self.interpreter_class, data) and len(operands) == 1 and len(tree.children) == 1:
+            return operands[0]
+        return None
+
+    @staticmethod
+    def constant(tree: Tree) -> Plan:
+        def evaluate(ip, n):
+            value = ip.visit(tree)
+            if not isinstance(value, Real):
+                raise Unbatchable
+            return value
+        return evaluate
+
+    def elementwise(self, function: Callable, operands: list[Plan]) -> Plan:
+        elements_per_fuel = self.ElementsPerFuel
+
+        def evaluate(ip, n):
+            values = [operand(ip, n) for operand in operands]
+            ip.burn(1 + n // elements_per_fuel)
+            return apply(function, *values)
+        return evaluate
+
+    def short_circuit(self, needs_right: Callable[[Any], bool], operands: list[Plan]) -> Plan:
+        """`left and right` or `left or right`, which is `right` where `needs_right(left)`
+        and `left` elsewhere. Like the interpreter, `right` is only evaluated where it
+        is needed: as a batch of just those rows, whose values are then put in their
+        place, since the rows of a plan are all alike."""
+        left, right = operands
+        elements_per_fuel = self.ElementsPerFuel
+
+        def evaluate(ip, n):
+            values = left(ip, n)
+            if not isinstance(values, list):
+                return right(ip, n) if needs_right(values) else values
+            ip.burn(1 + n // elements_per_fuel)
+            if rows := [i for i, value in enumerate(values) if needs_right(value)]:
+                needed = right(ip, len(rows))
+                for i, value in zip(rows, needed if isinstance(needed, list) else itertools.repeat(needed)):
+                    values[i] = value
+            return values
+        return evaluate
+
+    def compare_math(self, tree: Tree, operands: list[Plan]) -> Plan:
+        comparisons = [self.interpreter_class.comparison_ops[op] for op in tree.children[1::2]]
+        if len(comparisons) == 1:
+            return self.elementwise(comparisons[0], operands)
+
+        def chained(*values):
+            return all(c(a, b) for c, a, b in zip(comparisons, values, values[1:]))
+        return self.elementwise(chained, operands)
+
+    def dice(self, tree: Tree) -> Plan:
+        operands = [c for c in tree.children if isinstance(c, Tree)]
+        mode, target = _DICE[tree.data]
+        chunk_size, elements_per_fuel = self.ChunkSize, self.ElementsPerFuel
+
+        def evaluate(ip, n):
+            dice, sides, *kept = [ip.visit(c) for c in operands]
+            kept = kept[0] if kept else 1
+            if not all(type(x) is int for x in (dice, sides, kept)) or sides < 1:
+                raise Unbatchable
+            dicecore.check(dice, kept, mode)
+            if target is Target.ALL:
+                keep, highest = dice, True
+            else:
+                keep = kept if mode is Mode.KEEP else dice - kept
+                highest = (target is Target.HIGHEST) == (mode is Mode.KEEP)
+            if dice >= dicecore.CountingFactor * sides:
+                column = []
+                for _ in range(n):
+                    ip.burn(1 + sides // elements_per_fuel)
+                    column.append(dicecore.kernel(dice, sides, kept, mode, target))
+                return column
+            column = []
+            rows = max(1, chunk_size // dice)
+            for start in range(0, n, rows):
+                ip.burn(1 + (rolled := min(rows, n - start) * dice) // elements_per_fuel)
+                rolls = rng.current().rolls(sides, rolled)
+                column.extend(select(rolls, dice, keep, highest))
+            return column
+        return evaluate
+
+
+def select(rolls, dice: int, keep: int, highest: bool) -> list:
+    """The sum of the `keep` highest (or lowest) of each group of `dice` rolls."""
+    if dice == 1:
+        return list(rolls)
+    groups = itertools.batched(rolls, dice)
+    if keep == dice:
+        return list(map(sum, groups))
+    if keep == 1:
+        return list(map(max if highest else min, groups))
+    if highest:
+        return [sum(sorted(group)[-keep:]) for group in groups]
+    return [sum(sorted(group)[:keep]) for group in groups]
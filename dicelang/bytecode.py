@@ -0,0 +1,413 @@
+import ast
+import hashlib
+import threading
+from collections import Counter
+from typing import Any, Callable
+
+from lark import Token, Tree
+
+from dicelang import compiler as closures
+from dicelang import memory
+from dicelang.exceptions import Break, Continue
+from dicelang.lookup import Accessor
+from dicelang.special import Undefined
+from dicelang.user_function import UserFunction
+from dicelang.utils import Argument
+
+Lowered = Callable[[Any], Any]
+
+
+class Lowering:
+    """Translates one function body into the source of a Python function `body(ip)`.
+
+    The value of every node is assigned to a fresh local in evaluation order, so
+    side effects (dice, assignments, calls) happen exactly as they would in the
+    interpreter. Values that aren't Python literals (operators, constants from the
+    optimizer, nodes left to the interpreter) are referred to through names bound
+    in `namespace`; Dicelang identifiers only ever appear as string constants.
+
+    Fuel is used as in the closure engine, on entry and at each branch and loop
+    iteration, for the nodes lowered here; nodes left to `ip.visit` use their own."""
+
+    def __init__(self, compiler: closures.ClosureCompiler):
+        self.compiler = compiler
+        self.namespace = {}
+        self.bound = {}
+        self.lines = []
+        self.depth = 1
+        self.temps = 0
+        self.fallbacks = 0
+        self.methods = {name: getattr(self, name) for name in _LOWERED}
+        self.methods.update(dict.fromkeys(closures.BINARY, self.binary))
+        self.methods.update(dict.fromkeys(closures.UNARY, self.unary))
+        self.methods.update(dict.fromkeys((*closures.DICE, *closures.ROLLS), self.dice))
+
+    def source(self, tree: Tree) -> str:
+        self.charge(tree)
+        result = self.lower(tree)
+        return '\n'.join(['def body(ip):', *self.lines, f'    return {result}'])
+
+    def emit(self, line: str) -> None:
+        self.lines.append('    ' * self.depth + line)
+
+    def indented(self, lower: Callable[[], str], target: str, charged: Tree | None = None) -> None:
+        self.depth += 1
+        if charged is not None:
+            self.charge(charged)
+        self.emit(f'{target} = {lower()}')
+        self.depth -= 1
+
+    def charge(self, *nodes: Tree) -> None:
+        """Emit the use of the fuel of `nodes`, up to their branches."""
+        if fuel := sum(self.compiler.fuel(node, fallback=0) for node in nodes):
+            self.emit(f'ip.burn({fuel})')
+
+    def bind(self, value: Any) -> str:
+        key = id(value)
+        if key not in self.bound:
+            self.bound[key] = name = f'k{len(self.bound)}'
+            self.namespace[name] = value
+        return self.bound[key]
+
+    def temp(self, prefix: str = 't') -> str:
+        self.temps += 1
+        return f'{prefix}{self.temps}'
+
+    def assign(self, expression: str) -> str:
+        name = self.temp()
+        self.emit(f'{name} = {expression}')
+        return name
+
+    def lower(self, node) -> str:
+        if not isinstance(node, Tree):
+            return self.bind(node)
+        data = node.data
+        if data in closures.STATIC:
+            known, value = self.compiler.static_value(node)
+            return self.bind(value) if known else self.fallback(node)
+        if (method := self.methods.get(data)) is not None:
+            return method(node)
+        if not hasattr(self.compiler.interpreter_class, data) and node.children and isinstance(node.children[0], Tree):
+            return self.lower(node.children[0])
+        return self.fallback(node)
+
+    def lower_all(self, nodes) -> list[str]:
+        return [self.lower(n) for n in nodes if not isinstance(n, Token)]
+
+    def fallback(self, node: Tree) -> str:
+        self.fallbacks += 1
+        return self.assign(f'ip.visit({self.bind(node)})')
+
+    def constant(self, node: Tree) -> str:
+        value, _, copy_value = node.children
+        if copy_value is None:
+            return self.bind(value)
+        return self.assign(f'{self.bind(copy_value)}({self.bind(value)})')
+
+    def binary(self, node: Tree) -> str:
+        left, right = self.lower_all(node.children)
+        return self.assign(f'{self.bind(closures.BINARY[node.data])}({left}, {right})')
+
+    def unary(self, node: Tree) -> str:
+        operand = self.lower(node.children[0])
+        return self.assign(f'{self.bind(closures.UNARY[node.data])}({operand})')
+
+    def exponent(self, node: Tree) -> str:
+        mantissa, superscript = self.lower_all(node.children)
+        return self.assign(f'ip._exponentiate({mantissa}, {superscript})')
+
+    def dice(self, node: Tree) -> str:
+        roll = self.bind(closures.DICE.get(node.data) or closures.ROLLS[node.data])
+        operands = ', '.join(self.lower_all(node.children))
+        if node.data in closures.ROLLS:
+            return self.assign(f'{roll}({operands}, as_sum=False)')
+        return self.assign(f'{roll}({operands})')
+
+    def compare_math(self, node: Tree) -> str:
+        operands = self.lower_all(node.children[::2])
+        comparisons = self.compiler.interpreter_class.comparison_ops
+        tests = [f'{self.bind(comparisons[op])}({a}, {b})'
+                 for op, a, b in zip(node.children[1::2], operands, operands[1:])]
+        return self.assign(f'True if {" and ".join(tests)} else False')
+
+    def member_of(self, node: Tree) -> str:
+        element, collection = self.lower_all(node.children)
+        return self.assign(f'{element} in {collection}')
+
+    def member_of_negated(self, node: Tree) -> str:
+        element, collection = self.lower_all(node.children)
+        return self.assign(f'{element} not in {collection}')
+
+    def boolean_or(self, node: Tree) -> str:
+        left, right = node.children
+        result = self.assign(self.lower(left))
+        self.emit(f'if not {result}:')
+        self.indented(lambda: self.lower(right), result, right)
+        return result
+
+    def boolean_and(self, node: Tree) -> str:
+        left, right = node.children
+        result = self.assign(self.lower(left))
+        self.emit(f'if {result}:')
+        self.indented(lambda: self.lower(right), result, right)
+        return result
+
+    def boolean_xor(self, node: Tree) -> str:
+        operands = ', '.join(self.lower_all(node.children))
+        return self.assign(f'{self.bind(any)}(({operands},)) and not {self.bind(all)}(({operands},))')
+
+    def boolean_not(self, node: Tree) -> str:
+        return self.assign(f'not {self.lower(node.children[-1])}')
+
+    def branches(self, condition: Tree, if_body: Tree, else_body: Tree | None) -> str:
+        test = self.lower(condition)
+        result = self.temp()
+        self.emit(f'if {test}:')
+        self.indented(lambda: self.lower(if_body), result, if_body)
+        self.emit('else:')
+        self.indented(lambda: self.lower(else_body) if else_body is not None else self.bind(Undefined), result,
+                      else_body)
+        return result
+
+    def if_block(self, node: Tree) -> str:
+        _, condition, _, body = node.children
+        return self.branches(condition, body, None)
+
+    def if_else_block(self, node: Tree) -> str:
+        _, condition, _, if_body, _, else_body = node.children
+        return self.branches(condition, if_body, else_body)
+
+    def if_ternary(self, node: Tree) -> str:
+        if_action, _, condition, _, else_action = node.children
+        return self.branches(condition, if_action, else_action)
+
+    def block(self, node: Tree) -> str:
+        self.emit('ip.call_stack.scope_push()')
+        values = [self.lower(c) if isinstance(c, Tree) else self.bind(c) for c in node.children]
+        self.emit('ip.call_stack.scope_pop()')
+        return values[-2]
+
+    def loop_body(self, body: Tree, results: str, continued: str, collect: bool, *charged: Tree) -> None:
+        """Emit one iteration: run `body`, collect its value (or the value of a
+        `continue`) unless the loop's value is discarded, then use the fuel of the
+        `charged` nodes before the back-edge."""
+        signal = self.temp('e')
+        self.emit('try:')
+        self.indented(lambda: self.lower(body), value := self.temp())
+        if collect:
+            self.emit(f'    {results}.append({value})')
+        self.emit(f'except {self.bind(Continue)} as {signal}:')
+        if collect:
+            self.emit(f'    if {signal}:')
+            self.emit(f'        {results}.append({continued.format(signal)})')
+        else:
+            self.emit('    pass')
+        self.charge(*charged)
+
+    def loop(self, results: str, collect: bool, emit_loop: Callable[[], None]) -> str:
+        signal = self.temp('e')
+        self.emit('try:')
+        self.depth += 1
+        emit_loop()
+        self.depth -= 1
+        self.emit(f'except {self.bind(Break)} as {signal}:')
+        if collect:
+            self.emit(f'    if {signal}:')
+            self.emit(f'        {results}.append({signal}.value)')
+        else:
+            self.emit('    pass')
+        return results
+
+    def conditional_loop(self, node: Tree, condition: Tree, body: Tree, results: str, continued: str) -> str:
+        collect = not getattr(node, 'discarded', False)
+
+        def emit_loop():
+            self.emit('while True:')
+            self.depth += 1
+            self.emit(f'if not {self.lower(condition)}:')
+            self.depth += 1
+            self.charge(condition)
+            self.emit('break')
+            self.depth -= 1
+            self.loop_body(body, results, continued, collect, condition, body)
+            self.depth -= 1
+        return self.loop(results, collect, emit_loop)
+
+    def while_loop(self, node: Tree) -> str:
+        _, condition, _, body = node.children
+        results = self.assign('[]')
+        # The interpreter collects the `continue` signal itself here, not its value.
+        return self.conditional_loop(node, condition, body, results, '{}')
+
+    def do_while_loop(self, node: Tree) -> str:
+        _, body, _, condition = node.children
+        self.charge(body)
+        first = self.lower(body)
+        results = self.assign('[]' if getattr(node, 'discarded', False) else f'[{first}]')
+        return self.conditional_loop(node, condition, body, results, '{}.value')
+
+    def for_loop(self, node: Tree) -> str:
+        _, ident, _, iterable, _, body = node.children
+        collect = not getattr(node, 'discarded', False)
+        variable = self.assign(f'{self.bind(closures.loop_variable)}(ip, {self.lower(ident)})')
+        results = self.assign('[]')
+
+        def emit_loop():
+            item = self.temp('x')
+            self.emit(f'for {item} in {self.lower(iterable)}:')
+            self.depth += 1
+            self.emit(f'{variable}.put({item})')
+            self.loop_body(body, results, '{}.value', collect, body)
+            self.depth -= 1
+        return self.loop(results, collect, emit_loop)
+
+    def repetition(self, node: Tree) -> str:
+        repeatable, _, repeats = node.children
+        count = self.lower(repeats)
+        if self.compiler.batches.plan(repeatable) is not None:
+            return self.assign(f'{self.bind(self.compiler.batches.repeat)}(ip, {self.bind(repeatable)}, {count})')
+        results = self.assign('[]')
+        repetitions = self.assign(f'{self.bind(range)}({count})')
+        self.emit(f"{self.bind(memory.reserve)}({self.bind(len)}({repetitions}) * {memory.Pointer}, 'repetition')")
+        self.emit(f'for _ in {repetitions}:')
+        self.depth += 1
+        self.charge(repeatable)
+        self.emit(f'{results}.append({self.lower(repeatable)})')
+        self.depth -= 1
+        return results
+
+    def list_empty(self, _) -> str:
+        return self.assign('[]')
+
+    def dict_empty(self, _) -> str:
+        return self.assign('{}')
+
+    def list_populated(self, node: Tree) -> str:
+        return self.assign(f'[{", ".join(self.lower_all(node.children))}]')
+
+    def tuple_single(self, node: Tree) -> str:
+        return self.assign(f'({self.lower(node.children[0])},)')
+
+    def tuple_multi(self, node: Tree) -> str:
+        return self.assign(f'({", ".join(self.lower_all(node.children))},)')
+
+    def set_populated(self, node: Tree) -> str:
+        return self.assign(f'{{{", ".join(self.lower_all(node.children))}}}')
+
+    def dict_populated(self, node: Tree) -> str:
+        result = self.assign('{}')
+        for pair in node.children:
+            key, value = self.lower_all(pair.children)
+            self.emit(f'{result}[{key}] = {value}')
+        return result
+
+    def subscript_bracket(self, node: Tree) -> str:
+        return self.assign(f'{self.bind(closures.subscript)}({self.lower(node.children[0])})')
+
+    def subscript_dot(self, node: Tree) -> str:
+        return self.assign(f'{self.bind(Accessor.attr)}({self.lower(node.children[0])}[-1])')
+
+    def access(self, node: Tree) -> str:
+        known, value = self.compiler.static_value(node.children[0])
+        if not known or not isinstance(value, tuple) or (action := closures.LOOKUPS.get(value[0])) is None:
+            return self.fallback(node)
+        accessors = ''.join(f', {a}' for a in self.lower_all(node.children[1:]))
+        return self.assign(f'{self.bind(action)}(ip.call_stack, ip.ownership, {self.bind(value[1])}{accessors})')
+
+    def retrieval(self, node: Tree) -> str:
+        return self.assign(f'{self.lower(node.children[0])}.get()')
+
+    def retrieval_atomic(self, node: Tree) -> str:
+        target, *accessors = self.lower_all(node.children)
+        return self.assign(f'{self.bind(closures.retrieve)}({target}, [{", ".join(accessors)}])')
+
+    def function_call(self, node: Tree) -> str:
+        callee, *arguments = self.lower_all(node.children)
+        return self.assign(f'{self.bind(closures.call)}(ip, {callee}, {arguments[-1] if arguments else "[]"})')
+
+    def arguments(self, node: Tree) -> str:
+        return self.assign(f'[{", ".join(self.lower_all(node.children))}]')
+
+    def argument(self, node: Tree) -> str:
+        *name, value = self.lower_all(node.children)
+        if not name:
+            return self.assign(f'{self.bind(Argument)}({value})')
+        return self.assign(f'{self.bind(Argument)}({value}, {name[0]}[-1])')
+
+    def assignment_single(self, node: Tree) -> str:
+        target, value = self.lower_all(node.children)
+        return self.assign(f'{target}.put({value})')
+
+    def augmented_any(self, node: Tree) -> str:
+        target, augment = self.lower_all(node.children)
+        if node.children[1] == '**=':
+            function = 'ip._exponentiate'
+        else:
+            function = self.bind(self.compiler.interpreter_class.augments[node.children[1]])
+        return self.assign(f'{target}.put({function}({target}.get(), {augment}))')
+
+
+_LOWERED = ('constant', 'exponent', 'compare_math', 'member_of', 'member_of_negated', 'boolean_or',
+            'boolean_and', 'boolean_xor', 'boolean_not', 'if_block', 'if_else_block', 'if_ternary', 'block',
+            'while_loop', 'do_while_loop', 'for_loop', 'repetition', 'list_empty', 'dict_empty',
+            'list_populated', 'tuple_single', 'tuple_multi', 'set_populated', 'dict_populated',
+            'subscript_bracket', 'subscript_dot', 'access', 'retrieval', 'retrieval_atomic', 'function_call',
+            'arguments', 'argument', 'assignment_single', 'augmented_any')
+
+
+class BytecodeCompiler:
+    """Compiles the bodies of hot user functions to Python bytecode.
+
+    A body is lowered to a Python `ast.Module` defining `body(ip)` and compiled
+    with `compile()`. It runs with no builtins, and reaches Dicelang semantics
+    only through the same runtime helpers the closure engine uses. Loops check
+    the interpreter's runtime limit on every iteration, as the interpreter does.
+    Nodes that can't be lowered are handed back to the interpreter
+    (`ip.visit(node)`); a body whose root can't be lowered is not compiled.
+
+    Compiled bodies are cached on a hash of the function's syntax tree, so every
+    copy of a function (closures, store round trips) shares one compilation."""
+
+    def __init__(self, compiler: closures.ClosureCompiler, max_entries: int = 512):
+        self.compiler = compiler
+        self.max_entries = max_entries
+        self.cache: dict[str, Lowered | None] = {}
+        self.lock = threading.Lock()
+        self.counters = Counter()
+
+    @staticmethod
+    def digest(code: Tree) -> str:
+        return hashlib.sha256(repr(UserFunction.pack(code)).encode()).hexdigest()
+
+    def compile(self, code: Tree) -> Lowered | None:
+        """Return a compiled `body(ip)` for the function body `code`, or None if
+        it should be left to the interpreter."""
+        key = self.digest(code)
+        with self.lock:
+            if key in self.cache:
+                self.counters['hits'] += 1
+                return self.cache[key]
+        lowered = self.lower(code.children[0])
+        with self.lock:
+            if len(self.cache) >= self.max_entries:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[key] = lowered
+        return lowered
+
+    def lower(self, tree: Tree) -> Lowered | None:
+        lowering = Lowering(self.compiler)
+        try:
+            source = lowering.source(tree)
+            if lowering.fallbacks == len(lowering.lines):
+                # Nothing but calls back into the interpreter; compiling it would gain nothing.
+                self.counters['rejected'] += 1
+                return None
+            module = ast.parse(source, filename='<dicelang>', mode='exec')
+            namespace = {'__builtins__': {}, **lowering.namespace}
+            exec(compile(module, '<dicelang>', 'exec'), namespace)
+        except (SyntaxError, RecursionError, MemoryError, ValueError):
+            self.counters['rejected'] += 1
+            return None
+        self.counters['compiled'] += 1
+        self.counters['fallbacks'] += lowering.fallbacks
+        return namespace['body']
@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from lark import Tree
+
+
+def tree_size(tree) -> int:
+    """Count the nodes (subtrees and tokens) in a syntax tree."""
+    size = 0
+    pending = [tree]
+    while pending:
+        node = pending.pop()
+        size += 1
+        if isinstance(node, Tree):
+            pending.extend(node.children)
+    return size
+
+
+class ParseCache:
+    """Least-recently-used cache of flattened syntax trees, keyed on the exact
+    source text of a command (and the grammar rule it was parsed from).
+
+    Entries are evicted oldest-first whenever either `max_entries` or the
+    total node count across all cached trees (`max_nodes`) is exceeded. Trees
+    larger than `max_nodes` on their own are never cached. Cached trees are
+    shared between callers, so they must not be mutated after insertion. The
+    cache may be shared between threads; trees are built outside of its lock."""
+
+    def __init__(self, max_entries: int = 1024, max_nodes: int = 1 << 18, enabled: bool = True):
+        self.max_entries = max_entries
+        self.max_nodes = max_nodes
+        self.enabled = enabled
+        self.entries: OrderedDict[Hashable, tuple[Tree, int]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.nodes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def fetch(self, key: Hashable, build: Callable[[], Tree]) -> Tree:
+        """Return the tree cached under `key`, or call `build` to produce it and
+        cache the result. Exceptions from `build` propagate and nothing is cached."""
+        if not self.enabled:
+            return build()
+        with self.lock:
+            try:
+                tree, _ = self.entries[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return tree
+        tree = build()
+        self.store(key, tree)
+        return tree
+
+    def store(self, key: Hashable, tree: Tree) -> Tree:
+        if (size := tree_size(tree)) > self.max_nodes:
+            return tree
+        with self.lock:
+            if key in self.entries:
+                self.nodes -= self.entries.pop(key)[1]
+            self.entries[key] = tree, size
+            self.nodes += size
+            while len(self.entries) > self.max_entries or self.nodes > self.max_nodes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nodes -= evicted
+                self.evictions += 1
+        return tree
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.nodes = 0
+
+    def reset_counters(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Turn caching off and drop every cached tree."""
+        self.enabled = False
+        self.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / lookups if (lookups := self.hits + self.misses) else 0.0
+
+    def stats(self) -> dict:
+        return {'entries': len(self.entries), 'nodes': self.nodes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'hit_rate': self.hit_rate,
+                'enabled': self.enabled}
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(max_entries={self.max_entries}, max_nodes={self.max_nodes},'
+                f' enabled={self.enabled})')
+
+
+parse_cache = ParseCache()
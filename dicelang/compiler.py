@@ -0,0 +1,512 @@
+import operator
+from typing import Any, Callable
+
+from lark import Token, Tree
+
+from dicelang import dicecore
+from dicelang import memory
+from dicelang import ops
+from dicelang import utils
+from dicelang.batch import BatchCompiler
+from dicelang.exceptions import BadArguments, Break, Continue, Impossible
+from dicelang.lookup import Accessor, IdentType, Lookup
+from dicelang.optimizer import loop_results
+from dicelang.special import Undefined
+from dicelang.user_function import UserFunction
+
+Closure = Callable[[Any], Any]
+
+# Rules whose value depends only on the node itself, so they are evaluated once, at compile time.
+STATIC = {'number', 'string', 'boolean', 'undefined', 'whole_slice', 'tuple_empty',
+           'scoped_identifier', 'user_identifier', 'server_identifier', 'public_identifier',
+           'user_server_identifier', 'channel_identifier'}
+
+LOOKUPS = {IdentType.SCOPED: Lookup.scoped, IdentType.USER: Lookup.user, IdentType.SERVER: Lookup.server,
+            IdentType.PUBLIC: Lookup.public, IdentType.USER_SERVER: Lookup.user_server,
+            IdentType.CHANNEL: Lookup.channel}
+
+BINARY = {'addition': ops.add, 'subtraction': ops.subtract, 'multiplication': ops.multiply,
+           'division': ops.divide, 'integer_division': operator.floordiv, 'remainder': operator.mod,
+           'left_shift': ops.left_shift, 'right_shift': ops.right_shift, 'catenation': ops.cat,
+           'bit_and': operator.and_, 'bit_xor': operator.xor, 'bit_or': operator.or_}
+
+UNARY = {'unary_minus': ops.negate, 'unary_plus': ops.positive, 'bit_not': ops.invert,
+          'sum_or_join': ops.sum_or_join}
+
+DICE = {'die_binary': dicecore.keep_all, 'die_ternary_keep_high': dicecore.keep_highest,
+         'die_ternary_keep_low': dicecore.keep_lowest, 'die_ternary_drop_high': dicecore.drop_highest,
+         'die_ternary_drop_low': dicecore.drop_lowest, 'die_explode': dicecore.explode,
+         'die_compound': dicecore.compound, 'die_reroll': dicecore.reroll_below,
+         'die_successes': dicecore.count_successes, 'die_exploding_successes': dicecore.count_exploding_successes}
+ROLLS = {'roll_binary': dicecore.keep_all, 'roll_ternary_keep_high': dicecore.keep_highest,
+          'roll_ternary_keep_low': dicecore.keep_lowest, 'roll_ternary_drop_high': dicecore.drop_highest,
+          'roll_ternary_drop_low': dicecore.drop_lowest, 'roll_explode': dicecore.explode,
+          'roll_compound': dicecore.compound, 'roll_reroll': dicecore.reroll_below}
+
+# The children of each rule that are evaluated only sometimes, or again and again.
+BRANCHES = {'if_block': (3,), 'if_else_block': (3, 5), 'if_ternary': (0, 4), 'boolean_or': (1,),
+            'boolean_and': (1,), 'while_loop': (1, 3), 'do_while_loop': (1, 3), 'for_loop': (5,),
+            'repetition': (0,)}
+
+_COMPILED = ('constant', 'start', 'block', 'if_block', 'if_else_block', 'if_ternary', 'while_loop',
+             'do_while_loop', 'for_loop', 'repetition', 'exponent', 'compare_math', 'member_of',
+             'member_of_negated', 'boolean_or', 'boolean_and', 'boolean_xor', 'boolean_not', 'list_empty',
+             'dict_empty', 'list_populated', 'tuple_single', 'tuple_multi', 'set_populated', 'dict_populated',
+             'subscript_bracket', 'subscript_dot', 'access', 'retrieval', 'retrieval_atomic', 'function_call',
+             'arguments', 'argument', 'assignment_single', 'augmented_any')
+
+
+def loop_variable(ip, name) -> Lookup:
+    if not isinstance(name, tuple) or len(name) != 2 or (action := LOOKUPS.get(name[0])) is None:
+        raise Impossible(f"can't assign for loop variable {name}")
+    return action(ip.call_stack, ip.ownership, name[1])
+
+
+def retrieve(target: Any, accessors: list[Accessor]) -> Any:
+    """Apply `accessors` to `target` in turn, binding the result to the object it
+    was taken from if it is a user function."""
+    last = Undefined
+    for accessor in accessors:
+        last = target
+        target = accessor.get(target)
+    if isinstance(target, UserFunction):
+        target.this = last
+        return target
+    return target
+
+
+def call(ip, function: Any, arguments: list[utils.Argument]) -> Any:
+    if not utils.is_sorted([a.is_named() for a in arguments]):
+        raise BadArguments('named arguments must follow positional arguments')
+    positional = [a for a in arguments if not a.is_named()]
+    named = dict(a.pair() for a in arguments if a.is_named())
+    if isinstance(function, UserFunction):
+        return function(ip, *positional, **named)
+    return function(*[p.value for p in positional], **named)
+
+
+def subscript(value: Any) -> Accessor:
+    if isinstance(value, slice):
+        return Accessor.slice(value)
+    return Accessor.key(value)
+
+
+class ClosureCompiler:
+    """Compiles syntax trees into nested closures, one per node, each taking the
+    interpreter that runs it. Operands are compiled once, when their parent is, so
+    running a closure costs no method lookup or child list allocation per node.
+
+    Closures are cached on the node they were compiled from and hold no interpreter
+    state, so cached trees can be shared between interpreters. Nodes that have no
+    closure here fall back to the tree-walking method of `interpreter_class`, and
+    their children are compiled as soon as that method visits them.
+
+    Compiled code uses the fuel `visit` would, a unit per node, but a stretch of
+    nodes at a time: each tree the interpreter visits, each branch taken and each
+    loop iteration uses the fuel of its nodes up to the branches within it."""
+
+    def __init__(self, interpreter_class):
+        self.interpreter_class = interpreter_class
+        self.batches = BatchCompiler(interpreter_class)
+        self.methods = {name: getattr(self, name) for name in _COMPILED}
+        self.methods.update(dict.fromkeys(BINARY, self.binary))
+        self.methods.update(dict.fromkeys(UNARY, self.unary))
+        self.methods.update(dict.fromkeys((*DICE, *ROLLS), self.dice))
+
+    def compile(self, tree: Tree) -> Closure:
+        try:
+            return tree.closure
+        except AttributeError:
+            pass
+        data = tree.data
+        if data in STATIC:
+            closure = self.static(tree)
+        elif (method := self.methods.get(data)) is not None:
+            closure = method(tree)
+        elif not hasattr(self.interpreter_class, data) and tree.children and isinstance(tree.children[0], Tree):
+            # The interpreter's `__default__` evaluates unhandled rules as their first child.
+            closure = self.compile(tree.children[0])
+        else:
+            closure = self.fallback(tree)
+        tree.closure = closure
+        return closure
+
+    def fuel(self, tree: Tree, fallback: int = 1) -> int:
+        """The fuel visiting `tree` uses up to its branches and loop bodies, and up to
+        the nodes left to the interpreter, which count as `fallback` units (their
+        children use fuel of their own as the interpreter visits them)."""
+        data = tree.data
+        if data == 'constant':
+            return 1
+        if data not in STATIC and data not in self.methods and hasattr(self.interpreter_class, data):
+            return fallback
+        branches = BRANCHES.get(data, ())
+        return 1 + sum(self.fuel(child, fallback) for i, child in enumerate(tree.children)
+                       if isinstance(child, Tree) and i not in branches)
+
+    def charged(self, tree: Tree) -> Closure:
+        """The closure for `tree`, using the fuel of `tree` whenever it runs."""
+        closure, fuel = self.compile(tree), self.fuel(tree)
+
+        def run(ip):
+            ip.burn(fuel)
+            return closure(ip)
+        return run
+
+    def enter(self, tree: Tree) -> Closure:
+        """`charged(tree)`, cached on `tree`: what the interpreter runs to visit it."""
+        try:
+            return tree.entry
+        except AttributeError:
+            tree.entry = entry = self.charged(tree)
+            return entry
+
+    def compile_children(self, tree: Tree) -> list[Closure]:
+        """Closures for each child, in order. Tokens evaluate to themselves, as they
+        do in `visit_children`."""
+        return [self.compile(c) if isinstance(c, Tree) else self.token(c) for c in tree.children]
+
+    def static_value(self, tree: Tree) -> tuple[bool, Any]:
+        while tree.data not in STATIC and not hasattr(self.interpreter_class, tree.data):
+            if not tree.children or not isinstance(tree.children[0], Tree):
+                return False, None
+            tree = tree.children[0]
+        if tree.data not in STATIC:
+            return False, None
+        try:
+            return True, getattr(self.interpreter_class, tree.data)(tree)
+        except Exception:
+            return False, None
+
+    @staticmethod
+    def token(token: Token) -> Closure:
+        return lambda ip: token
+
+    @staticmethod
+    def fallback(tree: Tree) -> Closure:
+        name = tree.data
+        return lambda ip: getattr(ip, name)(tree)
+
+    def static(self, tree: Tree) -> Closure:
+        known, value = self.static_value(tree)
+        if not known:
+            return self.fallback(tree)
+        return lambda ip: value
+
+    @staticmethod
+    def constant(tree: Tree) -> Closure:
+        value, _, copy_value = tree.children
+        if copy_value is None:
+            return lambda ip: value
+        return lambda ip: copy_value(value)
+
+    def start(self, tree: Tree) -> Closure:
+        *statements, last = self.compile_children(tree)
+
+        def run(ip):
+            ip.call_stack.scope_push()
+            for statement in statements:
+                statement(ip)
+            out = last(ip)
+            ip.call_stack.scope_pop()
+            return out
+        return run
+
+    def block(self, tree: Tree) -> Closure:
+        # `begin` and `end` are kept as tokens; the value is that of the last statement.
+        *statements, last, _ = self.compile_children(tree)
+
+        def run(ip):
+            ip.call_stack.scope_push()
+            for statement in statements:
+                statement(ip)
+            out = last(ip)
+            ip.call_stack.scope_pop()
+            return out
+        return run
+
+    def if_block(self, tree: Tree) -> Closure:
+        _, condition, _, body = tree.children
+        condition, body = self.compile(condition), self.charged(body)
+        return lambda ip: body(ip) if condition(ip) else Undefined
+
+    def if_else_block(self, tree: Tree) -> Closure:
+        _, condition, _, if_body, _, else_body = tree.children
+        condition, if_body, else_body = self.compile(condition), self.charged(if_body), self.charged(else_body)
+        return lambda ip: if_body(ip) if condition(ip) else else_body(ip)
+
+    def if_ternary(self, tree: Tree) -> Closure:
+        if_action, _, condition, _, else_action = tree.children
+        condition, if_action, else_action = self.compile(condition), self.charged(if_action), self.charged(else_action)
+        return lambda ip: if_action(ip) if condition(ip) else else_action(ip)
+
+    def while_loop(self, tree: Tree) -> Closure:
+        _, condition, _, body = tree.children
+        test = self.fuel(condition)
+        fuel = test + self.fuel(body)
+        condition, body = self.compile(condition), self.compile(body)
+
+        def run(ip):
+            results = loop_results(tree)
+            try:
+                while condition(ip):
+                    try:
+                        results.append(body(ip))
+                    except Continue as c:
+                        if c:
+                            results.append(c)
+                    ip.burn(fuel)
+                ip.burn(test)
+            except Break as b:
+                if b:
+                    results.append(b.value)
+            return results
+        return run
+
+    def do_while_loop(self, tree: Tree) -> Closure:
+        _, body, _, condition = tree.children
+        test = self.fuel(condition)
+        fuel = test + self.fuel(body)
+        first, condition, body = self.charged(body), self.compile(condition), self.compile(body)
+
+        def run(ip):
+            results = loop_results(tree)
+            results.append(first(ip))
+            try:
+                while condition(ip):
+                    try:
+                        results.append(body(ip))
+                    except Continue as c:
+                        if c:
+                            results.append(c.value)
+                    ip.burn(fuel)
+                ip.burn(test)
+            except Break as b:
+                if b:
+                    results.append(b.value)
+            return results
+        return run
+
+    def for_loop(self, tree: Tree) -> Closure:
+        _, ident, _, iterable, _, body = tree.children
+        fuel = self.fuel(body)
+        ident, iterable, body = self.compile(ident), self.compile(iterable), self.compile(body)
+
+        def run(ip):
+            variable = loop_variable(ip, ident(ip))
+            results = loop_results(tree)
+            try:
+                for x in iterable(ip):
+                    variable.put(x)
+                    try:
+                        results.append(body(ip))
+                    except Continue as c:
+                        if c:
+                            results.append(c.value)
+                    ip.burn(fuel)
+            except Break as b:
+                if b:
+                    results.append(b.value)
+            return results
+        return run
+
+    def repetition(self, tree: Tree) -> Closure:
+        repeatable, _, repeats = tree.children
+        body, repeats = self.compile(repeatable), self.compile(repeats)
+        if self.batches.plan(repeatable) is None:
+            fuel = self.fuel(repeatable)
+
+            def run(ip):
+                results = []
+                memory.reserve(len(count := range(repeats(ip))) * memory.Pointer, 'repetition')
+                for _ in count:
+                    ip.burn(fuel)
+                    results.append(body(ip))
+                return results
+            return run
+        batches = self.batches
+        return lambda ip: batches.repeat(ip, repeatable, repeats(ip), body)
+
+    def dice(self, tree: Tree) -> Closure:
+        roll = DICE.get(tree.data) or ROLLS[tree.data]
+        as_sum = tree.data in DICE
+        # Operators are kept as tokens; the operands are the number of dice, of sides, and perhaps one more.
+        operands = [self.compile(c) for c in tree.children if isinstance(c, Tree)]
+        if len(operands) == 2:
+            dice, sides = operands
+            if as_sum:
+                return lambda ip: roll(dice(ip), sides(ip))
+            return lambda ip: roll(dice(ip), sides(ip), as_sum=False)
+        dice, sides, n = operands
+        if as_sum:
+            return lambda ip: roll(dice(ip), sides(ip), n(ip))
+        return lambda ip: roll(dice(ip), sides(ip), n(ip), as_sum=False)
+
+    def exponent(self, tree: Tree) -> Closure:
+        mantissa, superscript = self.compile_children(tree)
+        return lambda ip: ip._exponentiate(mantissa(ip), superscript(ip))
+
+    def binary(self, tree: Tree) -> Closure:
+        function = BINARY[tree.data]
+        left, right = self.compile_children(tree)
+        return lambda ip: function(left(ip), right(ip))
+
+    def unary(self, tree: Tree) -> Closure:
+        function = UNARY[tree.data]
+        operand = self.compile(tree.children[0])
+        return lambda ip: function(operand(ip))
+
+    def compare_math(self, tree: Tree) -> Closure:
+        comparisons = self.interpreter_class.comparison_ops
+        children = tree.children
+        operands = [self.compile(c) for c in children[::2]]
+        operators = [comparisons[c] for c in children[1::2]]
+        if len(operands) == 2:
+            (left, right), (compare,) = operands, operators
+            return lambda ip: True if compare(left(ip), right(ip)) else False
+
+        def run(ip):
+            # Every operand is evaluated before any comparison, as in the interpreter.
+            values = [operand(ip) for operand in operands]
+            return all(compare(a, b) for compare, a, b in zip(operators, values, values[1:]))
+        return run
+
+    def member_of(self, tree: Tree) -> Closure:
+        element, _, collection = self.compile_children(tree)
+        return lambda ip: element(ip) in collection(ip)
+
+    def member_of_negated(self, tree: Tree) -> Closure:
+        element, _, _, collection = self.compile_children(tree)
+        return lambda ip: element(ip) not in collection(ip)
+
+    def boolean_or(self, tree: Tree) -> Closure:
+        left, right = self.compile(tree.children[0]), self.charged(tree.children[1])
+        return lambda ip: left(ip) or right(ip)
+
+    def boolean_and(self, tree: Tree) -> Closure:
+        left, right = self.compile(tree.children[0]), self.charged(tree.children[1])
+        return lambda ip: left(ip) and right(ip)
+
+    def boolean_xor(self, tree: Tree) -> Closure:
+        operands = self.compile_children(tree)
+
+        def run(ip):
+            values = [operand(ip) for operand in operands]
+            return any(values) and not all(values)
+        return run
+
+    def boolean_not(self, tree: Tree) -> Closure:
+        operand = self.compile(tree.children[-1])
+        return lambda ip: not operand(ip)
+
+    @staticmethod
+    def list_empty(_) -> Closure:
+        return lambda ip: []
+
+    @staticmethod
+    def dict_empty(_) -> Closure:
+        return lambda ip: {}
+
+    def list_populated(self, tree: Tree) -> Closure:
+        items = self.compile_children(tree)
+        return lambda ip: [item(ip) for item in items]
+
+    def tuple_single(self, tree: Tree) -> Closure:
+        item = self.compile(tree.children[0])
+        return lambda ip: (item(ip),)
+
+    def tuple_multi(self, tree: Tree) -> Closure:
+        items = self.compile_children(tree)
+        return lambda ip: tuple(item(ip) for item in items)
+
+    def set_populated(self, tree: Tree) -> Closure:
+        items = self.compile_children(tree)
+        return lambda ip: {item(ip) for item in items}
+
+    def dict_populated(self, tree: Tree) -> Closure:
+        pairs = [self.compile_children(child) for child in tree.children]
+
+        def run(ip):
+            out = {}
+            for key, value in pairs:
+                k = key(ip)
+                out[k] = value(ip)
+            return out
+        return run
+
+    def subscript_bracket(self, tree: Tree) -> Closure:
+        bracketed = self.compile(tree.children[0])
+        return lambda ip: subscript(bracketed(ip))
+
+    def subscript_dot(self, tree: Tree) -> Closure:
+        name = self.compile(tree.children[0])
+        return lambda ip: Accessor.attr(name(ip)[-1])
+
+    def access(self, tree: Tree) -> Closure:
+        name, *accessors = self.compile_children(tree)
+        known, value = self.static_value(tree.children[0])
+        if not known or not isinstance(value, tuple) or (action := LOOKUPS.get(value[0])) is None:
+            return self.fallback(tree)
+        x = value[1]
+        if not accessors:
+            return lambda ip: action(ip.call_stack, ip.ownership, x)
+        return lambda ip: action(ip.call_stack, ip.ownership, x, *[accessor(ip) for accessor in accessors])
+
+    def retrieval(self, tree: Tree) -> Closure:
+        target = self.compile(tree.children[0])
+        return lambda ip: target(ip).get()
+
+    def retrieval_atomic(self, tree: Tree) -> Closure:
+        primary, *subscripts = self.compile_children(tree)
+
+        def run(ip):
+            target = primary(ip)
+            return retrieve(target, [accessor(ip) for accessor in subscripts])
+        return run
+
+    def function_call(self, tree: Tree) -> Closure:
+        callee, *rest = self.compile_children(tree)
+        arguments = rest[-1] if rest else None
+
+        def run(ip):
+            function = callee(ip)
+            return call(ip, function, arguments(ip) if arguments is not None else [])
+        return run
+
+    def arguments(self, tree: Tree) -> Closure:
+        arguments = self.compile_children(tree)
+        return lambda ip: [argument(ip) for argument in arguments]
+
+    def argument(self, tree: Tree) -> Closure:
+        parts = self.compile_children(tree)
+        if len(parts) == 1:
+            value, = parts
+            return lambda ip: utils.Argument(value(ip))
+        name, *_, value = parts
+
+        def run(ip):
+            key = name(ip)
+            return utils.Argument(value(ip), key[-1])
+        return run
+
+    def assignment_single(self, tree: Tree) -> Closure:
+        target, _, value = self.compile_children(tree)
+
+        def run(ip):
+            lval = target(ip)
+            return lval.put(value(ip))
+        return run
+
+    def augmented_any(self, tree: Tree) -> Closure:
+        target, _, augment = self.compile_children(tree)
+        if tree.children[1] == '**=':
+            def run(ip):
+                lval = target(ip)
+                return lval.put(ip._exponentiate(lval.get(), augment(ip)))
+            return run
+        function = self.interpreter_class.augments[tree.children[1]]
+
+        def run(ip):
+            lval = target(ip)
+            return lval.put(function(lval.get(), augment(ip)))
+        return run
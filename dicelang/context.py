@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from dicelang import memory, native, rng
+
+# The context of the execution running in this thread (or task), if any.
+current_context: ContextVar['ExecutionContext | None'] = ContextVar('context', default=None)
+current = current_context.get
+
+
+class ExecutionContext:
+    """The state of one execution: whose it is (`ownership`), the variables in its
+    scope (`call_stack`), what it has printed (`print_queue`), the memory it may
+    still allocate (`budget`) and the generator it rolls with (`generator`).
+
+    Executions in different contexts share nothing but the datastore, so an
+    interpreter can run any number of them at once, each in a thread of its own;
+    see `DicelangInterpreter.execute`. A context given no print queue, budget or
+    generator shares the ones in use where it is created. `interpreter` is the
+    interpreter running the execution, once one is forked for it."""
+
+    def __init__(self, ownership, call_stack, print_queue: native.PrintQueue | None = None,
+                 budget: memory.Budget | None = None, generator: rng.DiceRandom | None = None):
+        self.ownership = ownership
+        self.call_stack = call_stack
+        self.print_queue = print_queue or native.print_queue()
+        self.budget = budget or memory.current()
+        self.generator = generator or rng.current()
+        self.interpreter = None
+        call_stack.set_ownership(ownership)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.ownership!r}, budget={self.budget!r})'
+
+    @contextmanager
+    def entered(self) -> Iterator['ExecutionContext']:
+        """Print, allocate and roll as this context for the duration of the context
+        manager, in the current thread (or task) only."""
+        tokens = (native.current_print_queue.set(self.print_queue), memory.current_budget.set(self.budget),
+                  rng.current_generator.set(self.generator), current_context.set(self))
+        try:
+            yield self
+        finally:
+            for token in tokens:
+                token.var.reset(token)
+            self.call_stack.reset()
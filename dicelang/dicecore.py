@@ -1,8 +1,29 @@
 from enum import IntEnum
-import random
-from dicelang.exceptions import ImpossibleDice
+from itertools import chain, repeat
+from typing import Iterator
+import heapq
+import math
+from dicelang import memory, rng
+from dicelang.alias import SumTables
+from dicelang.exceptions import ExcessiveSize, ImpossibleDice
 RollResult = int | list[int]
 
+# Pools of at least `CountingFactor` dice per side are rolled by counting faces.
+CountingFactor = 8
+# Dice are kept or dropped with a heap rather than by sorting the pool when the
+# heap would hold at most one in `SelectionFactor` dice.
+SelectionFactor = 16
+# Exploding dice explode at most `MaxExplosions` times in a row, and a pool that
+# explodes or rerolls may roll at most `PoolBudget` dice in all.
+MaxExplosions = 100
+PoolBudget = 1 << 22
+# Pools that are only selected from are rolled `RollBlock` dice at a time.
+RollBlock = 1 << 16
+
+# Sums of small pools that are rolled repeatedly are drawn from their exact
+# distributions, with one random number rather than one per die.
+sum_tables = SumTables()
+
 
 class Mode(IntEnum):
     """Dice-rolling modes:
@@ -21,14 +42,40 @@ class Target(IntEnum):
     HIGHEST = 1
 
 
-def kernel(dice: int, sides: int, n: int = 1, mode: Mode = Mode.KEEP, target: Target = Target.ALL, as_sum: bool = True) -> RollResult:
+def check(dice: int, n: int, mode: Mode) -> None:
     if mode is Mode.KEEP and n > dice or mode is Mode.DROP and n >= dice:
         raise ImpossibleDice(f'tried to {"keep" if mode else "drop"} {n} {"die" if n == 1 else "dice"}'
                              + f' from {dice} {"die" if dice == 1 else "dice"} rolled.')
     if n < 1:
         raise ImpossibleDice(f'tried to {"keep" if mode else "drop"} non-positive number of dice ({n})')
 
-    rolls = sorted(random.randint(1, sides) for _ in range(dice))
+
+def kernel(dice: int, sides: int, n: int = 1, mode: Mode = Mode.KEEP, target: Target = Target.ALL, as_sum: bool = True) -> RollResult:
+    check(dice, n, mode)
+
+    if as_sum and (total := sum_tables.draw(dice, sides, n, mode, target)) is not None:
+        return total
+
+    if type(dice) is int and type(sides) is int and 0 < sides * CountingFactor <= dice:
+        if not as_sum:
+            memory.reserve(dice * memory.Pointer, 'dice pool')
+        return counted(dice, sides, n, mode, target, as_sum)
+
+    if type(dice) is int:
+        # Rolls of dice with more sides than there are cached small ints are int objects of their own.
+        memory.reserve(dice * (memory.Pointer + (memory.Int if type(sides) is int and sides > 256 else 0)), 'dice pool')
+
+    if target is Target.ALL:
+        if as_sum:
+            return sum(rng.current().rolls(sides, dice))
+    elif min(n, dice - n) * SelectionFactor <= dice:
+        return selected(dice, sides, n, mode, target, as_sum)
+    return sorting(dice, sides, n, mode, target, as_sum)
+
+
+def sorting(dice: int, sides: int, n: int, mode: Mode, target: Target, as_sum: bool) -> RollResult:
+    """`kernel` by rolling every die and sorting the whole pool."""
+    rolls = sorted(rng.current().rolls(sides, dice))
     match (mode, target):
         case Mode.KEEP, Target.LOWEST:
             rolls = rolls[:n]
@@ -38,10 +85,79 @@ def kernel(dice: int, sides: int, n: int = 1, mode: Mode = Mode.KEEP, target: Ta
             rolls = rolls[-n:]
         case Mode.DROP, Target.HIGHEST:
             rolls = rolls[:-n]
-
     return sum(rolls) if as_sum else rolls
 
 
+def selected(dice: int, sides: int, n: int, mode: Mode, target: Target, as_sum: bool) -> RollResult:
+    """`kernel` for keeping or dropping dice by selecting them with a bounded heap
+    as they are rolled, in O(dice log n) time. Sums hold only the smaller of the
+    kept and dropped dice, so `500d20kh3` never keeps more than 3 rolls, and the
+    rolls are streamed in blocks rather than held all at once."""
+    rolls = streamed(dice, sides)
+    keep = n if mode is Mode.KEEP else dice - n
+    highest = (target is Target.HIGHEST) == (mode is Mode.KEEP)
+    if not as_sum:
+        return heapq.nlargest(keep, rolls)[::-1] if highest else heapq.nsmallest(keep, rolls)
+    if keep <= dice - keep:
+        return sum(heapq.nlargest(keep, rolls) if highest else heapq.nsmallest(keep, rolls))
+    total = 0
+
+    def tally():
+        nonlocal total
+        for roll in rolls:
+            total += roll
+            yield roll
+    dropped = heapq.nsmallest(dice - keep, tally()) if highest else heapq.nlargest(dice - keep, tally())
+    return total - sum(dropped)
+
+
+def streamed(dice: int, sides: int) -> Iterator[int]:
+    """The rolls of `dice` dice, rolled `RollBlock` at a time."""
+    for start in range(0, dice, RollBlock):
+        yield from rng.current().rolls(sides, min(RollBlock, dice - start))
+
+
+def face_counts(dice: int, sides: int) -> list[int]:
+    """Roll `dice` dice and count how many land on each face. Each count is drawn
+    from a binomial distribution over the dice not counted yet, which gives the
+    same distribution as tallying the rolls one by one in O(sides) time."""
+    counts = []
+    remaining = dice
+    for face in range(1, sides):
+        count = rng.current().binomialvariate(remaining, 1 / (sides - face + 1)) if remaining else 0
+        counts.append(count)
+        remaining -= count
+    counts.append(remaining)
+    return counts
+
+
+def lowest(counts: list[int], n: int) -> list[int]:
+    """The counts of the `n` lowest dice in a tally of faces."""
+    kept = []
+    for count in counts:
+        kept.append(min(count, n))
+        n -= kept[-1]
+    return kept
+
+
+def counted(dice: int, sides: int, n: int, mode: Mode, target: Target, as_sum: bool) -> RollResult:
+    """`kernel` for large pools, keeping and dropping dice by face counts instead
+    of sorting the individual rolls."""
+    counts = face_counts(dice, sides)
+    match (mode, target):
+        case Mode.KEEP, Target.LOWEST:
+            counts = lowest(counts, n)
+        case Mode.DROP, Target.LOWEST:
+            counts = lowest(counts[::-1], dice - n)[::-1]
+        case Mode.KEEP, Target.HIGHEST:
+            counts = lowest(counts[::-1], n)[::-1]
+        case Mode.DROP, Target.HIGHEST:
+            counts = lowest(counts, dice - n)
+    if as_sum:
+        return sum(face * count for face, count in enumerate(counts, 1))
+    return list(chain.from_iterable(repeat(face, count) for face, count in enumerate(counts, 1)))
+
+
 def keep_all(dice: int, sides: int, as_sum: bool = True) -> RollResult:
     return kernel(dice, sides, as_sum=as_sum)
 
@@ -56,3 +172,85 @@ def drop_highest(dice: int, sides: int, n: int, as_sum: bool = True) -> RollResu
 
 def drop_lowest(dice: int, sides: int, n: int, as_sum: bool = True) -> RollResult:
     return kernel(dice, sides, n, mode=Mode.DROP, target=Target.LOWEST, as_sum=as_sum)
+
+
+def budget(rolled: int) -> None:
+    if rolled > PoolBudget:
+        raise ExcessiveSize(f'tried to roll more than {PoolBudget} dice in one pool')
+
+
+def explosions(dice: int, sides: int) -> Iterator[bytes | list[int]]:
+    """The waves of rolls of an exploding pool: one roll of every die, then one
+    more roll for each roll of the previous wave that landed on the highest face."""
+    check(dice, 1, Mode.KEEP)
+    if sides < 2:
+        raise ImpossibleDice(f'tried to explode dice with {sides} {"side" if sides == 1 else "sides"}')
+    count, rolled = dice, 0
+    for _ in range(MaxExplosions + 1):
+        budget(rolled := rolled + count)
+        wave = rng.current().rolls(sides, count)
+        yield wave
+        if not (count := wave.count(sides)):
+            return
+
+
+def tally(rolls: bytes | list[int], low: int, high: int) -> int:
+    """How many of `rolls` are from `low` to `high`, inclusive."""
+    if isinstance(rolls, bytes):
+        return sum(map(rolls.count, range(max(low, 1), min(high, 255) + 1)))
+    return sum(1 for roll in rolls if low <= roll <= high)
+
+
+def explode(dice: int, sides: int, as_sum: bool = True) -> RollResult:
+    """Roll `dice` dice, and another die for every one that lands on its highest
+    face. Rolls are listed in the order they were rolled."""
+    waves = explosions(dice, sides)
+    if as_sum:
+        return sum(map(sum, waves))
+    return list(chain.from_iterable(waves))
+
+
+def compound(dice: int, sides: int, as_sum: bool = True) -> RollResult:
+    """Like `explode`, except that the extra rolls are added to the die they came from."""
+    if as_sum:
+        return explode(dice, sides)
+    waves = explosions(dice, sides)
+    totals = list(next(waves))
+    exploded = [i for i, roll in enumerate(totals) if roll == sides]
+    for wave in waves:
+        for i, roll in zip(exploded, wave):
+            totals[i] += roll
+        exploded = [i for i, roll in zip(exploded, wave) if roll == sides]
+    return totals
+
+
+def reroll_below(dice: int, sides: int, below: int, as_sum: bool = True) -> RollResult:
+    """Roll `dice` dice, rolling each one that lands below `below` once more and
+    keeping the new roll."""
+    check(dice, 1, Mode.KEEP)
+    budget(dice)
+    rolls = rng.current().rolls(sides, dice)
+    budget(dice + (count := tally(rolls, 1, below - 1)))
+    rerolls = rng.current().rolls(sides, count)
+    if as_sum:
+        return sum(roll for roll in rolls if roll >= below) + sum(rerolls)
+    rerolls = iter(rerolls)
+    return [roll if roll >= below else next(rerolls) for roll in rolls]
+
+
+def count_successes(dice: int, sides: int, threshold: int) -> int:
+    """How many of `dice` dice land on `threshold` or higher. Each die does so
+    with the same chance, so the count is drawn from a binomial distribution, as
+    in `face_counts`, without rolling (or holding) the dice one by one."""
+    check(dice, 1, Mode.KEEP)
+    if type(dice) is int and type(sides) is int and sides > 0:
+        successes = min(max(sides - math.ceil(threshold) + 1, 0), sides)
+        return rng.current().binomialvariate(dice, successes / sides)
+    if type(dice) is int:
+        memory.reserve(dice * memory.Pointer, 'dice pool')
+    return tally(rng.current().rolls(sides, dice), threshold, sides)
+
+
+def count_exploding_successes(dice: int, sides: int, threshold: int) -> int:
+    """How many rolls of an exploding pool land on `threshold` or higher."""
+    return sum(tally(wave, threshold, sides) for wave in explosions(dice, sides))
@@ -0,0 +1,322 @@
+import itertools
+import math
+import operator
+from collections import defaultdict
+from fractions import Fraction
+from typing import Any, Callable, Iterable
+
+from lark import Tree
+from lark.visitors import Interpreter
+
+from dicelang import context, ops
+from dicelang.dicecore import Mode, Target, check, sum_tables
+from dicelang.exceptions import BadArguments, ExcessiveSize, ImpossibleDice
+from dicelang.optimizer import is_pure
+from dicelang.parser import parser
+from dicelang.user_function import UserFunction
+
+Weights = dict[Any, int]
+
+# Limits on exact computation: the number of joint outcomes of independent
+# operands, the size in bits of the integers used to convolve sums, and the
+# steps taken to count the outcomes of keeping or dropping dice (a second or so).
+MaxOutcomes = 1 << 16
+MaxWeightBits = 1 << 23
+MaxSelectionSteps = 1 << 24
+
+_DICE = {'die_binary': (Mode.KEEP, Target.ALL), 'die_ternary_keep_high': (Mode.KEEP, Target.HIGHEST),
+         'die_ternary_keep_low': (Mode.KEEP, Target.LOWEST), 'die_ternary_drop_high': (Mode.DROP, Target.HIGHEST),
+         'die_ternary_drop_low': (Mode.DROP, Target.LOWEST)}
+_BINARY = {'multiplication': ops.multiply, 'division': ops.divide, 'integer_division': operator.floordiv,
+           'remainder': operator.mod}
+_UNARY = {'unary_minus': ops.negate, 'unary_plus': ops.positive}
+
+
+def pack(weights: dict[int, int], low: int, span: int, width: int) -> int:
+    data = bytearray(span * width)
+    for value, weight in weights.items():
+        offset = (value - low) * width
+        data[offset:offset + width] = weight.to_bytes(width, 'little')
+    return int.from_bytes(data, 'little')
+
+
+def convolve(a: dict[int, int], b: dict[int, int]) -> dict[int, int]:
+    """Weights of the sum of two independent integer outcomes. Their generating
+    polynomials are packed into integers, one fixed-width field per coefficient,
+    so that a single big-integer product multiplies them (Kronecker substitution)."""
+    low_a, low_b = min(a), min(b)
+    span_a, span_b = max(a) - low_a + 1, max(b) - low_b + 1
+    span = span_a + span_b - 1
+    width = ((sum(a.values()) * sum(b.values())).bit_length() + 7) // 8
+    if span * width * 8 > MaxWeightBits:
+        raise BadArguments('too many outcomes to compute exactly')
+    product = pack(a, low_a, span_a, width) * pack(b, low_b, span_b, width)
+    data = product.to_bytes(span * width, 'little')
+    low = low_a + low_b
+    return {low + i: weight for i in range(span)
+            if (weight := int.from_bytes(data[i * width:(i + 1) * width], 'little'))}
+
+
+def sums(dice: int, sides: int) -> dict[int, int]:
+    """Weights of the sum of `dice` dice with `sides` sides each."""
+    result, power = {0: 1}, dict.fromkeys(range(1, sides + 1), 1)
+    while dice:
+        if dice & 1:
+            result = convolve(result, power)
+        dice >>= 1
+        if dice:
+            power = convolve(power, power)
+    return result
+
+
+def burn(fuel: int) -> None:
+    """Charge `fuel` to the running execution, if any, which stops it once it is
+    over its limits."""
+    if (running := context.current()) is not None and running.interpreter is not None:
+        running.interpreter.burn(fuel)
+
+
+def steps(dice: int, sides: int, k: int, selected: bool) -> int:
+    """Roughly the steps `select` takes for each of its partial outcomes (of which
+    there are about `k * k * sides`) at each face."""
+    return k if selected else dice * dice * sides // 4
+
+
+def select(dice: int, sides: int, k: int, highest: bool, selected: bool) -> dict[int, int]:
+    """Weights of the sum of the `k` highest (or lowest) of `dice` dice if
+    `selected`, otherwise of the other `dice - k` dice.
+
+    Faces are assigned to dice from the highest down (or the lowest up). Until
+    `k` dice have a face, all of them are selected, so a partial outcome is only
+    how many dice have a face and their sum. Once the `k`-th die has one, the
+    remaining dice can show any face not reached yet, and are counted at once."""
+    if dice * sides.bit_length() > MaxWeightBits:
+        raise BadArguments('too many outcomes to compute exactly')
+    step = steps(dice, sides, k, selected)
+    if (total_steps := sides * k * k * sides * step) > MaxSelectionSteps:
+        raise ExcessiveSize(f'about {total_steps:,} steps to compute exactly (limit: {MaxSelectionSteps:,})')
+    result = defaultdict(int)
+    active = {(0, 0): 1}
+    for face in range(sides, 0, -1) if highest else range(1, sides + 1):
+        burn(len(active) * step)
+        beyond = face - 1 if highest else sides - face
+        following = defaultdict(int)
+        for (assigned, total), weight in active.items():
+            free, need = dice - assigned, k - assigned
+            partial = 0
+            for count in range(min(need, free + 1)):
+                following[assigned + count, total + count * face] += weight * math.comb(free, count)
+                partial += math.comb(free, count) * beyond ** (free - count)
+            if selected:
+                result[total + need * face] += weight * ((beyond + 1) ** free - partial)
+                continue
+            # The unselected dice are the `count - need` others showing `face` and the rest.
+            rest = {0: 1}
+            for count in range(free, need - 1, -1):
+                shift = (count - need) * face + (0 if highest else (free - count) * face)
+                for value, w in rest.items():
+                    result[shift + value] += weight * math.comb(free, count) * w
+                rest = convolve(rest, dict.fromkeys(range(1, beyond + 1), 1)) if beyond else {}
+                if not rest:
+                    break
+        active = following
+    return result
+
+
+def pool(dice: int, sides: int, n: int, mode: Mode, target: Target) -> dict[int, int]:
+    """Weights of the sum of a roll of `dice` dice, keeping or dropping `n` as in
+    `dicecore.kernel`. Only the smaller of the kept and dropped dice are selected."""
+    check(dice, n, mode)
+    if sides < 1:
+        raise ImpossibleDice(f'tried to roll dice with {sides} sides')
+    keep = n if mode is Mode.KEEP else dice - n
+    if target is Target.ALL or keep == dice:
+        return sums(dice, sides)
+    highest = (target is Target.HIGHEST) == (mode is Mode.KEEP)
+    if keep <= dice - keep:
+        return select(dice, sides, keep, highest, selected=True)
+    return select(dice, sides, dice - keep, not highest, selected=False)
+
+
+# `dicecore` can't import this module, which imports it, so its alias tables are given their weights here.
+sum_tables.weigh = pool
+
+
+class Distribution:
+    """The exact distribution of a random expression, as integer weights: how
+    many of the equally likely rolls lead to each outcome."""
+
+    def __init__(self, weights: Weights):
+        self.weights = {value: weight for value, weight in weights.items() if weight}
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.weights!r})'
+
+    @classmethod
+    def constant(cls, value: Any) -> 'Distribution':
+        return cls({value: 1})
+
+    @classmethod
+    def joint(cls, distributions: Iterable['Distribution'], function: Callable) -> 'Distribution':
+        """The distribution of `function` applied to independent outcomes of each
+        of `distributions`."""
+        distributions = list(distributions)
+        if (size := math.prod(len(d.weights) for d in distributions)) > MaxOutcomes:
+            raise BadArguments(f'too many outcomes to compute exactly ({size})')
+        burn(size)
+        result = defaultdict(int)
+        for outcome in itertools.product(*(d.weights.items() for d in distributions)):
+            values, weights = zip(*outcome)
+            result[function(*values)] += math.prod(weights)
+        return cls(result)
+
+    @property
+    def total(self) -> int:
+        return sum(self.weights.values())
+
+    def is_constant(self) -> bool:
+        return len(self.weights) == 1
+
+    def is_integral(self) -> bool:
+        return all(type(value) is int for value in self.weights)
+
+    def probabilities(self) -> dict:
+        total = self.total
+        return {value: weight / total for value, weight in sorted(self.weights.items())}
+
+    def probability(self) -> float:
+        """The probability that the outcome is truthy, e.g. that a comparison holds."""
+        return sum(weight for value, weight in self.weights.items() if value) / self.total
+
+    def mean(self):
+        return sum(value * weight for value, weight in self.weights.items()) / self.total
+
+    def percentile(self, p) -> Any:
+        """The lowest outcome that at least `p` percent of outcomes are less than or equal to."""
+        if not 0 <= p <= 100:
+            raise BadArguments(f'percentile must be between 0 and 100, not {p}')
+        threshold = Fraction(p) / 100 * self.total
+        cumulative = 0
+        for value, weight in sorted(self.weights.items()):
+            cumulative += weight
+            if cumulative >= threshold:
+                return value
+
+
+class DistributionInterpreter(Interpreter):
+    """Evaluates dice expressions to their exact `Distribution` instead of rolling
+    them. Sums are convolved, keep and drop are counted by order statistics, and
+    independent operands of other operators and comparisons are combined outcome
+    by outcome. Subtrees without randomness are evaluated by the interpreter of the
+    running execution, under its limits, or by `evaluator` outside of one, so
+    they mean exactly what they do elsewhere."""
+    evaluator = None
+
+    def interpreter(self):
+        if (running := context.current()) is not None and running.interpreter is not None:
+            return running.interpreter
+        return self.evaluator
+
+    def evaluate(self, expression: str | UserFunction) -> Distribution:
+        """Accepts Dicelang source or a function taking no arguments."""
+        if isinstance(expression, UserFunction):
+            if expression.params:
+                raise BadArguments('expected a function taking no arguments')
+            return self.visit(expression.code.children[0])
+        if isinstance(expression, str):
+            return self.visit(parser.parse_flattened(expression))
+        raise BadArguments(f'expected an expression as a string or function, not {type(expression).__name__}')
+
+    def visit(self, tree: Tree) -> Distribution:
+        burn(1)
+        if is_pure(tree):
+            return Distribution.constant(self.interpreter().visit(tree))
+        return super().visit(tree)
+
+    def __default__(self, tree):
+        if not hasattr(type(self.evaluator), tree.data) and len(tree.children) == 1:
+            return self.visit(tree.children[0])
+        raise BadArguments(f"can't compute the distribution of {tree.data.replace('_', ' ')}")
+
+    def start(self, tree):
+        if len(tree.children) != 1:
+            raise BadArguments('expected a single expression')
+        return self.visit(tree.children[0])
+
+    def operands(self, tree) -> list[Distribution]:
+        return [self.visit(c) for c in tree.children if isinstance(c, Tree)]
+
+    def whole(self, tree) -> int:
+        distribution = self.visit(tree)
+        if not distribution.is_constant() or type(value := next(iter(distribution.weights))) is not int:
+            raise BadArguments('the numbers of dice, sides and dice kept or dropped must be constant integers')
+        return value
+
+    def dice(self, tree):
+        dice, sides, *n = [self.whole(c) for c in tree.children if isinstance(c, Tree)]
+        return Distribution(pool(dice, sides, *n or [1], *_DICE[tree.data]))
+
+    die_binary = die_ternary_keep_high = die_ternary_keep_low = dice
+    die_ternary_drop_high = die_ternary_drop_low = dice
+
+    def addition(self, tree):
+        left, right = self.operands(tree)
+        if left.is_integral() and right.is_integral():
+            return Distribution(convolve(left.weights, right.weights))
+        return Distribution.joint((left, right), ops.add)
+
+    def subtraction(self, tree):
+        left, right = self.operands(tree)
+        if left.is_integral() and right.is_integral():
+            return Distribution(convolve(left.weights, {-value: w for value, w in right.weights.items()}))
+        return Distribution.joint((left, right), ops.subtract)
+
+    def binary(self, tree):
+        return Distribution.joint(self.operands(tree), _BINARY[tree.data])
+
+    multiplication = division = integer_division = remainder = binary
+
+    def unary(self, tree):
+        return Distribution.joint(self.operands(tree), _UNARY[tree.data])
+
+    unary_minus = unary_plus = unary
+
+    def compare_math(self, tree):
+        comparisons = [self.evaluator.comparison_ops[op] for op in tree.children[1::2]]
+
+        def compare(*values):
+            return all(c(a, b) for c, a, b in zip(comparisons, values, values[1:]))
+        return Distribution.joint(self.operands(tree), compare)
+
+    def boolean_and(self, tree):
+        return Distribution.joint(self.operands(tree), lambda a, b: a and b)
+
+    def boolean_or(self, tree):
+        return Distribution.joint(self.operands(tree), lambda a, b: a or b)
+
+    def boolean_not(self, tree):
+        return Distribution.joint([self.visit(tree.children[-1])], operator.not_)
+
+
+distributions = DistributionInterpreter()
+
+
+def dist(expression: str | UserFunction) -> dict:
+    """The exact probability of each outcome of a dice expression, e.g. `dist("4d6kh3")`."""
+    return distributions.evaluate(expression).probabilities()
+
+
+def prob(expression: str | UserFunction) -> float:
+    """The exact probability that a dice expression is true, e.g. `prob("1d20 + 5 >= 15")`."""
+    return distributions.evaluate(expression).probability()
+
+
+def mean(expression: str | UserFunction):
+    """The expected value of a dice expression, e.g. `mean("2d6 + 3")`."""
+    return distributions.evaluate(expression).mean()
+
+
+def percentile(expression: str | UserFunction, p):
+    """The lowest outcome of a dice expression at or above `p` percent of outcomes,
+    e.g. `percentile("3d6", 50)`."""
+    return distributions.evaluate(expression).percentile(p)
@@ -93,6 +93,15 @@ class ExcessiveRuntime(DicelangRuntimeError):
     pass
 
 
+class ExcessiveSize(DicelangRuntimeError):
+    pass
+
+
+class WorkerLost(DicelangRuntimeError):
+    """The process running a command exited without returning its result."""
+    pass
+
+
 class DuplicateParameter(DicelangRuntimeError):
     pass
 
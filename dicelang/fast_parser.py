@@ -0,0 +1,284 @@
+import copy
+import re
+import threading
+from lark import Lark, Token, Tree
+
+
+class Unsupported(Exception):
+    """Raised when source text falls outside the subset handled by `FastParser`.
+    The caller is expected to retry with the Earley kernel."""
+    pass
+
+
+_ARITHM_OPS = {'+': 'addition', '-': 'subtraction', '$': 'catenation'}
+_TERM_OPS = {'*': 'multiplication', '/': 'division', '//': 'integer_division', '%': 'remainder',
+             '<<': 'left_shift', '>>': 'right_shift'}
+_FACTOR_OPS = {'-': 'unary_minus', '+': 'unary_plus', '~': 'bit_not'}
+_COMPARISON_OPS = ('>', '<', '>=', '<=', '==', '!=')
+_DICE_OPS = {('d', None): 'die_binary', ('r', None): 'roll_binary',
+             ('d', 'kh'): 'die_ternary_keep_high', ('d', 'xh'): 'die_ternary_drop_high',
+             ('d', 'kl'): 'die_ternary_keep_low', ('d', 'xl'): 'die_ternary_drop_low',
+             ('r', 'kh'): 'roll_ternary_keep_high', ('r', 'xh'): 'roll_ternary_drop_high',
+             ('r', 'kl'): 'roll_ternary_keep_low', ('r', 'xl'): 'roll_ternary_drop_low'}
+_NUMBER_TERMINALS = ('LIT_INT_DEC', 'LIT_INT_HEX', 'LIT_REAL', 'LIT_COMPLEX')
+_STRING_TERMINALS = {'"': 'LIT_STRING_DOUBLE', "'": 'LIT_STRING_SINGLE'}
+_WORD_LITERALS = {'True': ('boolean', 'LIT_TRUE'), 'False': ('boolean', 'LIT_FALSE'),
+                  'Undefined': ('undefined', 'LIT_UNDEFINED'), 'nan': ('number', 'LIT_NAN'),
+                  'inf': ('number', 'LIT_INF')}
+
+_IGNORED = re.compile(r'(?:[ \t\f\r\n]+|#.*|`)*')
+_WORD = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_DICE_WORD = re.compile(r'(kh|xh|kl|xl|d|r)(?![A-Za-z_])')
+_PUNCTUATION = re.compile(r'->|\*\*=?|//=?|<<=?|>>=?|[<>=!]=|[-+*/%$&|^]=?|[<>=!~@&|^()\[\]{},;:.]')
+_OPERAND_ENDS = {'number', 'string', 'ident', 'literal', ')', ']'}
+
+
+class FastParser:
+    """Deterministic recursive-descent parser for the unambiguous core of Dicelang:
+    numbers, strings, booleans, identifiers, dice, arithmetic, comparisons, lists,
+    subscripts and calls.
+
+    It produces exactly the tree the Earley `kernel` would, and raises
+    `Unsupported` for everything else (including malformed input), so that
+    error reporting is always left to the kernel."""
+
+    def __init__(self, kernel: Lark):
+        terminals = {t.name: t for t in kernel.terminals}
+        anonymous = {t.pattern.value: t.name for t in kernel.terminals if t.pattern.type == 're'}
+        self.patterns = {name: re.compile(terminals[name].pattern.to_regexp())
+                         for name in (*_NUMBER_TERMINALS, *_STRING_TERMINALS.values(), 'IDENT')}
+        self.anonymous = {op: anonymous[op] for op in (*_COMPARISON_OPS, 'd', 'r', 'kh', 'xh', 'kl', 'xl')}
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+
+    def parse(self, code: str) -> Tree:
+        # Each call reads its tokens with a copy of the parser of its own, so threads can parse at once.
+        parsing = copy.copy(self)
+        try:
+            parsing.tokens = self.tokenize(code)
+            parsing.index = 0
+            tree = parsing.start()
+        except Unsupported:
+            with self.lock:
+                self.rejected += 1
+            raise
+        with self.lock:
+            self.accepted += 1
+        return tree
+
+    def tokenize(self, code: str) -> list[tuple[str, Token | Tree | str]]:
+        """Split `code` into (kind, value) pairs. Whether a word is an identifier or a
+        dice operator depends on whether it follows an operand, so lexing tracks that."""
+        tokens = []
+        pos, line, line_start, size = 0, 1, 0, len(code)
+        kind = None
+        while True:
+            skipped = _IGNORED.match(code, pos).end()
+            if newlines := code.count('\n', pos, skipped):
+                line += newlines
+                line_start = code.rindex('\n', pos, skipped) + 1
+            if (pos := skipped) >= size:
+                break
+            char = code[pos]
+            column = pos - line_start + 1
+            if kind not in _OPERAND_ENDS:
+                kind, value, end = self.operand(code, pos)
+            elif m := _DICE_WORD.match(code, pos):
+                kind, end = 'dice' if m.group() in 'dr' else 'keep', m.end()
+                value = Token(self.anonymous[m.group()], m.group())
+            elif m := _PUNCTUATION.match(code, pos):
+                kind = value = m.group()
+                end = m.end()
+                if kind in _COMPARISON_OPS:
+                    value = Token(self.anonymous[kind], kind)
+            else:
+                raise Unsupported(f'unexpected character {char!r}')
+            for leaf in (value.children if isinstance(value, Tree) else (value,)):
+                if isinstance(leaf, Token):
+                    leaf.start_pos, leaf.end_pos = pos, end
+                    leaf.line = leaf.end_line = line
+                    leaf.column, leaf.end_column = column, column + end - pos
+            tokens.append((kind, value))
+            pos = end
+        tokens.append(('$END', None))
+        return tokens
+
+    def operand(self, code: str, pos: int) -> tuple[str, Token | Tree | str, int]:
+        char = code[pos]
+        if char.isdigit() or char == '.' and code[pos + 1:pos + 2].isdigit():
+            best, type_ = None, None
+            for name in _NUMBER_TERMINALS:
+                if (m := self.patterns[name].match(code, pos)) and (best is None or m.end() > best.end()):
+                    best, type_ = m, name
+            if best.group().endswith('.'):
+                raise Unsupported('trailing decimal point')
+            return 'number', Token(type_, best.group()), best.end()
+        if char in _STRING_TERMINALS:
+            if not (m := self.patterns[type_ := _STRING_TERMINALS[char]].match(code, pos)):
+                raise Unsupported('unterminated string')
+            return 'string', Token(type_, m.group()), m.end()
+        if m := _WORD.match(code, pos):
+            word = m.group()
+            if word == 'R' and code[m.end():m.end() + 1] in _STRING_TERMINALS:
+                raise Unsupported('raw string')
+            if word in _WORD_LITERALS:
+                rule, type_ = _WORD_LITERALS[word]
+                return 'literal', Tree(rule, [Token(type_, word)]), m.end()
+            if (ident := self.patterns['IDENT'].match(code, pos)) and ident.end() == m.end():
+                return 'ident', Token('IDENT', word), m.end()
+            raise Unsupported(f'keyword {word!r}')
+        if m := _PUNCTUATION.match(code, pos):
+            return m.group(), m.group(), m.end()
+        raise Unsupported(f'unexpected character {char!r}')
+
+    def peek(self, offset: int = 0) -> str:
+        return self.tokens[self.index + offset][0]
+
+    def take(self, kind: str | None = None):
+        found, value = self.tokens[self.index]
+        if kind is not None and found != kind:
+            raise Unsupported(f'expected {kind!r}, found {found!r}')
+        self.index += 1
+        return value
+
+    def start(self) -> Tree:
+        statements = [self.expr()]
+        while self.peek() == ';':
+            self.take()
+            if self.peek() == '$END':
+                break
+            statements.append(self.expr())
+        self.take('$END')
+        return Tree('start', statements)
+
+    def expr(self) -> Tree:
+        return self.comparison()
+
+    def comparison(self) -> Tree:
+        node = self.arithm()
+        if self.peek() not in _COMPARISON_OPS:
+            return node
+        children = [node]
+        while self.peek() in _COMPARISON_OPS:
+            children.append(self.take())
+            children.append(self.arithm())
+        return Tree('compare_math', children)
+
+    def arithm(self) -> Tree:
+        node = self.term()
+        while (op := self.peek()) in _ARITHM_OPS:
+            self.take()
+            node = Tree(_ARITHM_OPS[op], [node, self.term()])
+        return node
+
+    def term(self) -> Tree:
+        node = self.factor()
+        while (op := self.peek()) in _TERM_OPS:
+            self.take()
+            node = Tree(_TERM_OPS[op], [node, self.factor()])
+        return node
+
+    def factor(self) -> Tree:
+        if (op := self.peek()) in _FACTOR_OPS:
+            self.take()
+            return Tree(_FACTOR_OPS[op], [self.factor()])
+        return self.power()
+
+    def power(self) -> Tree:
+        base = self.dice()
+        if self.peek() == '**':
+            self.take()
+            return Tree('exponent', [base, self.power()])
+        return base
+
+    def dice(self) -> Tree:
+        node = self.primary()
+        while self.peek() == 'dice':
+            operator = self.take()
+            children = [node, operator, self.primary()]
+            selector = None
+            if self.peek() == 'keep':
+                selector = self.take()
+                children.extend((selector, self.primary()))
+            node = Tree(_DICE_OPS[str(operator), selector and str(selector)], children)
+        return node
+
+    def primary(self) -> Tree:
+        node = Tree('primary', [self.atom()])
+        while True:
+            match self.peek():
+                case '(':
+                    self.take()
+                    if self.peek() == ')':
+                        self.take()
+                        node = Tree('function_call', [node])
+                        continue
+                    node = Tree('function_call', [node, self.arguments()])
+                    self.take(')')
+                case '[':
+                    self.take()
+                    subscript = Tree('subscript_bracket', [Tree('index_or_key', [self.expr()])])
+                    self.take(']')
+                    node = self.subscripted(node, subscript)
+                case '.':
+                    self.take()
+                    subscript = Tree('subscript_dot', [Tree('scoped_identifier', [self.take('ident')])])
+                    node = self.subscripted(node, subscript)
+                case _:
+                    return node
+
+    @staticmethod
+    def subscripted(node: Tree, subscript: Tree) -> Tree:
+        """Earley resolves `x.y.z` to either a single `retrieval_atomic` or nested
+        ones depending on hash seed; consecutive subscripts always share one node here."""
+        if node.data == 'retrieval_atomic':
+            node.children.append(subscript)
+            return node
+        return Tree('retrieval_atomic', [node, subscript])
+
+    def atom(self) -> Tree:
+        match self.peek():
+            case 'number':
+                return Tree('atom', [Tree('number', [self.take()])])
+            case 'string':
+                return Tree('atom', [Tree('string', [self.take()])])
+            case 'literal':
+                return Tree('atom', [self.take()])
+            case 'ident':
+                identifier = Tree('identifier', [Tree('scoped_identifier', [self.take()])])
+                return Tree('retrieval', [Tree('access', [identifier])])
+            case '(':
+                self.take()
+                inner = self.expr()
+                self.take(')')
+                return Tree('priority', [inner])
+            case '[':
+                self.take()
+                if self.peek() == ']':
+                    self.take()
+                    return Tree('atom', [Tree('list_empty', [])])
+                items = [self.expr()]
+                while self.peek() == ',':
+                    self.take()
+                    if self.peek() == ']':
+                        break
+                    items.append(self.expr())
+                self.take(']')
+                return Tree('atom', [Tree('list_populated', items)])
+            case found:
+                raise Unsupported(f'unexpected {found!r}')
+
+    def arguments(self) -> Tree:
+        arguments = [self.argument()]
+        while self.peek() == ',':
+            self.take()
+            arguments.append(self.argument())
+        return Tree('arguments', arguments)
+
+    def argument(self) -> Tree:
+        if self.peek() == 'ident' and self.peek(1) == '=':
+            name = Tree('scoped_identifier', [self.take()])
+            self.take()
+            return Tree('argument', [name, self.expr()])
+        return Tree('argument', [self.expr()])
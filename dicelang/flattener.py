@@ -6,10 +6,13 @@ def init_class(cls):
 
 @init_class
 class Flattener(lark.InlineTransformer):
+    """Collapses single-child passthrough rules. The grammar now inlines these
+    itself (`?rule`), so trees from `DicelangParser` are already flat; this is
+    kept for trees produced by older grammars."""
     passthrough_rules = {'dice', 'special', 'factor', 'power', 'term',
                          'arithm', 'bitwise_and', 'bitwise_or', 'bitwise_xor',
                          'comparison', 'logical_not', 'logical_and',
-                         'logical_xor', 'logical_or' 'repeat', 'flow',
+                         'logical_xor', 'logical_or', 'repeat', 'flow',
                          'inline_if', 'compound', 'flow_control', 'expr',
                          'assignment', 'augmented', 'conditional'}
 
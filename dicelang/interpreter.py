@@ -1,86 +1,197 @@
 import datetime
-import inspect
-import itertools
 import math
 import operator
-import random
+import os
+import time
 import traceback
 import sys
-from collections.abc import Iterable, Sequence
-from functools import partialmethod
-from numbers import Complex
 from typing import Hashable
 
 from lark.visitors import Interpreter
 
 from dicelang import dicecore
+from dicelang import memory
+from dicelang import native
 from dicelang import ops
 from dicelang import utils
 from dicelang import result
+from dicelang import rng
 from dicelang.exceptions import (BadLiteral, BadArguments, Break, Continue, DicelangSignal, Empty, Help,
                                  IllegalSignal, Impossible, InvalidSubscript, Return, Terminate,
-                                 ExcessiveRuntime)
+                                 ExcessiveRuntime, ExcessiveSize)
 from dicelang.lookup import Accessor, CallStack, IdentType, Lookup, Ownership
 from dicelang.special import Undefined
-from dicelang.native import PrintQueue
+from dicelang.bytecode import BytecodeCompiler
+from dicelang.compiler import ClosureCompiler
+from dicelang.context import ExecutionContext
+from dicelang.distribution import DistributionInterpreter
+from dicelang.optimizer import Optimizer, loop_results
+from dicelang.ranges import Range
 from dicelang.user_function import UserFunction
 
+# Integer powers of up to this many bits take milliseconds, so they skip the time limit checks.
+MaxUncheckedPowerBits = 1 << 18
+# The clock is read once this much fuel has been used since it last was, every few milliseconds.
+FuelCheckInterval = 1 << 12
+
 
 class DicelangInterpreter(Interpreter):
     default_owner = 'clotho'
     default_server = 'test'
-
-    def __init__(self, call_stack=None, time_limit_seconds: int | None = 15):
+    Engines = ('tree', 'closure')
+    default_engine = os.environ.get('DICELANG_ENGINE', 'tree')
+    max_power_bits = 1 << 22  # The largest integer power computed when limited, in bits
+
+    def __init__(self, call_stack=None, time_limit_seconds: float | None = 15, engine: str | None = None,
+                 fuel_limit: int | None = None, memory_limit: int | None = memory.DefaultBudget):
+        """`engine` selects how trees are evaluated: 'tree' walks them node by node,
+        'closure' compiles each node into a closure once and runs those. Both give
+        the same results; the default can be set with `DICELANG_ENGINE`.
+
+        Executions are limited to `time_limit_seconds` and, if given, `fuel_limit`
+        units of fuel. Fuel measures work done: a unit per node evaluated (which
+        compiled code uses a stretch of nodes at a time; see `ClosureCompiler`),
+        per user function called and per step of builtins that do a lot, such as
+        `mean`. Limits are checked as fuel is used, against a monotonic clock but
+        only every `FuelCheckInterval` units, so they hold everywhere at little
+        cost. Large results are limited to `memory_limit` bytes in all,
+        predicted before they are built; see `memory.Budget`.
+
+        Each execution runs in an `ExecutionContext` of its own, by a `fork` of the
+        interpreter, so one interpreter can run many executions at once from
+        different threads. Its `call_stack` only lends them its datastore."""
         self.call_stack = call_stack or CallStack()
         self.ownership = None
-        self.command_limit = datetime.timedelta(time_limit_seconds) if time_limit_seconds else None
-        self.start_time = None
-        self.limited = self.command_limit is not None
+        self.context = None
+        self.time_limit = time_limit_seconds or None
+        self.fuel_limit = fuel_limit
+        self.memory_limit = memory_limit
+        self.fuel = 0
+        self.checkpoint = FuelCheckInterval
+        self.started = None
+        self.deadline = None
+        self.limited = self.time_limit is not None or self.fuel_limit is not None
+        self.optimizer = Optimizer(self)
+        self.engine = engine or self.default_engine
+        match self.engine:
+            case 'tree':
+                pass
+            case 'closure':
+                self.visit = self.visit_compiled
+            case _:
+                raise ValueError(f'unknown engine {self.engine!r}; expected one of {self.Engines}')
 
         # XXX: Tight coupling, very bad, but it has to do for now
         if UserFunction.interpreter is None:
             UserFunction.interpreter = self
+        if DistributionInterpreter.evaluator is None:
+            DistributionInterpreter.evaluator = self
+
+    def visit(self, tree):
+        self.fuel += 1
+        if self.fuel >= self.checkpoint:
+            self.check_limits()
+        return getattr(self, tree.data)(tree)
+
+    def visit_compiled(self, tree):
+        return compiler.enter(tree)(self)
+
+    def fork(self, context: ExecutionContext) -> 'DicelangInterpreter':
+        """An interpreter for the execution in `context`, sharing the limits, optimizer
+        and compiled code of this one but counting its own fuel."""
+        # Not `copy.copy`, which would look up `__setstate__` and find `__default__`.
+        forked = object.__new__(self.__class__)
+        forked.__dict__.update(self.__dict__)
+        forked.context = context
+        context.interpreter = forked
+        forked.call_stack = context.call_stack
+        forked.ownership = context.ownership
+        if self.engine == 'closure':
+            forked.visit = forked.visit_compiled
+        return forked
 
     def execute_test(self, tree):
-        self.ownership = Ownership(user=self.default_owner, server=self.default_server)
-        try:
-            return self.visit(tree)
-        finally:
-            self.call_stack.reset()
-
-    def execute(self, tree, as_owner: str = 'clotho', on_server: str = 'test', in_channel: str = "default"):
-        try:
-            self.ownership = Ownership(user=as_owner, server=on_server, channel=in_channel)
-            self.call_stack.set_ownership(self.ownership)
-            self.start_time = datetime.datetime.now()
-            value = self.visit(tree)
-            r = result.success(value=value, console=PrintQueue.flush())
-            self.call_stack.datastore.put(itype=IdentType.USER, owner=self.ownership.user, value=value, name='_')
-            self.call_stack.datastore.put(itype=IdentType.SERVER, owner=self.ownership.server, value=value, name='_')
-            self.call_stack.datastore.put(itype=IdentType.PUBLIC, owner=self.default_owner, value=value, name='_')
-            self.call_stack.datastore.put(itype=IdentType.USER_SERVER, owner=f'{self.ownership.server}:{self.ownership.user}', value=value, name='_')
-            self.call_stack.datastore.put(itype=IdentType.CHANNEL, owner=self.ownership.channel, value=value, name='_')
-        except Terminate as term:
-            r = result.success(value=term.unwrap(), console=PrintQueue.flush())
-        except Help as e:
-            r = result.helptext(value=e)
-        except DicelangSignal as e:
-            error = IllegalSignal(f'{e.__class__.__name__} used outside of flow control context')
-            r = result.failure(error=error, console=PrintQueue.flush())
-        except Exception as e:
-            r = result.failure(error=f'{e.__class__.__name__}: {e!s}', console=PrintQueue.flush(), exc_type=e.__class__)
-            traceback.print_tb(e.__traceback__)
-        finally:
-            self.call_stack.reset()
-            self.start_time = None
+        """Runs `tree` with no time limit, letting its exceptions through, and
+        printing, allocating and rolling as whatever calls it does."""
+        ownership = Ownership(user=self.default_owner, server=self.default_server)
+        context = ExecutionContext(ownership, CallStack(self.call_stack.datastore))
+        ip = self.fork(context)
+        with context.entered():
+            ip.refuel(deadline=False)
+            return ip.visit(tree)
+
+    def execute(self, tree, as_owner: str = 'clotho', on_server: str = 'test', in_channel: str = "default",
+                seed: int | None = None):
+        """Runs `tree`, rolling with a generator seeded with `seed`. The seed is kept on
+        the result, so passing it back replays the execution exactly."""
+        ownership = Ownership(user=as_owner, server=on_server, channel=in_channel)
+        context = ExecutionContext(ownership, CallStack(self.call_stack.datastore), native.PrintQueue(),
+                                   memory.Budget(self.memory_limit), rng.DiceRandom(seed))
+        ip = self.fork(context)
+        console = context.print_queue.flush
+        datastore = context.call_stack.datastore
+        with context.entered():
+            try:
+                ip.refuel()
+                value = self.detached(ip.visit(tree))
+                r = result.success(value=value, console=console())
+                with datastore.lock:
+                    datastore.put(itype=IdentType.USER, owner=ownership.user, value=value, name='_')
+                    datastore.put(itype=IdentType.SERVER, owner=ownership.server, value=value, name='_')
+                    datastore.put(itype=IdentType.PUBLIC, owner=self.default_owner, value=value, name='_')
+                    datastore.put(itype=IdentType.USER_SERVER, owner=f'{ownership.server}:{ownership.user}', value=value, name='_')
+                    datastore.put(itype=IdentType.CHANNEL, owner=ownership.channel, value=value, name='_')
+            except Terminate as term:
+                r = result.success(value=self.detached(term.unwrap()), console=console())
+            except Help as e:
+                r = result.helptext(value=e)
+            except DicelangSignal as e:
+                error = IllegalSignal(f'{e.__class__.__name__} used outside of flow control context')
+                r = result.failure(error=error, console=console())
+            except Exception as e:
+                r = result.failure(error=f'{e.__class__.__name__}: {e!s}', console=console(), exc_type=e.__class__)
+                traceback.print_tb(e.__traceback__)
+        r.seed = context.generator.initial_seed
+        r.fuel = ip.fuel
+        r.allocated = context.budget.allocated
         return r
 
-    def check_excessive_runtime(self, action: str, limit=None):
-        if self.limited:
-            now = datetime.datetime.now()
-            delta = datetime.timedelta(limit) if limit else self.command_limit
-            if (tm := now - self.start_time) > delta:
-                raise ExcessiveRuntime(f'{tm.seconds} seconds to {action} (limit: {delta.seconds})')
+    @staticmethod
+    def detached(value):
+        """`value`, as it is returned from an execution. Results are shown once the
+        execution is over, so a lazy range becomes a list of its items while its
+        budget still applies; the range itself, which may be stored, stays lazy."""
+        return value.copy().materialize() if isinstance(value, Range) else value
+
+    def refuel(self, deadline: bool = True) -> None:
+        """Start counting fuel from zero and, if `deadline`, the time limit from now."""
+        self.fuel = 0
+        self.started = time.monotonic()
+        self.deadline = self.started + self.time_limit if deadline and self.time_limit is not None else None
+        self.checkpoint = self.next_checkpoint()
+
+    def next_checkpoint(self) -> int:
+        if self.fuel_limit is None:
+            return self.fuel + FuelCheckInterval
+        return min(self.fuel + FuelCheckInterval, self.fuel_limit + 1)
+
+    def burn(self, fuel: int) -> None:
+        """Use `fuel` units of fuel, checking the limits if enough has been used since
+        they were last checked."""
+        self.fuel += fuel
+        if self.fuel >= self.checkpoint:
+            self.check_limits()
+
+    def check_limits(self) -> None:
+        if self.context is None:
+            # Work done outside of executions, such as folding constants while parsing, is counted but not limited.
+            self.checkpoint = self.fuel + FuelCheckInterval
+            return
+        if self.fuel_limit is not None and self.fuel > self.fuel_limit:
+            raise ExcessiveRuntime(f'{self.fuel:,} units of fuel used to execute command (limit: {self.fuel_limit:,})')
+        if self.deadline is not None and (now := time.monotonic()) > self.deadline:
+            raise ExcessiveRuntime(f'{now - self.started:.1f} seconds to execute command (limit: {self.time_limit})')
+        self.checkpoint = self.next_checkpoint()
 
     def block(self, tree):
         self.call_stack.scope_push()
@@ -98,7 +209,7 @@ class DicelangInterpreter(Interpreter):
 
     def while_loop(self, tree):
         _, condition, _, body = tree.children
-        results = []
+        results = loop_results(tree)
         try:
             while self.visit(condition):
                 try:
@@ -106,7 +217,6 @@ class DicelangInterpreter(Interpreter):
                 except Continue as c:
                     if c:
                         results.append(c)
-                self.check_excessive_runtime("to execute command with loop")
         except Break as b:
             if b:
                 results.append(b.value)
@@ -114,7 +224,8 @@ class DicelangInterpreter(Interpreter):
 
     def do_while_loop(self, tree):
         _, body, _, condition = tree.children
-        results = [self.visit(body)]
+        results = loop_results(tree)
+        results.append(self.visit(body))
         try:
             while self.visit(condition):
                 try:
@@ -122,7 +233,6 @@ class DicelangInterpreter(Interpreter):
                 except Continue as c:
                     if c:
                         results.append(c.value)
-                self.check_excessive_runtime("to execute command with loop")
         except Break as b:
             if b:
                 results.append(b.value)
@@ -148,7 +258,7 @@ class DicelangInterpreter(Interpreter):
             case _:
                 raise Impossible(f"can't assign for loop variable {name}")
         loop_variable = action(self.call_stack, self.ownership, x)
-        results = []
+        results = loop_results(tree)
         try:
             for x in self.visit(iterable):
                 loop_variable.put(x)
@@ -157,7 +267,6 @@ class DicelangInterpreter(Interpreter):
                 except Continue as c:
                     if c:
                         results.append(c.value)
-                self.check_excessive_runtime("to execute command with loop")
         except Break as b:
             if b:
                 results.append(b.value)
@@ -177,7 +286,7 @@ class DicelangInterpreter(Interpreter):
 
     def repetition(self, tree):
         repeatable, _, repeats = tree.children
-        return [self.visit(repeatable) for _ in range(self.visit(repeats))]
+        return compiler.batches.repeat(self, repeatable, self.visit(repeats))
 
     def die_binary(self, tree):
         dice, _, sides = self.visit_children(tree)
@@ -219,120 +328,94 @@ class DicelangInterpreter(Interpreter):
         dice, _, sides, _, n = self.visit_children(tree)
         return dicecore.drop_lowest(dice, sides, n, as_sum=False)
 
+    def die_explode(self, tree):
+        dice, _, sides, _ = self.visit_children(tree)
+        return dicecore.explode(dice, sides)
+
+    def die_compound(self, tree):
+        dice, _, sides, _ = self.visit_children(tree)
+        return dicecore.compound(dice, sides)
+
+    def die_reroll(self, tree):
+        dice, _, sides, _, below = self.visit_children(tree)
+        return dicecore.reroll_below(dice, sides, below)
+
+    def die_successes(self, tree):
+        dice, _, sides, _, threshold = self.visit_children(tree)
+        return dicecore.count_successes(dice, sides, threshold)
+
+    def die_exploding_successes(self, tree):
+        dice, _, sides, _, _, threshold = self.visit_children(tree)
+        return dicecore.count_exploding_successes(dice, sides, threshold)
+
+    def roll_explode(self, tree):
+        dice, _, sides, _ = self.visit_children(tree)
+        return dicecore.explode(dice, sides, as_sum=False)
+
+    def roll_compound(self, tree):
+        dice, _, sides, _ = self.visit_children(tree)
+        return dicecore.compound(dice, sides, as_sum=False)
+
+    def roll_reroll(self, tree):
+        dice, _, sides, _, below = self.visit_children(tree)
+        return dicecore.reroll_below(dice, sides, below, as_sum=False)
+
     def exponent(self, tree):
-        mantissa, superscript = self.visit_children(tree)
-
-        # Large integer exponentiation can stall execution. Whenever a float or a negative
-        # exponent is involved, though, the limitations of floating point representation
-        # will keep this from hanging.
-        if self.limited and isinstance(mantissa, int) and isinstance(superscript, int):
-            if superscript >= 1000000:
-                product = 1
-                limit = datetime.timedelta(seconds=5)
-                while superscript > 0:
-                    product *= mantissa
-                    superscript -= 1
-                    self.check_excessive_runtime("to compute exponentiation", limit=limit)
-                return product
-        return mantissa ** superscript
+        return self._exponentiate(*self.visit_children(tree))
+
+    def _exponentiate(self, mantissa, superscript):
+        # Large integer exponentiation can stall execution. The size of an integer power
+        # is known before it is computed, so powers that are too large are refused at once,
+        # and the rest are computed by repeated squaring, checking the time limit between
+        # squarings. Whenever a float or a negative exponent is involved, though, the
+        # limitations of floating point representation will keep this from hanging.
+        if (not self.limited or not isinstance(mantissa, int) or not isinstance(superscript, int)
+                or superscript < 2 or -1 <= mantissa <= 1):
+            return mantissa ** superscript
+        bits = superscript * math.log2(abs(mantissa))
+        if bits > self.max_power_bits:
+            raise ExcessiveSize(f'integer power of about {bits:,.0f} bits (limit: {self.max_power_bits:,})')
+        if bits <= MaxUncheckedPowerBits:
+            return mantissa ** superscript
+        product = mantissa
+        for bit in bin(superscript)[3:]:
+            self.check_limits()
+            product *= product
+            if bit == '1':
+                product *= mantissa
+        return product
 
     def unary_minus(self, tree):
-        operand = self.visit(tree.children[0])
-        if isinstance(operand, Sequence):
-            return operand[::-1]
-        return -operand
+        return ops.negate(self.visit(tree.children[0]))
 
     def unary_plus(self, tree):
-        operand = self.visit_children(tree)[0]
-        if isinstance(operand, (int, float, complex)):
-            return +operand
-        return operand
+        return ops.positive(self.visit_children(tree)[0])
 
     def multiplication(self, tree):
-        multiplier, multiplicand = self.visit_children(tree)
-        if isinstance(multiplier, int) and isinstance(multiplicand, Sequence):
-            direction = utils.sign(multiplier)
-            return multiplicand[::direction] * abs(multiplier)
-        elif isinstance(multiplier, Sequence) and isinstance(multiplicand, int):
-            direction = utils.sign(multiplicand)
-            return multiplier[::direction] * abs(multiplicand)
-        return multiplier * multiplicand
+        return ops.multiply(*self.visit_children(tree))
 
     def division(self, tree):
-        dividend, divisor = self.visit_children(tree)
-        if isinstance(dividend, (list, tuple, set)):
-            if not isinstance(divisor, str) and isinstance(divisor, Iterable):
-                return type(dividend)(x for x in dividend if x not in divisor)
-            else:
-                return type(dividend)(x for x in dividend if x != divisor)
-        if isinstance(dividend, dict):
-            if not isinstance(divisor, str) and isinstance(divisor, Iterable):
-                return {k: v for k, v in dividend.items() if k not in divisor}
-            else:
-                return {k: v for k, v in dividend.items() if k != divisor}
-        if isinstance(dividend, str) and isinstance(divisor, str):
-            return dividend.replace(divisor, '')
-        return dividend / divisor
+        return ops.divide(*self.visit_children(tree))
 
     def integer_division(self, tree):
         dividend, divisor = self.visit_children(tree)
         return dividend // divisor
 
     def left_shift(self, tree):
-        bits, shift = self.visit_children(tree)
-        if isinstance(bits, (list, tuple)):
-            return bits + type(bits)([shift])
-        elif isinstance(bits, str):
-            return bits + str(shift)
-        return bits << shift
+        return ops.left_shift(*self.visit_children(tree))
 
     def right_shift(self, tree):
-        bits, shift = self.visit_children(tree)
-        if isinstance(bits, (list, tuple)):
-            return type(bits)([shift]) + bits
-        elif isinstance(bits, str):
-            return str(shift) + bits
-        return bits >> shift
+        return ops.right_shift(*self.visit_children(tree))
 
     def remainder(self, tree):
         dividend, divisor = self.visit_children(tree)
         return dividend % divisor
 
     def addition(self, tree):
-        addend, augend = self.visit_children(tree)
-        if isinstance(addend, dict) and isinstance(augend, dict):
-            return {**addend, **augend}
-        if utils.isvector(addend) and utils.isvector(augend):
-            return type(addend)(itertools.chain(addend, augend))
-        return addend + augend
+        return ops.add(*self.visit_children(tree))
 
     def subtraction(self, tree):
-        minuend, subtrahend = self.visit_children(tree)
-        # For list-y minuends, remove the first instance of each element
-        # in subtrahend (or subtrahend itself if it's not a container)
-        # from minuend, if it's present.
-        if utils.isordered(minuend):
-            new = list(minuend)
-            if utils.iscontainer(subtrahend):
-                for item in subtrahend:
-                    try:
-                        new.remove(item)
-                    except ValueError:
-                        pass
-                return type(minuend)(new)
-            else:
-                try:
-                    new.remove(subtrahend)
-                except ValueError:
-                    pass
-                return type(minuend)(new)
-        elif isinstance(minuend, dict):
-            return {k: v for k, v in minuend.items() if k != subtrahend}
-        elif isinstance(minuend, set):
-            return {item for item in minuend if item != subtrahend}
-        elif isinstance(minuend, str) and isinstance(subtrahend, str):
-            return minuend.replace(subtrahend, '', 1)
-        return minuend - subtrahend
+        return ops.subtract(*self.visit_children(tree))
 
     def catenation(self, tree):
         return ops.cat(*self.visit_children(tree))
@@ -350,32 +433,24 @@ class DicelangInterpreter(Interpreter):
         return left | right
 
     def bit_not(self, tree):
-        operand = self.visit(tree.children[0])
-        if operand.__class__ is complex:
-            return operand.conjugate()
-        return ~operand
+        return ops.invert(self.visit(tree.children[0]))
 
     def sum_or_join(self, tree):
-        operand = self.visit_children(tree)[0]
-        if isinstance(operand, Iterable) and not isinstance(operand, str):
-            return utils.vector_sum(operand)
-        elif isinstance(operand, Complex):
-            return operand.imag
-        return operand
+        return ops.sum_or_join(self.visit_children(tree)[0])
 
     def coinflip(self, tree):
         a, b = tree.children
-        return self.visit(a if random.randint(0, 1) else b)
+        return self.visit(a if rng.current().randint(0, 1) else b)
 
     def random_selection_replacing_unary(self, tree):
         population, = self.visit_children(tree)
         if hasattr(population, '__len__'):
-            return random.choice(population)
+            return rng.current().choice(population)
         return population
 
     def random_selection_replacing_binary(self, tree):
         count, population = self.visit_children(tree)
-        return random.choices(population, k=count)
+        return rng.current().choices(population, k=count)
 
     def random_selection_unary(self, tree):
         return self.random_selection_replacing_unary(tree)
@@ -383,7 +458,7 @@ class DicelangInterpreter(Interpreter):
     def random_selection_binary(self, tree):
         count, population = self.visit_children(tree)
         if hasattr(population, '__len__'):
-            return random.sample(population, count)
+            return rng.current().sample(population, count)
         return [population] * count
 
     comparison_ops = {
@@ -442,6 +517,11 @@ class DicelangInterpreter(Interpreter):
     def boolean_not(self, tree):
         return not self.visit(tree.children[-1])
 
+    @staticmethod
+    def constant(tree):
+        value, _, copy_value = tree.children
+        return value if copy_value is None else copy_value(value)
+
     @staticmethod
     def number(tree):
         match (token := tree.children[0]).type:
@@ -530,24 +610,24 @@ class DicelangInterpreter(Interpreter):
     def list_range(self, tree):
         start, _, stop = self.visit_children(tree)
         step = 1 if start < stop else -1
-        return list(range(start, stop, step))
+        return Range(range(start, stop, step))
 
     def list_range_stepped(self, tree):
         start, _, stop, _, step = self.visit_children(tree)
         step = abs(step)
         step = step if start < stop else -step
-        return list(range(start, stop, step))
+        return Range(range(start, stop, step))
 
     def list_closed(self, tree):
         start, _, stop = self.visit_children(tree)
         step = 1 if (up := (start < stop)) else -1
-        return list(range(start, stop + step if up else stop - step, step))
+        return Range(range(start, stop + step if up else stop - step, step))
 
     def list_closed_stepped(self, tree):
         start, _, stop, _, step = self.visit_children(tree)
         step = abs(step)
         step = step if (up := (start < stop)) else -step
-        return list(range(start, stop + step if up else stop - step, step))
+        return Range(range(start, stop + step if up else stop - step, step))
 
     def tuple_single(self, tree):
         return self.visit(tree.children[0]),
@@ -629,8 +709,6 @@ class DicelangInterpreter(Interpreter):
         if isinstance(target, UserFunction):
             target.this = last
             return target
-        if inspect.ismethod(target):
-            return partialmethod(target, last)
         return target
 
     def function_call(self, tree):
@@ -671,8 +749,8 @@ class DicelangInterpreter(Interpreter):
     def public_identifier(tree):
         return IdentType.PUBLIC, str(tree.children[1])
 
-
-    def user_server_identifier(self, tree):
+    @staticmethod
+    def user_server_identifier(tree):
         return IdentType.USER_SERVER, str(tree.children[1])
 
     @staticmethod
@@ -698,16 +776,18 @@ class DicelangInterpreter(Interpreter):
         owner = self.ownership.get(var_scope)
         return self.call_stack.datastore.check(var_scope, owner)
 
-    augments = {'+=': operator.iadd, '-=': operator.isub, '$=': ops.icat,
-                '*=': operator.imul, '/=': operator.itruediv, '//=': operator.ifloordiv,
-                '%=': operator.imod, '**=': operator.ipow, '<<=': operator.ilshift,
-                '>>=': operator.irshift, '&=': operator.iand, '|=': operator.ior,
+    # **= is missing: it is _exponentiate, which needs the interpreter to check its limits.
+    augments = {'+=': ops.add, '-=': ops.subtract, '$=': ops.icat,
+                '*=': ops.multiply, '/=': ops.divide, '//=': operator.ifloordiv,
+                '%=': operator.imod, '<<=': ops.left_shift,
+                '>>=': ops.right_shift, '&=': operator.iand, '|=': operator.ior,
                 '^=': operator.ixor, 'and=': ops.iand, 'xor=': ops.ixor,
                 'or=': ops.ior}
 
     def augmented_any(self, tree):
         target, op, augment = self.visit_children(tree)
-        return target.put(self.augments[op](target.get(), augment))
+        function = self._exponentiate if op == '**=' else self.augments[op]
+        return target.put(function(target.get(), augment))
 
     def assignment_single(self, tree):
         lval, _eq_sign, rval = self.visit_children(tree)
@@ -751,3 +831,7 @@ class DicelangInterpreter(Interpreter):
                 raise Terminate(value)
             case _:
                 raise Impossible(f'unknown signal: {sig}')
+
+
+compiler = ClosureCompiler(DicelangInterpreter)
+UserFunction.lowering = BytecodeCompiler(compiler)
@@ -1,8 +1,13 @@
+import tempfile
 import unittest
+from pathlib import Path
 from dicelang.interpreter import DicelangInterpreter
+from dicelang.lookup import CallStack, SelfPruningStore
 from dicelang.parser import parser
 
-Dicelang = DicelangInterpreter()
+# Variables the tests store go to a database of their own, not the bot's.
+storage = tempfile.TemporaryDirectory()
+Dicelang = DicelangInterpreter(CallStack(SelfPruningStore(Path(storage.name) / 'persistence.db')))
 
 
 def execute(command):
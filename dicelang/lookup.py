@@ -1,4 +1,5 @@
 import copy
+import functools
 import pickle
 import sqlite3
 import threading
@@ -13,9 +14,10 @@ from collections import Counter
 from enum import Enum, IntEnum
 
 from dicelang import plugins
+from dicelang.ranges import Range
 from dicelang.exceptions import (BuiltinError, MissingScope, DeleteNonexistent, FetchNonexistent, Impossible,
                                  NoSuchVariable, ClassCreationError)
-from dicelang.utils import get_attr_or_item, some
+from dicelang.utils import Parameter, get_attr_or_item, some  # Parameter is needed by `exec` in BasicStore.put
 from dicelang.special import Undefined
 from dicelang.user_function import UserFunction
 
@@ -401,14 +403,27 @@ class Lookup:
         return self.call_stack.datastore.drop(itype, self.owner, self.name, *self.accessors)
 
 
+def synchronized(method):
+    """Make `method` hold its store's lock, so that executions in different threads
+    can share a store."""
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+
 class BasicStore:
     def __init__(self):
+        self.lock = threading.RLock()
         self.storage = {IdentType.USER: {}, IdentType.SERVER: {}, IdentType.PUBLIC: {},
                         IdentType.USER_SERVER: {}, IdentType.CHANNEL: {}}
 
+    @synchronized
     def check(self, itype: IdentType, owner: str) -> set[str]:
         return set(self.storage[itype].get(owner, {}).keys())
 
+    @synchronized
     def get(self, itype: IdentType, owner: str, name: str, *accessors: Accessor) -> Any:
         store = self.storage[itype or IdentType.SERVER]
         failed = False
@@ -424,11 +439,13 @@ class BasicStore:
             value = accessor.get(value)
         return value
 
+    @synchronized
     def put(self, itype: IdentType, owner: str, value, name: str, *accessors: Accessor) -> Any:
         store = self.storage[itype or IdentType.SERVER]
         if owner not in store:
             store[owner] = {name: value}
-        elif name not in store[owner]:
+        elif name not in store[owner] or isinstance(value, Range) and not accessors:
+            # Ranges are stored as they are, so lazy ones stay lazy (and pickle as the range they stand for).
             store[owner][name] = value
         else:
             with UserFunction.SerializationManager():
@@ -442,6 +459,7 @@ class BasicStore:
                 exec(f'store[owner][name]{"".join(str(acc) for acc in accessors)} = {r}')
         return value
 
+    @synchronized
     def drop(self, itype: IdentType, owner: str, name: str, *accessors: Accessor) -> Any:
         store = self.storage[itype or IdentType.SERVER]
         if owner not in store or name not in store[owner]:
@@ -456,7 +474,7 @@ class BasicStore:
 class PersistentStore(BasicStore):
     def __init__(self, db_location: Location):
         super().__init__()
-        self.conn = sqlite3.connect(db_location)
+        self.conn = sqlite3.connect(db_location, check_same_thread=False)
         self.cur = self.conn.cursor()
         self.cur.execute("""CREATE TABLE IF NOT EXISTS variables(
             ownership INTEGER NOT NULL,
@@ -479,10 +497,19 @@ class PersistentStore(BasicStore):
         self.conn.commit()
         self.conn.close()
 
+    @synchronized
+    def forget(self) -> None:
+        """Drop the values cached in memory, so that the next reads see whatever other
+        processes sharing the database have written since."""
+        for cache in self.storage.values():
+            cache.clear()
+
+    @synchronized
     def check(self, itype: IdentType, owner: str) -> set[str]:
         res = self.cur.execute('SELECT name FROM variables WHERE ownership = ? AND owner = ?', (itype, owner))
         return set(fetched[0] for fetched in res.fetchall())
 
+    @synchronized
     def get(self, itype: IdentType, owner: str, name: str, *accessors: Accessor) -> Any:
         try:
             value = super().get(itype, owner, name, *accessors)
@@ -496,6 +523,7 @@ class PersistentStore(BasicStore):
         super().put(itype, owner, value, name, *accessors)
         return value
 
+    @synchronized
     def put(self, itype: IdentType, owner: str, value, name: str, *accessors: Accessor) -> Any:
         super().put(itype, owner, value, name, *accessors)
         obj = self.storage[itype or IdentType.SERVER][owner][name]
@@ -512,6 +540,7 @@ class PersistentStore(BasicStore):
         self.conn.commit()
         return value
 
+    @synchronized
     def drop(self, itype: IdentType, owner: str, name: str, *accessors: Accessor) -> Any:
         try:  # Obtain a copy of the item we intend to delete, or raise an error on deleting a missing object.
             out = self.get(itype, owner, name, *accessors)
@@ -547,6 +576,7 @@ class SelfPruningStore(PersistentStore):
         self.pruner.start()
         print(f'Self-pruning thread initiated. Culling cycle: {cycle_time / 3600:.2f} hours.')
 
+    @synchronized
     def get(self, itype: IdentType, owner: str, name: str, *accessors: Accessor) -> Any:
         out = super().get(itype, owner, name, *accessors)
         usage = self.usage[itype or IdentType.SERVER]
@@ -556,6 +586,7 @@ class SelfPruningStore(PersistentStore):
             usage[owner][name] += 1
         return out
 
+    @synchronized
     def put(self, itype: IdentType, owner: str, value, name: str, *accessors: Accessor) -> Any:
         out = super().put(itype, owner, value, name, *accessors)
         usage = self.usage[itype or IdentType.SERVER]
@@ -565,6 +596,7 @@ class SelfPruningStore(PersistentStore):
             usage[owner][name] += 1
         return out
 
+    @synchronized
     def drop(self, itype: IdentType, owner: str, name: str, *accessors: Accessor) -> Any:
         out = super().drop(itype, owner, name, *accessors)
         usage = self.usage[itype or IdentType.SERVER]
@@ -576,6 +608,7 @@ class SelfPruningStore(PersistentStore):
             usage[owner][name] += 1
         return out
 
+    @synchronized
     def prune(self) -> int:
         marked = []
         for itype in self.usage:
@@ -0,0 +1,81 @@
+from collections.abc import Sized
+from contextlib import AbstractContextManager, contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from dicelang.exceptions import ExcessiveSize
+
+# Estimated bytes per item: a pointer per item of a container, an int object per
+# item that has none yet (as when a range is materialized), and per character.
+Pointer = 8
+Int = 28
+# Allocations smaller than this are neither checked nor counted.
+LargeAllocation = 1 << 16
+# The most that an execution may allocate in large allocations, in bytes.
+DefaultBudget = 1 << 28
+
+
+def footprint(value) -> int:
+    """The estimated size in bytes of a copy of `value`, if it has a length."""
+    if not isinstance(value, Sized):
+        return 0
+    if isinstance(value, str):
+        return len(value) * (1 if value.isascii() else 4)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    size = len(value) * Pointer
+    # A range that hasn't been materialized has no int objects of its own yet; a copy needs them.
+    if getattr(value, 'is_lazy', None) is not None and value.is_lazy():
+        size += len(value) * Int
+    return size
+
+
+class Budget:
+    """The memory an execution may allocate. Operators whose results can be far
+    larger than their operands (`[1] * 10 ** 10`, `'x' * 10 ** 12`, large dice
+    pools and materialized ranges) reserve their predicted size before building
+    them, so a command is refused before Python runs out of memory rather than
+    after. The large allocations of an execution add up to `allocated`, which may
+    not exceed `limit`; with no limit, they are only counted."""
+
+    def __init__(self, limit: int | None = DefaultBudget):
+        self.limit = limit
+        self.allocated = 0
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(limit={self.limit}, allocated={self.allocated})'
+
+    def reserve(self, size: int, what: str) -> None:
+        """Account for allocating `size` bytes for `what`, or raise `ExcessiveSize`
+        if that would exceed the limit."""
+        if size < LargeAllocation:
+            return
+        if self.limit is not None and self.allocated + size > self.limit:
+            raise ExcessiveSize(f'{what} of about {size:,} bytes would exceed the memory budget'
+                                f' ({self.allocated:,} of {self.limit:,} bytes used)')
+        self.allocated += size
+
+
+# The budget of the running execution, or of anything run outside of one. Each
+# thread (and task) sees the budget of its own execution.
+current_budget: ContextVar[Budget] = ContextVar('budget', default=Budget(None))
+current = current_budget.get
+
+
+def reserve(size: int, what: str) -> None:
+    current().reserve(size, what)
+
+
+@contextmanager
+def using(budget: Budget) -> Iterator[Budget]:
+    """Allocate from `budget` for the duration of the context."""
+    token = current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        current_budget.reset(token)
+
+
+def budgeted(limit: int | None = DefaultBudget) -> AbstractContextManager[Budget]:
+    """Allocate from a new budget of `limit` bytes for the duration of the context."""
+    return using(Budget(limit))
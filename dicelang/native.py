@@ -1,18 +1,25 @@
+import bisect
 import math
-import statistics
 import functools
 import operator
+from collections import Counter
+from contextvars import ContextVar
 from numbers import Complex
-from random import shuffle
 
 import more_itertools
 
+from dicelang import rng
+from dicelang.exceptions import BadArguments
+from dicelang.ranges import Range
+
 from typing import TypeVar, Iterable, Any, SupportsFloat, SupportsIndex
 from numbers import Real
 T = TypeVar('T')
 
 
-class _PrintQueue:
+class PrintQueue:
+    """The messages printed by an execution, shown along with its result."""
+
     def __init__(self, queue: list | None = None):
         self.queued = queue or []
 
@@ -22,19 +29,15 @@ class _PrintQueue:
         return msg
 
     def print(self, *args) -> str:
-        """Print an arbitrary sequence of values, separated by spaces."""
         return self._print_kernel(*args, end='')
 
     def print0(self, *args) -> str:
-        """Print an arbitrary sequence of values with no separators."""
         return self._print_kernel(*args, sep='', end='')
 
     def println(self, *args) -> str:
-        """Print an arbitrary sequence of values, separated by spaces, and followed by a newline."""
         return self._print_kernel(*args)
 
     def println0(self, *args) -> str:
-        """Print an arbitrary sequence of values without separators, followed by a newline."""
         return self._print_kernel(*args, sep='')
 
     def flush(self) -> str:
@@ -43,24 +46,85 @@ class _PrintQueue:
         return flushed
 
 
-PrintQueue = _PrintQueue()
+# The print queue of the running execution, or of anything run outside of one. Each
+# thread (and task) prints to the queue of its own execution.
+current_print_queue: ContextVar[PrintQueue] = ContextVar('print_queue', default=PrintQueue())
+print_queue = current_print_queue.get
+
+
+def print_(*args) -> str:
+    """Print an arbitrary sequence of values, separated by spaces."""
+    return print_queue().print(*args)
+
+
+def print0(*args) -> str:
+    """Print an arbitrary sequence of values with no separators."""
+    return print_queue().print0(*args)
+
+
+def println(*args) -> str:
+    """Print an arbitrary sequence of values, separated by spaces, and followed by a newline."""
+    return print_queue().println(*args)
+
+
+def println0(*args) -> str:
+    """Print an arbitrary sequence of values without separators, followed by a newline."""
+    return print_queue().println0(*args)
+
+
+def rand() -> float:
+    return rng.current().random()
 
 
 def shuffled(iterable: Iterable[T]) -> list[T]:
     new = list(iterable)
-    shuffle(new)
+    rng.current().shuffle(new)
     return new
 
 
-def stats(iterable: dict | Iterable[Real]):
-    items = iterable.values() if isinstance(iterable, dict) else iterable
-    out = {'mu': statistics.mean(items), 'minimum': min(items),
-           'maximum': max(items), 'median': statistics.median(items),
-           'size': len(items), 'sum': sum(items)}
-    out['sigma'] = statistics.stdev(items, out['average'])
-    out['q1'] = statistics.median(x for x in items if x < out['median'])
-    out['q3'] = statistics.median(x for x in items if x > out['median'])
-    return out
+def stats(values: dict | Iterable[Real], weighted: bool = False) -> dict:
+    """Summary statistics of `values`, read in a single pass. Only the distinct
+    values are kept, each with how many times it occurred, so a million rolls
+    take no more memory than their faces. The mean and deviation are accumulated
+    by Welford's method and the median and quartiles are selected from the
+    cumulative counts. Dicts give their values or, if `weighted`, map each value
+    to how many times it occurred.
+
+    Memory is therefore bounded by the number of distinct values, not constant:
+    values that seldom repeat, such as floats, take as much as a list of them
+    would. That is the price of exact quartiles."""
+    if not weighted:
+        counts = Counter(values.values() if isinstance(values, dict) else values)
+    elif not isinstance(values, dict) or not all(type(count) is int and count >= 0 for count in values.values()):
+        raise BadArguments('weighted statistics need a dict mapping each value to how many times it occurred')
+    else:
+        counts = values
+    distinct = sorted(value for value, count in counts.items() if count)
+    if not distinct:
+        raise BadArguments('no values to compute statistics of')
+
+    size = mu = m2 = 0
+    cumulative = []
+    for value in distinct:
+        count = counts[value]
+        size += count
+        delta = value - mu
+        mu += delta * count / size
+        m2 += delta * (value - mu) * count
+        cumulative.append(size)
+
+    def median(start: int, stop: int) -> Real:
+        """The median of the values ranked `start` to `stop - 1`, or of all of them if there are none."""
+        if stop <= start:
+            start, stop = 0, size
+        low, high = divmod(start + stop - 1, 2)
+        lower = distinct[bisect.bisect_right(cumulative, low)]
+        return (lower + distinct[bisect.bisect_right(cumulative, low + 1)]) / 2 if high else lower
+
+    return {'mu': mu, 'minimum': distinct[0], 'maximum': distinct[-1], 'median': median(0, size),
+            'size': size, 'sum': sum(value * counts[value] for value in distinct),
+            'sigma': math.sqrt(m2 / (size - 1)) if size > 1 else 0.0,
+            'q1': median(0, size // 2), 'q3': median((size + 1) // 2, size)}
 
 
 def flatten(items: Iterable[Any]) -> list[Any]:
@@ -72,11 +136,16 @@ def lzip(*iterables: Iterable) -> list[tuple]:
 
 
 def typeof(x: Any) -> type:
-    return x.__class__
+    # Ranges are lists as far as scripts can tell.
+    return list if x.__class__ is Range else x.__class__
 
 
 def typename(x: Any) -> str:
-    return x.__class__.__name__
+    return typeof(x).__name__
+
+
+def instanceof(x: Any, types: type | tuple[type, ...]) -> bool:
+    return isinstance(x, types) or x.__class__ is Range and isinstance([], types)
 
 
 def magnitude(x: SupportsFloat | SupportsIndex) -> Real:
@@ -1,4 +1,11 @@
-from typing import SupportsInt
+import itertools
+from collections.abc import Iterable, Sequence
+from numbers import Complex
+from typing import Any, SupportsInt
+
+from dicelang import memory, utils
+from dicelang.memory import footprint
+from dicelang.ranges import Range
 
 
 def cat(x: SupportsInt, y: SupportsInt) -> int:
@@ -18,3 +25,120 @@ def ior(x: bool, y: bool) -> bool:
 
 def ixor(x: bool, y: bool) -> bool:
     return x and not y or y and not x
+
+
+def multiply(multiplier: Any, multiplicand: Any) -> Any:
+    if isinstance(multiplier, int) and isinstance(multiplicand, Sequence):
+        memory.reserve(footprint(multiplicand) * abs(multiplier), 'repetition')
+        direction = utils.sign(multiplier)
+        return multiplicand[::direction] * abs(multiplier)
+    elif isinstance(multiplier, Sequence) and isinstance(multiplicand, int):
+        memory.reserve(footprint(multiplier) * abs(multiplicand), 'repetition')
+        direction = utils.sign(multiplicand)
+        return multiplier[::direction] * abs(multiplicand)
+    return multiplier * multiplicand
+
+
+def divide(dividend: Any, divisor: Any) -> Any:
+    if isinstance(dividend, (list, tuple, set, Range)):
+        memory.reserve(footprint(dividend), 'difference')
+        if not isinstance(divisor, str) and isinstance(divisor, Iterable):
+            return type(dividend)(x for x in dividend if x not in divisor)
+        else:
+            return type(dividend)(x for x in dividend if x != divisor)
+    if isinstance(dividend, dict):
+        if not isinstance(divisor, str) and isinstance(divisor, Iterable):
+            return {k: v for k, v in dividend.items() if k not in divisor}
+        else:
+            return {k: v for k, v in dividend.items() if k != divisor}
+    if isinstance(dividend, str) and isinstance(divisor, str):
+        return dividend.replace(divisor, '')
+    return dividend / divisor
+
+
+def left_shift(bits: Any, shift: Any) -> Any:
+    if isinstance(bits, (list, tuple, Range)):
+        memory.reserve(footprint(bits) + memory.Pointer, 'append')
+        return bits + type(bits)([shift])
+    elif isinstance(bits, str):
+        memory.reserve(footprint(bits) + footprint(shift := str(shift)), 'append')
+        return bits + shift
+    if isinstance(bits, int) and isinstance(shift, int) and shift > 0:
+        memory.reserve((bits.bit_length() + shift) // 8, 'shift')
+    return bits << shift
+
+
+def right_shift(bits: Any, shift: Any) -> Any:
+    if isinstance(bits, (list, tuple, Range)):
+        memory.reserve(footprint(bits) + memory.Pointer, 'append')
+        return type(bits)([shift]) + bits
+    elif isinstance(bits, str):
+        memory.reserve(footprint(bits) + footprint(shift := str(shift)), 'append')
+        return shift + bits
+    return bits >> shift
+
+
+def add(addend: Any, augend: Any) -> Any:
+    if isinstance(addend, dict) and isinstance(augend, dict):
+        return {**addend, **augend}
+    if utils.isvector(addend) and utils.isvector(augend):
+        memory.reserve(footprint(addend) + footprint(augend), 'concatenation')
+        return type(addend)(itertools.chain(addend, augend))
+    if isinstance(addend, str) and isinstance(augend, str):
+        memory.reserve(footprint(addend) + footprint(augend), 'concatenation')
+    return addend + augend
+
+
+def subtract(minuend: Any, subtrahend: Any) -> Any:
+    # For list-y minuends, remove the first instance of each element
+    # in subtrahend (or subtrahend itself if it's not a container)
+    # from minuend, if it's present.
+    if utils.isordered(minuend):
+        memory.reserve(footprint(minuend), 'difference')
+        new = list(minuend)
+        if utils.iscontainer(subtrahend):
+            for item in subtrahend:
+                try:
+                    new.remove(item)
+                except ValueError:
+                    pass
+            return type(minuend)(new)
+        else:
+            try:
+                new.remove(subtrahend)
+            except ValueError:
+                pass
+            return type(minuend)(new)
+    elif isinstance(minuend, dict):
+        return {k: v for k, v in minuend.items() if k != subtrahend}
+    elif isinstance(minuend, set):
+        return {item for item in minuend if item != subtrahend}
+    elif isinstance(minuend, str) and isinstance(subtrahend, str):
+        return minuend.replace(subtrahend, '', 1)
+    return minuend - subtrahend
+
+
+def negate(operand: Any) -> Any:
+    if isinstance(operand, Sequence):
+        return operand[::-1]
+    return -operand
+
+
+def positive(operand: Any) -> Any:
+    if isinstance(operand, (int, float, complex)):
+        return +operand
+    return operand
+
+
+def invert(operand: Any) -> Any:
+    if operand.__class__ is complex:
+        return operand.conjugate()
+    return ~operand
+
+
+def sum_or_join(operand: Any) -> Any:
+    if isinstance(operand, Iterable) and not isinstance(operand, str):
+        return utils.vector_sum(operand)
+    elif isinstance(operand, Complex):
+        return operand.imag
+    return operand
@@ -0,0 +1,173 @@
+import copy
+from collections.abc import Sized
+from numbers import Number
+
+import lark
+from lark import Token, Tree
+
+from dicelang import memory
+from dicelang.ranges import Range
+from dicelang.special import Undefined
+
+
+MaxFoldedSize = 4096
+# Folding runs outside of any execution, so it allocates from a budget of its own:
+# enough for the largest value it may fold, a materialized range of `MaxFoldedSize` ints.
+FoldBudget = MaxFoldedSize * (memory.Pointer + memory.Int)
+
+_SCALARS = (Number, str, bytes, type(None), type(Undefined))
+
+# Rules whose value depends only on the values of their children. Dice, the random
+# operators (`!`, `@`, `@!`), lookups, calls and identity tests (`is`) are never folded.
+_FOLDABLE = {'addition', 'subtraction', 'multiplication', 'division', 'integer_division', 'remainder',
+             'exponent', 'unary_minus', 'unary_plus', 'catenation', 'left_shift', 'right_shift',
+             'bit_and', 'bit_xor', 'bit_or', 'bit_not', 'sum_or_join',
+             'compare_math', 'member_of', 'member_of_negated',
+             'boolean_or', 'boolean_xor', 'boolean_and', 'boolean_not',
+             'list_range', 'list_range_stepped', 'list_closed', 'list_closed_stepped',
+             'list_empty', 'list_populated', 'tuple_empty', 'tuple_single', 'tuple_multi',
+             'set_populated', 'dict_empty', 'dict_populated'}
+_LITERALS = {'number', 'string', 'boolean', 'undefined'}
+_RANGES = {'list_range', 'list_range_stepped', 'list_closed', 'list_closed_stepped'}
+# Rules the interpreter evaluates as the value of their only child, via `__default__`.
+_PASSTHROUGH = {'atom', 'primary', 'priority', 'index_or_key'}
+_PURE = _FOLDABLE | _LITERALS | _PASSTHROUGH | {'constant'}
+# The position of the body among the children of each loop.
+_LOOPS = {'while_loop': 3, 'do_while_loop': 1, 'for_loop': 5}
+
+
+def is_pure(tree: Tree) -> bool:
+    """Whether the value of `tree` depends only on the literals in it."""
+    return all(t.data in _PURE for t in tree.iter_subtrees())
+
+
+def is_constant(node) -> bool:
+    return isinstance(node, Tree) and node.data == 'constant'
+
+
+def constant_value(node):
+    return node.children[0]
+
+
+def discard(node) -> None:
+    """Mark the loops that can skip collecting their values because the value of
+    `node` is thrown away: `node` itself, the last statement of a block, either
+    branch of a conditional, and the bodies of such loops in turn."""
+    if not isinstance(node, Tree):
+        return
+    data = node.data
+    if data in _LOOPS:
+        node.discarded = True
+        discard(node.children[_LOOPS[data]])
+    elif data == 'block':
+        discard(node.children[-2])
+    elif data in ('if_block', 'if_else_block'):
+        for body in node.children[3::2]:
+            discard(body)
+    elif data == 'if_ternary':
+        discard(node.children[0])
+        discard(node.children[-1])
+    elif (data in _PASSTHROUGH or data in ('body', 'short')) and len(node.children) == 1:
+        discard(node.children[0])
+
+
+class Discarded(list):
+    """The values of a loop whose value is thrown away, which it doesn't keep."""
+
+    def append(self, value) -> None:
+        pass
+
+
+def loop_results(tree: Tree) -> list:
+    """A new list for the values of the loop `tree`, unless they are discarded."""
+    return Discarded() if getattr(tree, 'discarded', False) else []
+
+
+def fuel_cost(*trees) -> int:
+    """The fuel that evaluating `trees` node by node uses, one unit per node, for
+    compiled code to use in one go."""
+    return sum(1 for tree in trees if isinstance(tree, Tree) for _ in tree.iter_subtrees())
+
+
+def copier(value):
+    """How a folded value must be copied each time it is used, so that in-place
+    operations (`x += [1]`) can't change the constant: not at all for immutable
+    values, shallowly for flat containers, and deeply otherwise."""
+    if isinstance(value, _SCALARS):
+        return None
+    if isinstance(value, (list, set, tuple, Range)) and all(isinstance(v, _SCALARS) for v in value):
+        return None if isinstance(value, tuple) else copy.copy
+    if isinstance(value, dict) and all(isinstance(v, _SCALARS) for v in value.values()):
+        return copy.copy
+    return copy.deepcopy
+
+
+class Optimizer(lark.Transformer):
+    """Rewrites a syntax tree before it is interpreted. Literal tokens are decoded
+    once, and subtrees whose value can't change between evaluations are folded
+    into `constant` nodes, e.g. `[1 through 20]` or `2 ** 10` inside a loop body.
+
+    A `constant` node holds the value, the subtree it replaced (for source
+    reconstruction and serialization) and the function used to copy the value
+    on each use (or None when it is immutable). Folding evaluates the subtree with
+    `evaluator`, a `DicelangInterpreter`, so folded results are exactly what the
+    interpreter would have computed. Subtrees that raise, or whose result (or
+    inputs) would exceed `MaxFoldedSize`, are left alone for the interpreter.
+
+    Loops whose values are never used, such as every statement of a block but
+    the last, are marked `discarded` so that they run in constant memory."""
+
+    def __init__(self, evaluator):
+        super().__init__(visit_tokens=False)
+        self.evaluator = evaluator
+
+    def __default__(self, data, children, meta):
+        tree = Tree(data, children, meta)
+        if data in ('start', 'block'):
+            for statement in children[:-2 if data == 'block' else -1]:
+                discard(statement)
+            return tree
+        if data in _LITERALS:
+            return self.fold(tree)
+        if data in _FOLDABLE:
+            operands = [c for c in children if not isinstance(c, Token)]
+            if data == 'dict_populated':
+                operands = [c for pair in children for c in pair.children]
+            if all(is_constant(c) for c in operands) and self.affordable(data, [constant_value(c) for c in operands]):
+                return self.fold(tree)
+        elif data in _PASSTHROUGH and len(children) == 1 and is_constant(children[0]):
+            value, _, copy_value = children[0].children
+            return Tree('constant', [value, tree, copy_value])
+        return tree
+
+    def fold(self, tree: Tree) -> Tree:
+        try:
+            with memory.budgeted(FoldBudget):
+                value = self.evaluator.visit(tree)
+        except Exception:
+            return tree
+        if hasattr(value, '__len__') and not isinstance(value, (Tree, Token)) and len(value) > MaxFoldedSize:
+            return tree
+        if isinstance(value, int) and value.bit_length() > MaxFoldedSize * 8:
+            return tree
+        return Tree('constant', [value, tree, copier(value)])
+
+    @staticmethod
+    def affordable(rule: str, operands: list) -> bool:
+        """Guard against folds that would be expensive to compute before their
+        results can be measured."""
+        ints = [x for x in operands if isinstance(x, int)]
+        match rule:
+            case 'exponent':
+                return len(ints) < 2 or abs(operands[1]) <= MaxFoldedSize
+            case 'multiplication':
+                length = max((len(x) for x in operands if isinstance(x, Sized)), default=1)
+                return len(ints) != 1 or abs(ints[0]) * length <= MaxFoldedSize
+            case 'left_shift':
+                return len(ints) < 2 or operands[1] <= MaxFoldedSize * 8
+            case _ if rule in _RANGES:
+                if len(ints) != len(operands):
+                    return False
+                step = abs(operands[2]) if len(operands) == 3 else 1
+                return step > 0 and abs(operands[1] - operands[0]) // step <= MaxFoldedSize
+        return True
@@ -1,5 +1,19 @@
-from lark import Lark, UnexpectedInput
+import hashlib
+import importlib
+import os
+import pickle
+import stat
+import sys
+import threading
+import time
+import types
+import warnings
+from collections import Counter
+import lark
+from lark import Lark, Tree, UnexpectedCharacters, UnexpectedInput
 from pathlib import Path
+from dicelang.cache import ParseCache, parse_cache
+from dicelang.fast_parser import FastParser, Unsupported
 
 class MissingGrammar(Exception):
     pass
@@ -73,41 +87,215 @@ class InvalidIdentifier(DicelangSyntaxError):
     examples = ["q.r", "p.d", "public begin", "my public", "x.delete"]
 
 
+class SyntaxErrorTable:
+    """Classify Earley errors by the parser state they stopped in.
+
+    Like `UnexpectedInput.match_examples`, this compares `state` (and the `<EOF>`
+    token) against the errors raised by each example, but the examples are parsed
+    once up front instead of on every error. Errors of the lexer carry no token,
+    so they are also matched on the character the lexer stopped at, which tells
+    `(1, })` from `(1, ` where `match_examples` can't."""
+
+    def __init__(self, kernel: Lark, start: str, examples: dict[type, list[str]]):
+        self.by_state = {}
+        self.exact = {}
+        for error_type, malformed in examples.items():
+            for example in malformed:
+                try:
+                    kernel.parse(example, start=start)
+                except UnexpectedInput as u:
+                    self.by_state.setdefault(u.state, error_type)
+                    if (token := self.token(u)) is not None:
+                        self.exact.setdefault((u.state, token), error_type)
+
+    @staticmethod
+    def token(error: UnexpectedInput) -> str | None:
+        if isinstance(error, UnexpectedCharacters):
+            return error.char
+        return getattr(error, 'token', None)
+
+    def classify(self, error: UnexpectedInput) -> type | None:
+        if (token := self.token(error)) is not None:
+            if (error_type := self.exact.get((error.state, token))) is not None:
+                return error_type
+        return self.by_state.get(error.state)
+
+
+class _KernelPickler(pickle.Pickler):
+    """Lark keeps references to the `re` module around; store modules by name."""
+    def persistent_id(self, obj):
+        if isinstance(obj, types.ModuleType):
+            return obj.__name__
+        return None
+
+
+class _KernelUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        return importlib.import_module(pid)
+
+
+def _is_private(status: os.stat_result) -> bool:
+    """Whether the file `status` describes belongs to this user, and no one else
+    can write to it."""
+    owned = not hasattr(os, 'getuid') or status.st_uid == os.getuid()
+    return owned and not status.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
 # NEVER use the 'lalr' parser option. Dicelang's grammar has loads of
 # shift/reduce conflicts which 'earley' can handle.
 class DicelangParser:
     Paths = [Path(x) for x in ('./dicelang.lark', './dicelang/dicelang.lark')]
-    _syntax_errors = {MissingLeftOperand, MissingRightOperand, MissingComma, MissingOpenParen, MissingCloseParen,
+    StartRules = ('start', 'function')
+    CacheDirectory = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'dicelang'
+    CacheVersion = 2  # Bump whenever what is cached changes shape, e.g. SyntaxErrorTable
+    _syntax_errors = (MissingLeftOperand, MissingRightOperand, MissingComma, MissingOpenParen, MissingCloseParen,
                       MissingOpenCurly, MissingCloseCurly, MissingOpenBracket, MissingCloseBracket,
-                      InvalidIdentifier}
+                      InvalidIdentifier)
+    _kernels = {}
 
-    def __init__(self, start='start'):
-        for path in self.Paths:
+    def __init__(self, start='start', fast=True, use_cache=True):
+        self.start = start
+        self.grammar = self.read_grammar()
+        self.kernel, error_tables = self.load_kernel(self.grammar, use_cache)
+        self.errors = error_tables[start]
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        # The fast front end only understands whole scripts; function bodies and
+        # everything outside its subset go straight to (or back to) Earley.
+        self.fast = FastParser(self.kernel) if fast and start == 'start' else None
+
+    @classmethod
+    def read_grammar(cls) -> str:
+        for path in cls.Paths:
             try:
                 with open(path, 'r', encoding='utf-8') as grammar_file:
-                    self.grammar = grammar_file.read()
-                    break
+                    return grammar_file.read()
+            except FileNotFoundError:
+                pass
+        paths = ', '.join(str(p) for p in cls.Paths)
+        raise MissingGrammar(f'Grammar not found along following path(s): {paths}')
+
+    @classmethod
+    def kernel_digest(cls, grammar: str) -> str:
+        examples = repr(sorted((t.__name__, t.examples) for t in cls._syntax_errors))
+        key = '\0'.join((grammar, *cls.StartRules, examples, str(cls.CacheVersion), lark.__version__, sys.version))
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def kernel_path(cls, grammar: str) -> Path:
+        return cls.CacheDirectory / f'.dicelang_kernel_{cls.kernel_digest(grammar)[:32]}.pickle'
+
+    @classmethod
+    def build_kernel(cls, grammar: str) -> tuple[Lark, dict[str, SyntaxErrorTable]]:
+        kernel = Lark(grammar, parser='earley', start=list(cls.StartRules))
+        examples = cls.make_examples()
+        return kernel, {start: SyntaxErrorTable(kernel, start, examples) for start in cls.StartRules}
+
+    @classmethod
+    def load_kernel(cls, grammar: str, use_cache: bool = True) -> tuple[Lark, dict[str, SyntaxErrorTable]]:
+        """Return the Earley parser for `grammar`, shared by every start rule, along
+        with a syntax error table for each start rule. These are kept in memory and
+        pickled to `CacheDirectory` under a hash of the grammar, so later processes
+        can skip grammar analysis entirely.
+
+        Unpickling runs whatever the pickle says to, so the cache is only used in a
+        directory of this user's that no one else can write to, and a cached file
+        is only loaded if the same holds for it."""
+        digest = cls.kernel_digest(grammar)
+        if use_cache and (compiled := cls._kernels.get(digest)) is not None:
+            return compiled
+        path = cls.kernel_path(grammar)
+        compiled = None
+        persist = use_cache and cls.prepare_cache_directory()
+        if persist:
+            try:
+                with open(path, 'rb') as cached:
+                    if not _is_private(os.fstat(cached.fileno())):
+                        raise PermissionError('writable by other users')
+                    compiled = _KernelUnpickler(cached).load()
             except FileNotFoundError:
                 pass
-        else:
-            paths = ', '.join(str(p) for p in self.Paths)
-            raise MissingGrammar(f'Grammar not found along following path(s): {paths}')
-        self.kernel = Lark(self.grammar, parser='earley', start=start)
+            except Exception as e:  # Stale, corrupt or untrusted cache; rebuild it below.
+                warnings.warn(f'Discarding grammar cache {path}: {e!r}', RuntimeWarning)
+        if compiled is None:
+            compiled = cls.build_kernel(grammar)
+            if persist:
+                cls.save_kernel(compiled, path)
+        if use_cache:
+            cls._kernels[digest] = compiled
+        return compiled
+
+    @classmethod
+    def prepare_cache_directory(cls) -> bool:
+        """Create `CacheDirectory` for this user alone if need be; whether it can be
+        trusted with the cache."""
+        try:
+            cls.CacheDirectory.mkdir(mode=0o700, parents=True, exist_ok=True)
+            if _is_private(cls.CacheDirectory.stat()):
+                return True
+            problem = 'writable by other users'
+        except OSError as e:
+            problem = repr(e)
+        warnings.warn(f'Not caching grammar in {cls.CacheDirectory}: {problem}', RuntimeWarning)
+        return False
+
+    @staticmethod
+    def save_kernel(compiled: tuple[Lark, dict[str, SyntaxErrorTable]], path: Path) -> None:
+        partial_path = path.with_name(f'{path.name}.{os.getpid()}')
+        try:
+            with open(partial_path, 'wb', opener=lambda file, flags: os.open(file, flags, 0o600)) as cached:
+                _KernelPickler(cached, protocol=pickle.HIGHEST_PROTOCOL).dump(compiled)
+            os.replace(partial_path, path)
+        except (OSError, pickle.PicklingError) as e:
+            warnings.warn(f'Could not write grammar cache {path}: {e!r}', RuntimeWarning)
+            partial_path.unlink(missing_ok=True)
 
     @classmethod
     def make_examples(cls):
         return {error_type: error_type.examples for error_type in cls._syntax_errors}
 
+    def count(self, counter: str, amount: float = 1) -> None:
+        with self.lock:
+            self.counters[counter] += amount
+
     def parse(self, code: str, start=None):
+        start = start or self.start
+        if self.fast is not None and start == 'start':
+            try:
+                ast = self.fast.parse(code)
+            except Unsupported:
+                pass
+            else:
+                self.count('fast')
+                return ast
+        began = time.perf_counter()
         try:
             ast = self.kernel.parse(code, start=start)
         except UnexpectedInput as u:
-            print(u)
-            if not (exc_class := u.match_examples(self.kernel.parse, self.make_examples(), use_accepts=True)):
+            self.count('failed')
+            exc_class = self.errors.classify(u)
+            self.count('failure_seconds', time.perf_counter() - began)
+            if not exc_class:
                 raise
+            self.count('classified')
             raise exc_class(u.get_context(code), u.line, u.column)
+        self.count('earley')
         return ast
 
+    def parse_flattened(self, code: str, cache: ParseCache | None = parse_cache, optimizer=None) -> Tree:
+        """Parse `code`, reusing the tree from an earlier call with identical
+        source text when `cache` is enabled. Pass `cache=None` to bypass caching
+        entirely. Passthrough rules are inlined by the grammar itself, so the
+        tree needs no separate flattening pass.
+
+        If an `optimizer` is given, the tree is rewritten by it before being
+        returned, and the optimized tree is cached separately from the plain one."""
+        def build():
+            return self.parse(code) if optimizer is None else optimizer.transform(self.parse(code))
+        if cache is None:
+            return build()
+        return cache.fetch((self.start, code) if optimizer is None else (self.start, code, 'optimized'), build)
+
 
 parser = DicelangParser()
 
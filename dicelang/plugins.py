@@ -3,11 +3,12 @@ import math
 import re
 import statistics
 from fractions import Fraction
-from random import random as rand
 
 from dicelang.native import (
-    PrintQueue as pq, flatten, lzip, shuffled, stats, typename, typeof, magnitude, product
+    flatten, instanceof, lzip, print_, print0, println, println0, rand, shuffled, stats, typename, typeof, magnitude,
+    product
 )
+from dicelang.distribution import dist, mean, percentile, prob
 from dicelang.helptext import helptext
 from dicelang.bonus import dnd
 
@@ -33,18 +34,22 @@ exposed = {
     'average': statistics.mean,
     'sum': sum,
     'product': product,
-    'isinstance': isinstance,
+    'isinstance': instanceof,
     'typeof': typeof,
     'typename': typename,
     'zip': lzip,
     'shuffled': shuffled,
     'stats': stats,
+    'dist': dist,
+    'prob': prob,
+    'mean': mean,
+    'percentile': percentile,
     'flatten': flatten,
     'rand': rand,
-    'print': pq.print,
-    'print0': pq.print0,
-    'println': pq.println,
-    'println0': pq.println0,
+    'print': print_,
+    'print0': print0,
+    'println': println,
+    'println0': println0,
     'Fraction': Fraction,
     'dnd': dnd.DND,
     'help': helptext,
@@ -0,0 +1,121 @@
+import operator
+from collections.abc import Iterable, MutableSequence
+from typing import Any
+
+from dicelang import memory
+
+
+class Range(MutableSequence):
+    """The list made by `[a to b]` or `[a through b by c]`. It is backed by a
+    `range` until it is changed in place, so its length, membership, indexing and
+    slicing take constant time and loops stream it instead of allocating every
+    item up front. The first change in place turns it into an ordinary list of
+    its items, which it then behaves exactly like.
+
+    A `Range` built from anything other than a `range` is a list from the start,
+    which is how operators that rebuild their operand's type (`[1 to 9] / 2`)
+    make one."""
+    __slots__ = ('items',)
+
+    def __init__(self, items: range | Iterable = ()):
+        self.items = items if type(items) is range else list(items)
+
+    def is_lazy(self) -> bool:
+        return type(self.items) is range
+
+    def materialize(self) -> list:
+        """The items as a list, which they stay from then on."""
+        if type(self.items) is range:
+            memory.reserve(memory.footprint(self), 'range')
+            self.items = list(self.items)
+        return self.items
+
+    def __repr__(self) -> str:
+        return repr(list(self.items) if type(self.items) is range else self.items)
+
+    def __reduce__(self):
+        return self.__class__, (self.items,)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __reversed__(self):
+        return reversed(self.items)
+
+    def __contains__(self, value: Any) -> bool:
+        # A range only finds ints in constant time; it compares anything else to every item.
+        if type(self.items) is range and isinstance(value, float):
+            return value.is_integer() and int(value) in self.items
+        return value in self.items
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.__class__(self.items[index])
+        return self.items[index]
+
+    def __setitem__(self, index, value):
+        self.materialize()[index] = value
+
+    def __delitem__(self, index):
+        del self.materialize()[index]
+
+    def insert(self, index: int, value: Any) -> None:
+        self.materialize().insert(index, value)
+
+    def append(self, value: Any) -> None:
+        self.materialize().append(value)
+
+    def extend(self, values: Iterable) -> None:
+        self.materialize().extend(values)
+
+    def clear(self) -> None:
+        self.items = []
+
+    def sort(self, *, key=None, reverse: bool = False) -> None:
+        self.materialize().sort(key=key, reverse=reverse)
+
+    def index(self, value: Any, *bounds: int) -> int:
+        if type(self.items) is range and not bounds:
+            return self.items.index(value)
+        return super().index(value, *bounds)
+
+    def count(self, value: Any) -> int:
+        return self.items.count(value)
+
+    def copy(self) -> 'Range':
+        return self.__class__(self.items)
+
+    __copy__ = copy
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Range):
+            other = other.items
+        elif not isinstance(other, list):
+            return NotImplemented
+        return len(self.items) == len(other) and all(map(operator.eq, self.items, other))
+
+    def __lt__(self, other: Any) -> bool:
+        return list(self.items) < list(other) if isinstance(other, (list, Range)) else NotImplemented
+
+    def __le__(self, other: Any) -> bool:
+        return list(self.items) <= list(other) if isinstance(other, (list, Range)) else NotImplemented
+
+    def __gt__(self, other: Any) -> bool:
+        return list(self.items) > list(other) if isinstance(other, (list, Range)) else NotImplemented
+
+    def __ge__(self, other: Any) -> bool:
+        return list(self.items) >= list(other) if isinstance(other, (list, Range)) else NotImplemented
+
+    def __add__(self, other: Any) -> 'Range':
+        return self.__class__([*self.items, *other]) if isinstance(other, (list, Range)) else NotImplemented
+
+    def __radd__(self, other: Any) -> list:
+        return [*other, *self.items] if isinstance(other, list) else NotImplemented
+
+    def __mul__(self, times: int) -> 'Range':
+        return self.__class__(list(self.items) * times) if isinstance(times, int) else NotImplemented
+
+    __rmul__ = __mul__
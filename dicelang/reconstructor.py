@@ -41,6 +41,9 @@ class DicelangReconstructor(Interpreter):
     def display(tree):
         return ' '.join(str(c) for c in tree.children)
 
+    def constant(self, tree):
+        return self.visit(tree.children[1])
+
     def priority(self, tree):
         return f'({self.visit(tree.children[0])})'
 
@@ -283,6 +286,31 @@ class DicelangReconstructor(Interpreter):
     def roll_ternary_low(self, tree):
         return ' '.join(self.visit_children(tree))
 
+    def die_explode(self, tree):
+        return ''.join(self.visit_children(tree))
+
+    def die_compound(self, tree):
+        return ''.join(self.visit_children(tree))
+
+    def die_reroll(self, tree):
+        return ' '.join(self.visit_children(tree))
+
+    def die_successes(self, tree):
+        return ' '.join(self.visit_children(tree))
+
+    def die_exploding_successes(self, tree):
+        dice, d, sides, explode, cs, threshold = self.visit_children(tree)
+        return f'{dice} {d} {sides}{explode} {cs} {threshold}'
+
+    def roll_explode(self, tree):
+        return ''.join(self.visit_children(tree))
+
+    def roll_compound(self, tree):
+        return ''.join(self.visit_children(tree))
+
+    def roll_reroll(self, tree):
+        return ' '.join(self.visit_children(tree))
+
     def retrieval_atomic(self, tree):
         visited = self.visit_children(tree)
         primexpr = visited[0]
@@ -6,12 +6,16 @@ class BadResult(Exception):
 
 class Result:
     def __init__(self, *, value: Any = None, console: str | None = None, error: Any = None,
-                 is_helptext: bool = False, exc_type: type = None):
+                 is_helptext: bool = False, exc_type: type = None, seed: int | None = None,
+                 fuel: int | None = None, allocated: int | None = None):
         self.value = value
         self.console = console
         self.error = error
         self.helptext = is_helptext
         self.exc_type = exc_type
+        self.seed = seed  # Replays the execution when passed back to `DicelangInterpreter.execute`
+        self.fuel = fuel  # The work the execution took; see `DicelangInterpreter`
+        self.allocated = allocated  # Bytes of large values the execution built; see `memory.Budget`
 
     def _original_error(self):
         return self.error.split(': ', 1)[-1]
@@ -0,0 +1,88 @@
+import random
+from contextlib import AbstractContextManager, contextmanager
+from contextvars import ContextVar
+from functools import cache
+from typing import Iterator
+
+# The most random bytes generated at once, unless more are needed.
+BlockSize = 1 << 12
+# Pools of fewer dice are cheaper to roll one `getrandbits` call at a time.
+SmallPool = 4
+
+
+@cache
+def byte_faces(sides: int) -> tuple[bytes, bytes, int]:
+    """A table mapping random bytes to faces, the bytes to reject so that every face
+    is equally likely, and the number of bytes kept."""
+    kept = 256 - 256 % sides
+    return bytes(b % sides + 1 for b in range(256)), bytes(range(kept, 256)), kept
+
+
+class DiceRandom(random.Random):
+    """A `random.Random` that rolls dice from a buffer of random bytes, filled a
+    block at a time from `getrandbits`, so that a pool of dice costs a slice and a
+    table lookup rather than a call through `randint` per die. Bytes that would
+    favour some faces are rejected, so every face is equally likely. Single
+    integers, as drawn by `randint`, `choice` and `shuffle`, are already one
+    `getrandbits` call each and are left to `random.Random`.
+
+    The seed is kept as `initial_seed`, so an execution can be replayed exactly by
+    seeding a new generator with it. Without one, the seed is drawn from the
+    `random` module, which keeps `random.seed` reproducible too."""
+
+    def __init__(self, seed: int | None = None):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.initial_seed = seed
+        super().__init__(seed)
+
+    def seed(self, a=None, version: int = 2) -> None:
+        super().seed(a, version)
+        self.buffer = b''
+        self.position = 0
+        # The pools whose sums have been rolled since seeding; see `alias.SumTables`.
+        self.pools = set()
+
+    def take(self, size: int) -> bytes:
+        """The next `size` random bytes."""
+        end = self.position + size
+        if end > len(self.buffer):
+            self.buffer = self.buffer[self.position:] + self.randbytes(max(BlockSize, size))
+            self.position, end = 0, size
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+
+    def rolls(self, sides: int, count: int) -> bytes | list[int]:
+        """`count` rolls of a die with `sides` sides, in the order they were rolled."""
+        if type(sides) is not int or type(count) is not int or sides < 1:
+            return [self.randint(1, sides) for _ in range(count)]
+        if sides > 255 or count < SmallPool:
+            return [self._randbelow(sides) + 1 for _ in range(count)]
+        table, rejected, kept = byte_faces(sides)
+        rolls = b''
+        while len(rolls) < count:
+            needed = count - len(rolls)
+            rolls += self.take(needed if kept == 256 else needed * 256 // kept + 8).translate(table, rejected)
+        return rolls[:count]
+
+
+# The generator of the running execution, or of anything run outside of one. Each
+# thread (and task) sees the generator of its own execution.
+current_generator: ContextVar[DiceRandom] = ContextVar('generator', default=DiceRandom())
+current = current_generator.get
+
+
+@contextmanager
+def using(generator: DiceRandom) -> Iterator[DiceRandom]:
+    """Roll with `generator` for the duration of the context."""
+    token = current_generator.set(generator)
+    try:
+        yield generator
+    finally:
+        current_generator.reset(token)
+
+
+def seeded(seed: int | None = None) -> AbstractContextManager[DiceRandom]:
+    """Roll with a new generator, seeded with `seed`, for the duration of the context."""
+    return using(DiceRandom(seed))
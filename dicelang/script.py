@@ -1,16 +1,22 @@
+import functools
+
 import lark
 from dicelang.interpreter import DicelangInterpreter
 from dicelang.parser import parser, DicelangSyntaxError
 from dicelang.result import Result, failure
-from dicelang.flattener import Flattener
 
-interpreter = DicelangInterpreter()
-fl = Flattener()
+@functools.cache
+def default_interpreter() -> DicelangInterpreter:
+    """The interpreter of `execute` when none is given, started on first use, so that
+    importing this module doesn't open the database."""
+    return DicelangInterpreter()
 
-def execute(owner: str, server: str, channel: str, dicelang_script: str) -> Result:
+def execute(owner: str, server: str, channel: str, dicelang_script: str, seed: int | None = None,
+            interpreter: DicelangInterpreter | None = None) -> Result:
+    if interpreter is None:
+        interpreter = default_interpreter()
     try:
-        ast = parser.parse(dicelang_script)
-        ast_flattened = fl.transform(ast)
+        ast_flattened = parser.parse_flattened(dicelang_script, optimizer=interpreter.optimizer)
     except lark.LarkError as e:
         r = failure(error=e, console="Parsing error. You may have mistyped a keyword, forgot"
                                      " string quotes, mismatched parentheses or brackets, or used"
@@ -18,7 +24,7 @@ def execute(owner: str, server: str, channel: str, dicelang_script: str) -> Resu
     except DicelangSyntaxError as e:
         r = failure(error=e.context, console=f'Syntax error: {e.label}')
     else:
-        r = interpreter.execute(ast_flattened, as_owner=owner, on_server=server, in_channel=channel)
+        r = interpreter.execute(ast_flattened, as_owner=owner, on_server=server, in_channel=channel, seed=seed)
     return r
 
 
@@ -1,20 +1,28 @@
 import traceback
 from copy import deepcopy
 from collections import Counter
+from lark import Token, Tree
 from dicelang.exceptions import BadArguments, BadParameters, Break, Continue, DuplicateParameter, IllegalSignal, Return
 from dicelang.parser import DicelangParser
 from dicelang.reconstructor import DicelangReconstructor
 from dicelang.special import Undefined
 from dicelang.utils import is_sorted
-from dicelang.flattener import Flattener
 
 
 class UserFunction:
     """Construct a user-created function specified by Dicelang code."""
+    FormatVersion = 1
     reconstructor = DicelangReconstructor()
+    # Optimizes functions built from source. Functions are called, and their
+    # parameters evaluated, by the interpreter of the execution doing so.
     interpreter = None
-    flattener = Flattener()
     parser = DicelangParser(start='function')
+    # Bodies of functions called at least `compile_after` times are compiled by
+    # `lowering` (a `BytecodeCompiler`), if one is set. None disables compilation.
+    compile_after = 8
+    lowering = None
+    calls = 0
+    compiled = None
 
     class SerializationManager:
         def __enter__(self):
@@ -38,8 +46,7 @@ class UserFunction:
     def __init__(self, code_string, closed_over=None):
         """Construct a user-created function from its source code and the
         scope variables it closes over."""
-        ast = self.parser.parse(code_string)
-        ast = self.flattener.transform(ast)
+        ast = self.parser.parse_flattened(code_string, optimizer=self.interpreter.optimizer)
         *params, self.code = ast.children
         self.params = [self.interpreter.visit(p) for p in params]
         self.required = len(self.params) - sum(p.is_default() for p in self.params)
@@ -54,7 +61,8 @@ class UserFunction:
     __repr__ = standard_repr
 
     def alt_repr(self):
-        return f'{self.__class__.__name__}({self.source!r}, {self.closed_over!r})'
+        return (f'{self.__class__.__name__}.restore({self.FormatVersion!r}, {self.source!r},'
+                f' {self.pack(self.code)!r}, {self.params!r}, {self.closed_over!r})')
 
     def __enter__(self):
         self.__repr__ = self.alt_repr
@@ -64,12 +72,11 @@ class UserFunction:
 
     @classmethod
     def from_ast(cls, interpreter, tree, closed_over=None):
-        """Initialize a function from its abstract syntax tree."""
-        if cls.interpreter is None:
-            cls.interpreter = interpreter
+        """Initialize a function from its abstract syntax tree, evaluating its
+        parameters with `interpreter`."""
         self = object.__new__(cls)
         self.code = tree.children[-1]
-        self.params = [cls.interpreter.visit(c) for c in tree.children[:-1]]
+        self.params = [interpreter.visit(c) for c in tree.children[:-1]]
         self.validate()
         self.required = len(self.params) - sum(p.is_default() for p in self.params)
         self.closed_over = closed_over or [{}]
@@ -77,6 +84,56 @@ class UserFunction:
         self.source = cls.reconstruct(tree)
         return self
 
+    @classmethod
+    def restore(cls, version, source, code, params, closed_over=None):
+        """Rebuild a function from its serialized form without parsing it. If it
+        was serialized by a different `FormatVersion`, recompile it from source."""
+        if version != cls.FormatVersion:
+            return cls(source, closed_over)
+        self = object.__new__(cls)
+        self.code = cls.unpack(code)
+        if cls.interpreter is not None:
+            self.code = cls.interpreter.optimizer.transform(self.code)
+        self.params = params
+        self.required = len(self.params) - sum(p.is_default() for p in self.params)
+        self.closed_over = closed_over or [{}]
+        self.this = Undefined
+        self.source = source
+        return self
+
+    def __reduce__(self):
+        # The closure is passed as state rather than as an argument so that pickle
+        # can handle functions that close over themselves.
+        return self.restore, (self.FormatVersion, self.source, self.pack(self.code), self.params), self.closed_over
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # Pickled before `FormatVersion` existed
+            self.__dict__.update(state)
+        else:
+            self.closed_over = state or [{}]
+
+    @staticmethod
+    def pack(tree):
+        """Encode a syntax tree as nested tuples: `(rule, children)` for subtrees
+        and `(type, text)` for tokens. Source positions and folded constants
+        are dropped; `restore` re-optimizes the tree."""
+        if isinstance(tree, Token):
+            return tree.type, str(tree)
+        if isinstance(tree, Tree):
+            if tree.data == 'constant':
+                return UserFunction.pack(tree.children[1])
+            return str(tree.data), tuple(UserFunction.pack(c) for c in tree.children)
+        return tree
+
+    @staticmethod
+    def unpack(packed):
+        if packed is None:
+            return None
+        name, rest = packed
+        if isinstance(rest, str):
+            return Token(name, rest)
+        return Tree(name, [UserFunction.unpack(c) for c in rest])
+
     def __deepcopy__(self, *args, **kwargs):
         new = object.__new__(self.__class__)
         new.code = deepcopy(self.code)
@@ -124,15 +181,21 @@ class UserFunction:
         return marshalled
 
     def __call__(self, interpreter, *args, **kwargs):
-        """Execute the function with the passed arguments and the current
-        interpreter state."""
+        """Execute the function with the passed arguments in the execution run by
+        `interpreter`, on its call stack."""
         arguments = {'self': self.this}
         arguments.update(self.marshal(*args, **kwargs))
         interpreter.call_stack.function_push(arguments, self.closed_over)
-        if self.interpreter is None:
-            self.__class__.interpreter = interpreter
+        interpreter.burn(1)
+        self.calls += 1
+        if self.compiled is None and self.lowering is not None and self.compile_after is not None \
+                and self.calls >= self.compile_after:
+            self.compiled = self.lowering.compile(self.code) or False
         try:
-            out = interpreter.visit(self.code.children[0])
+            if self.compiled:
+                out = self.compiled(interpreter)
+            else:
+                out = interpreter.visit(self.code.children[0])
         except Return as rs:
             out = rs.unwrap()
         except (Break, Continue) as e:
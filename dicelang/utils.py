@@ -5,6 +5,7 @@ from numbers import Number
 from operator import add
 from typing import Any, Sequence, TypeVar
 from dicelang.exceptions import InvalidSubscript
+from dicelang.ranges import Range
 
 T = TypeVar('T')
 Unfilled = sentinel.create()
@@ -79,7 +80,7 @@ def split(vector: Sequence[Any], on: Any) -> tuple[Sequence[Any], Sequence[Any]]
 
 
 def isordered(x: Any) -> bool:
-    return isinstance(x, (tuple, list))
+    return isinstance(x, (tuple, list, Range))
 
 
 def isvector(x: Any) -> bool:
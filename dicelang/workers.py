@@ -0,0 +1,167 @@
+import math
+import multiprocessing
+import os
+import pickle
+import queue
+import resource
+import signal
+from multiprocessing.connection import Connection
+
+from dicelang import script
+from dicelang.exceptions import ExcessiveRuntime, WorkerLost
+from dicelang.interpreter import DicelangInterpreter
+from dicelang.lookup import BasicStore, CallStack, Location, PersistentStore
+from dicelang.parser import parser
+from dicelang.result import Result, failure
+
+# Commands run while the worker starts, so the parser and interpreter are warm before the first request.
+WarmUp = ('1d20 + 5', '4d6kh3 repeat 6', 'x = [1 to 10]; for i in x do i * 2')
+
+
+def portable(r: Result) -> bytes:
+    """`r`, pickled to be sent to the parent. Errors are only ever displayed, so they
+    are sent as text, as are values that can't be pickled."""
+    if r.error is not None and not isinstance(r.error, str):
+        r.error = f'{r.error}'
+    try:
+        return pickle.dumps(r)
+    except Exception:
+        r.value = f'{r.value}'
+        return pickle.dumps(r)
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def serve(connection: Connection, db_location: Location | None, memory_limit: int | None,
+          cpu_limit: int | None) -> None:
+    """Run requests from `connection` until it is closed: the arguments of
+    `script.execute`, each answered with its pickled result.
+
+    The address space of the worker is capped at `memory_limit` bytes, so that
+    allocations beyond it raise `MemoryError` rather than exhaust the host. Before
+    each request, the soft CPU limit is moved to `cpu_limit` seconds past the time
+    used so far; a command that exceeds it is killed by `SIGXCPU`."""
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    store = BasicStore() if db_location is None else PersistentStore(db_location)
+    interpreter = DicelangInterpreter(CallStack(store))
+    for code in WarmUp:
+        interpreter.execute_test(parser.parse_flattened(code, optimizer=interpreter.optimizer))
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    connection.send_bytes(b'')
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if isinstance(store, PersistentStore):
+            store.forget()
+        if cpu_limit is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (math.ceil(cpu_seconds()) + cpu_limit, hard))
+        r = script.execute(*request, interpreter=interpreter)
+        connection.send_bytes(portable(r))
+
+
+class Worker:
+    """A worker process and the parent's end of its connection."""
+
+    def __init__(self, context, *args):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(child, *args), daemon=True)
+        self.process.start()
+        child.close()
+        # The worker says it is ready once it has warmed up.
+        self.connection.recv_bytes()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class WorkerPool:
+    """Runs `script.execute` in a pool of worker processes, started in advance, so
+    that a command can't block its caller for longer than `timeout` seconds or take
+    down the process that serves every other command.
+
+    Each worker keeps its own interpreter and warm parser between requests and is
+    limited to `memory_limit` bytes of address space and `cpu_limit` seconds of CPU
+    per request. A worker that doesn't answer within `timeout` is killed, as is one
+    that exceeds its limits; either way it is replaced by a fresh one, and the
+    command fails with `ExcessiveRuntime` or `WorkerLost`. If no fresh worker can
+    be started, the next command to need one tries again.
+
+    Workers share the variables in the SQLite database at `db_location`, rereading
+    them from the database on each request; with no database, each worker has
+    variables of its own. `execute` may be called from any number of threads at
+    once, and waits for a worker to be free."""
+
+    def __init__(self, workers: int | None = None, timeout: float = 20, db_location: Location | None = None,
+                 memory_limit: int | None = 1 << 30, cpu_limit: int | None = 15):
+        self.timeout = timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.arguments = db_location, memory_limit, cpu_limit
+        self.workers = [self.spawn() for _ in range(workers or os.cpu_count() or 1)]
+        self.idle = queue.SimpleQueue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.respawned = 0
+
+    def __enter__(self) -> 'WorkerPool':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def spawn(self) -> Worker:
+        return Worker(self.context, *self.arguments)
+
+    def replace(self, worker: Worker | None) -> Worker | None:
+        """Kill `worker`, if any, and start a fresh one in its place; None if that
+        fails, in which case the slot is left empty."""
+        if worker is not None:
+            worker.kill()
+            self.workers.remove(worker)
+        try:
+            fresh = self.spawn()
+        except (EOFError, OSError):
+            return None
+        self.workers.append(fresh)
+        self.respawned += 1
+        return fresh
+
+    def execute(self, owner: str, server: str, channel: str, dicelang_script: str, seed: int | None = None) -> Result:
+        worker = self.idle.get()
+        try:
+            if worker is None and (worker := self.replace(None)) is None:
+                error = WorkerLost('no worker could be started to execute command')
+                return failure(error=f'{error.__class__.__name__}: {error!s}', console='', exc_type=error.__class__)
+            worker.connection.send((owner, server, channel, dicelang_script, seed))
+            if not worker.connection.poll(self.timeout):
+                worker = self.replace(worker)
+                error = ExcessiveRuntime(f'over {self.timeout} seconds to execute command')
+                return failure(error=f'{error.__class__.__name__}: {error!s}', console='', exc_type=error.__class__)
+            return pickle.loads(worker.connection.recv_bytes())
+        except (EOFError, OSError):
+            worker.process.join()
+            exitcode = worker.process.exitcode
+            worker = self.replace(worker)
+            if exitcode == -signal.SIGXCPU:
+                error = ExcessiveRuntime(f'over {self.arguments[2]} seconds of CPU time to execute command')
+            else:
+                error = WorkerLost(f'worker exited with code {exitcode} while executing command')
+            return failure(error=f'{error.__class__.__name__}: {error!s}', console='', exc_type=error.__class__)
+        finally:
+            self.idle.put(worker)
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.connection.close()
+        for worker in self.workers:
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
@@ -0,0 +1,87 @@
+import asyncio
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from dicelang.lookup import Location
+from dicelang.result import Result
+from dicelang.workers import WorkerPool
+
+
+class Dispatcher:
+    """Runs Dicelang commands for the bots without blocking their event loop.
+
+    Commands are executed by a `WorkerPool` of `workers` processes, each waited on
+    by a thread of its own, so at most `workers` commands run at once and the rest
+    wait their turn. The commands of an owner, and those of a server, run one at a
+    time and in the order they arrived, as they did when commands ran on the event
+    loop: a command always sees the variables left by the one before it.
+
+    `waiting` is the number of commands waiting to run, `running` the number
+    running; `stats` reports those along with totals since the dispatcher started."""
+
+    def __init__(self, workers: int, db_location: Location, timeout: float = 20):
+        self.pool = WorkerPool(workers, timeout=timeout, db_location=db_location)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='dicelang')
+        self.slots = asyncio.Semaphore(workers)
+        self.locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self.workers = workers
+        self.waiting = 0
+        self.running = 0
+        self.started = 0
+        self.completed = 0
+        self.peak_waiting = 0
+        self.waited = 0.0
+
+    def __enter__(self) -> 'Dispatcher':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def lock(self, key: str) -> asyncio.Lock:
+        """The lock held while a command of `key` runs, shared with every other
+        command of `key` waiting or running; once none are, it is dropped."""
+        if (lock := self.locks.get(key)) is None:
+            self.locks[key] = lock = asyncio.Lock()
+        return lock
+
+    async def execute(self, owner: str, server: str, channel: str, dicelang: str) -> Result:
+        # Owner locks are always taken before server locks, so commands can't wait on each other in a cycle.
+        owner_lock, server_lock = self.lock(f'owner:{owner}'), self.lock(f'server:{server}')
+        enqueued = time.monotonic()
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        admitted = False
+        try:
+            async with owner_lock, server_lock, self.slots:
+                self.waiting -= 1
+                self.running += 1
+                self.started += 1
+                admitted = True
+                self.waited += time.monotonic() - enqueued
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, self.pool.execute, owner, server, channel, dicelang)
+        finally:
+            if admitted:
+                self.running -= 1
+                self.completed += 1
+            else:
+                self.waiting -= 1
+
+    @staticmethod
+    async def render(function: Callable[..., Any], *args) -> Any:
+        """`function(*args)`, called in a thread: replies to large results take a
+        while to format and to write to attachments."""
+        return await asyncio.to_thread(function, *args)
+
+    def stats(self) -> dict:
+        return {'workers': self.workers, 'waiting': self.waiting, 'running': self.running,
+                'completed': self.completed, 'peak_waiting': self.peak_waiting,
+                'mean_wait': self.waited / self.started if self.started else 0.0,
+                'respawned': self.pool.respawned}
+
+    def close(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
+        self.pool.close()
@@ -1,10 +1,41 @@
+import ast
+import asyncio
+import datetime
+import itertools
+import math
+import pickle
+import random
+import statistics
+import tempfile
+import time
 import unittest
-from dicelang.interpreter import DicelangInterpreter
-from dicelang.parser import parser
-from dicelang.script import Flattener
-from dicelang.exceptions import ImpossibleDice
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from functools import partial
+from unittest import mock
+from pathlib import Path
+from lark import Tree, UnexpectedInput
+from dicelang import dicecore, distribution, memory, native, rng
+from dicelang.context import ExecutionContext
+from dicelang.interpreter import DicelangInterpreter, compiler
+from dicelang.parser import parser, DicelangParser, DicelangSyntaxError
+from dicelang.user_function import UserFunction
+from dicelang.flattener import Flattener
+from dicelang.exceptions import BadArguments, ExcessiveRuntime, ExcessiveSize, ImpossibleDice, WorkerLost
+from dicelang.cache import ParseCache, tree_size
+from dicelang.fast_parser import Unsupported
+from dicelang.alias import AliasTable, SumTables
+from dicelang.bytecode import Lowering
+from dicelang.lookup import BasicStore, CallStack, IdentType, Ownership, SelfPruningStore
+from dicelang.optimizer import Discarded, Optimizer
+from dicelang.ranges import Range
+from dicelang.workers import WorkerPool
+from messaging.dispatch import Dispatcher
 
-di = DicelangInterpreter()
+# Variables the tests store go to a database of their own, not the bot's.
+storage = tempfile.TemporaryDirectory()
+di = DicelangInterpreter(CallStack(SelfPruningStore(Path(storage.name) / 'persistence.db')))
 fl = Flattener()
 
 def execute(s: str):
@@ -168,6 +199,27 @@ class TestMathematics(unittest.TestCase):
         r = execute('-5 ** 2')
         self.assertTrue(r.unwrap_eq(-5 ** 2))
 
+    def test_large_exponents(self):
+        r = execute('(3 ** 1000001) % 1000007')
+        self.assertTrue(r.unwrap_eq(pow(3, 1000001, 1000007)))
+        r = execute('(-1) ** (10 ** 12 + 1)')
+        self.assertTrue(r.unwrap_eq(-1))
+        start = datetime.datetime.now()
+        r = execute('10 ** 10 ** 9')
+        self.assertIs(r.exc_type, ExcessiveSize)
+        self.assertLess(datetime.datetime.now() - start, datetime.timedelta(seconds=1))
+
+    def test_augmented_exponents(self):
+        closure = DicelangInterpreter(CallStack(BasicStore()), engine='closure')
+        function = 'f = (n) -> begin x = 2; x **= n; x end; [f(3), f(10 ** 8)]'
+        for run in (execute, lambda code: closure.execute(parser.parse(code))):
+            self.assertTrue(run('x = 3; x **= 4; x').unwrap_eq(81))
+            start = time.monotonic()
+            self.assertIs(run('x = 2; x **= 10 ** 8').exc_type, ExcessiveSize)
+            with mock.patch.object(UserFunction, 'compile_after', 1):
+                self.assertIs(run(function).exc_type, ExcessiveSize)
+            self.assertLess(time.monotonic() - start, 1)
+
 
 class TestSpecials(unittest.TestCase):
     def test_sum_or_join(self):
@@ -196,6 +248,38 @@ class TestSpecials(unittest.TestCase):
         r = execute('5 @! [1, 2, 3, 4, 5]')
         self.assertTrue(set(r.unwrap()) == result_pool)
 
+
+class TestStats(unittest.TestCase):
+    def test_matches_statistics(self):
+        random.seed(15)
+        for data in ([5], [1, 2], [3, 1, 2], [2, 2, 2, 2], [0.5, 2.25, 1.0, -4],
+                     [random.randint(1, 20) for _ in range(1001)], [random.random() for _ in range(100)]):
+            with self.subTest(data=data[:8]):
+                s = native.stats(data)
+                ranked, n = sorted(data), len(data)
+                self.assertAlmostEqual(s['mu'], statistics.mean(data))
+                self.assertAlmostEqual(s['sigma'], statistics.stdev(data) if n > 1 else 0.0)
+                self.assertEqual((s['minimum'], s['maximum'], s['size']), (ranked[0], ranked[-1], n))
+                self.assertEqual(s['sum'], sum(data))
+                self.assertEqual(s['median'], statistics.median(data))
+                self.assertEqual(s['q1'], statistics.median(ranked[:n // 2] or ranked))
+                self.assertEqual(s['q3'], statistics.median(ranked[(n + 1) // 2:] or ranked))
+
+    def test_inputs(self):
+        expected = native.stats([1, 1, 2, 6])
+        self.assertEqual(execute('stats([1, 1, 2, 6])').unwrap(), expected)
+        self.assertEqual(execute('stats({"a": 1, "b": 6, "c": 1, "d": 2})').unwrap(), expected)
+        self.assertEqual(execute('stats({1: 2, 2: 1, 6: 1, 4: 0}, weighted=True)').unwrap(), expected)
+        self.assertEqual(native.stats(iter([6, 2, 1, 1])), expected)
+        for code in ('stats([])', 'stats([1, 2], weighted=True)', 'stats({1: 0.5}, weighted=True)'):
+            with self.subTest(code=code):
+                self.assertIs(execute(code).exc_type, BadArguments)
+
+    def test_streaming(self):
+        s = native.stats(x % 6 + 1 for x in range(1000000))
+        self.assertEqual((s['size'], s['sum'], s['median'], s['q1'], s['q3']), (1000000, 3499996, 3, 2, 5))
+
+
 class TestDice(unittest.TestCase):
     def test_die_binary(self):
         r = execute('3d6')
@@ -229,6 +313,356 @@ class TestDice(unittest.TestCase):
         r = execute('3d6kl2')
         self.assertTrue(2 <= r.unwrap() <= 12)
 
+    def test_large_pools(self):
+        r = execute('1000000d6')
+        self.assertTrue(1000000 <= r.unwrap() <= 6000000)
+        r = execute('1000r4xl10')
+        self.assertEqual(len(rolls := r.unwrap()), 990)
+        self.assertEqual(rolls, sorted(rolls))
+        self.assertTrue(set(rolls) <= {1, 2, 3, 4})
+
+    def test_exploding(self):
+        rng.current().seed(19)
+        rolls = execute('30r6!').unwrap()
+        self.assertEqual(len(rolls), 30 + rolls.count(6))
+        totals = execute('30r6!!').unwrap()
+        self.assertEqual(len(totals), 30)
+        self.assertTrue(all(total % 6 for total in totals))
+        self.assertTrue(execute('4d6! > 3').unwrap())
+        self.assertEqual(execute('2d6! cs 7').unwrap(), 0)
+        for code, error in (('1d1!', ImpossibleDice), ('0d6!!', ImpossibleDice), ('10000000d6!', ExcessiveSize)):
+            with self.subTest(code=code):
+                self.assertIs(execute(code).exc_type, error)
+        with (mock.patch.object(dicecore, 'MaxExplosions', 3),
+              mock.patch.object(rng.current(), 'rolls', side_effect=lambda sides, count: [sides] * count)):
+            self.assertEqual(dicecore.explode(2, 6, as_sum=False), [6] * 8)
+            self.assertEqual(dicecore.compound(2, 6, as_sum=False), [24, 24])
+
+    def test_reroll_and_successes(self):
+        rolls = execute('40r6xr3').unwrap()
+        self.assertEqual(len(rolls), 40)
+        self.assertTrue(set(rolls) <= set(range(1, 7)))
+        self.assertEqual(execute('5d10 cs 11').unwrap(), 0)
+        self.assertEqual(execute('5d10 cs 1').unwrap(), 5)
+        self.assertEqual(execute('1000000d6 cs 1').unwrap(), 1000000)
+        # Successes are counted without rolling the dice one by one.
+        start = time.monotonic()
+        self.assertLess(abs(execute('30000000 d 10000000 cs 2').unwrap() - 29999997), 100)
+        self.assertLess(time.monotonic() - start, 1)
+        for as_sum, expected in ((False, [4, 5, 3, 6]), (True, 18)):
+            with mock.patch.object(rng.current(), 'rolls', side_effect=[[1, 5, 2, 6], [4, 3]]):
+                self.assertEqual(dicecore.reroll_below(4, 6, 3, as_sum), expected)
+
+    def test_suffixes_unspaced(self):
+        for code, rule in (('10d10!cs8', 'die_exploding_successes'), ('5d10! cs 8', 'die_exploding_successes'),
+                           ('5d10cs8', 'die_successes'), ('40d6xr3', 'die_reroll'), ('40r6xr3', 'roll_reroll'),
+                           ('4d6!!', 'die_compound'), ('3r6!!', 'roll_compound'), ('4d6! ! 2', 'coinflip')):
+            with self.subTest(code=code):
+                self.assertEqual(parser.parse(code).children[0].data, rule)
+        for code in ('4d6!!2', 'cs8 = 1', 'xr = 1'):
+            with self.subTest(code=code):
+                self.assertRaises((DicelangSyntaxError, UnexpectedInput), parser.parse, code)
+        self.assertEqual(execute('csv = 2; xr3x = 3; csv * xr3x').unwrap(), 6)
+
+    def test_pool_means(self):
+        trials = 20000
+        rng.current().seed(trials)
+        for roll, args, mean in ((dicecore.explode, (1, 6), 4.2), (dicecore.reroll_below, (1, 6, 3), 25 / 6),
+                                 (dicecore.count_successes, (1, 10, 8), 0.3),
+                                 (dicecore.count_exploding_successes, (1, 10, 8), 1 / 3)):
+            with self.subTest(roll=roll.__name__):
+                observed = statistics.mean(roll(*args) for _ in range(trials))
+                self.assertAlmostEqual(observed, mean, delta=0.05 * mean)
+
+    def test_selected_streams_rolls(self):
+        generator = rng.current()
+        with (mock.patch.object(dicecore, 'RollBlock', 8),
+              mock.patch.object(generator, 'rolls', wraps=generator.rolls) as rolls):
+            for mode, target in itertools.product(dicecore.Mode, (dicecore.Target.LOWEST, dicecore.Target.HIGHEST)):
+                for n, as_sum in itertools.product((1, 3, 97), (True, False)):
+                    with self.subTest(mode=mode, target=target, n=n, as_sum=as_sum):
+                        kept = dicecore.selected(100, 20, n, mode, target, as_sum)
+                        count = n if mode is dicecore.Mode.KEEP else 100 - n
+                        if as_sum:
+                            self.assertTrue(count <= kept <= 20 * count)
+                        else:
+                            self.assertEqual(len(kept), count)
+        self.assertEqual(max(call.args[1] for call in rolls.call_args_list), 8)
+
+    def test_selected_matches_sorting(self):
+        for mode, target in itertools.product(dicecore.Mode, (dicecore.Target.LOWEST, dicecore.Target.HIGHEST)):
+            for dice, n, as_sum in itertools.product((5, 40), (1, 2, 4), (True, False)):
+                with self.subTest(mode=mode, target=target, dice=dice, n=n, as_sum=as_sum):
+                    rng.current().seed(dice * n)
+                    expected = dicecore.sorting(dice, 20, n, mode, target, as_sum)
+                    rng.current().seed(dice * n)
+                    self.assertEqual(dicecore.selected(dice, 20, n, mode, target, as_sum), expected)
+
+    def test_counted_distribution(self):
+        dice, sides, n, trials = 6, 3, 2, 20000
+        outcomes = list(itertools.product(range(1, sides + 1), repeat=dice))
+        rolls = [sorted(outcome) for outcome in outcomes]
+        selections = {dicecore.keep_all: lambda r: r, dicecore.keep_highest: lambda r: r[-n:],
+                      dicecore.keep_lowest: lambda r: r[:n], dicecore.drop_highest: lambda r: r[:-n],
+                      dicecore.drop_lowest: lambda r: r[n:]}
+        rng.current().seed(dice)
+        for roll, select in selections.items():
+            with self.subTest(roll=roll.__name__):
+                expected = Counter(sum(select(r)) for r in rolls)
+                with (mock.patch.object(dicecore, 'CountingFactor', 1),
+                      mock.patch.object(dicecore.sum_tables, 'enabled', False)):
+                    args = (dice, sides) if roll is dicecore.keep_all else (dice, sides, n)
+                    observed = Counter(roll(*args) for _ in range(trials))
+                self.assertLessEqual(set(observed), set(expected))
+                chi_squared = sum((observed[total] - trials * count / len(outcomes)) ** 2
+                                  / (trials * count / len(outcomes)) for total, count in expected.items())
+                df = len(expected) - 1
+                self.assertLess(chi_squared, df + 4 * math.sqrt(2 * df))
+
+
+class TestRandom(unittest.TestCase):
+    def test_replay(self):
+        tree = parser.parse('[4d6kh3 repeat 6, 1000d1000, 3r300, 1 ! 2, @[1 through 9], 3 @! [1 through 9], '
+                            'shuffled([1 through 9]), rand()]')
+        first = di.execute(tree)
+        self.assertIsNotNone(first.seed)
+        replayed = di.execute(tree, seed=first.seed)
+        self.assertEqual(replayed.seed, first.seed)
+        self.assertEqual(replayed.value, first.value)
+        self.assertNotEqual(di.execute(tree, seed=first.seed + 1).value, first.value)
+
+    def test_executions_isolated(self):
+        generator = rng.current()
+        r = di.execute(parser.parse('1d6 ! 2'), seed=1)
+        self.assertIs(rng.current(), generator)
+        self.assertEqual(r.seed, 1)
+
+    def test_uniform(self):
+        generator = rng.DiceRandom(6)
+        for sides, rolls in ((6, lambda n: generator.rolls(6, n)), (100, lambda n: generator.rolls(100, n)),
+                             (300, lambda n: generator.rolls(300, n)), (7, lambda n: [generator.randint(1, 7) for _ in range(n)])):
+            with self.subTest(sides=sides):
+                trials = 200 * sides
+                observed = Counter(rolls(trials))
+                self.assertEqual(set(observed), set(range(1, sides + 1)))
+                chi_squared = sum((observed[face] - 200) ** 2 / 200 for face in range(1, sides + 1))
+                df = sides - 1
+                self.assertLess(chi_squared, df + 4 * math.sqrt(2 * df))
+
+
+class TestDistribution(unittest.TestCase):
+    def test_pools_match_enumeration(self):
+        for dice, sides in ((4, 6), (5, 4), (3, 8)):
+            for mode, target, n in itertools.product(dicecore.Mode, dicecore.Target, range(1, dice + 1)):
+                if mode is dicecore.Mode.DROP and n == dice:
+                    continue
+                with self.subTest(dice=dice, sides=sides, mode=mode, target=target, n=n):
+                    expected = Counter()
+                    for outcome in itertools.product(range(1, sides + 1), repeat=dice):
+                        with mock.patch.object(rng.current(), 'rolls', return_value=outcome):
+                            expected[dicecore.sorting(dice, sides, n, mode, target, True)] += 1
+                    self.assertEqual(distribution.pool(dice, sides, n, mode, target), expected)
+
+    def test_builtins(self):
+        self.assertTrue(execute('prob("1d20 + 5 >= 15")').unwrap_eq(0.55))
+        self.assertAlmostEqual(execute('prob("5 <= 1d20 <= 15 and 1d6 == 6")').unwrap(), 11 / 120)
+        self.assertTrue(execute('mean("2d6 + 3")').unwrap_eq(10))
+        self.assertTrue(execute('mean("1d6 * 1d6")').unwrap_eq(12.25))
+        self.assertTrue(execute('percentile("3d6", 50)').unwrap_eq(10))
+        self.assertTrue(execute('percentile("3d6", 100)').unwrap_eq(18))
+        self.assertTrue(execute('dist("(1 + 1)d2 - 1")').unwrap_eq({1: 0.25, 2: 0.5, 3: 0.25}))
+        self.assertTrue(execute('prob(() -> 2d20kh1 >= 15)').unwrap_eq(0.51))
+
+    def test_large_pools(self):
+        self.assertAlmostEqual(execute('mean("300d6")').unwrap(), 1050)
+        self.assertAlmostEqual(sum(execute('dist("500d20kh3")').unwrap().values()), 1)
+
+    def test_large_selections_refused(self):
+        for code in ('mean("60d60kh30")', 'dist("100d100kh50")', 'dist("500d20kh497")', 'prob("10d100kh7 > 600")'):
+            with self.subTest(code=code):
+                start = time.monotonic()
+                self.assertIs(execute(code).exc_type, ExcessiveSize)
+                self.assertLess(time.monotonic() - start, 1)
+        interpreter = DicelangInterpreter(CallStack(BasicStore()), time_limit_seconds=0.05)
+        start = time.monotonic()
+        self.assertIs(interpreter.execute(parser.parse('mean("40d40kh20")')).exc_type, ExcessiveRuntime)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_unsupported(self):
+        for code in ('mean("1r6")', 'mean("x d 6")', 'mean("1d6 d 6")', 'mean("1d6; 1d6")', 'mean(6)'):
+            with self.subTest(code=code):
+                self.assertIs(execute(code).exc_type, BadArguments)
+        self.assertIs(execute('mean("0d6")').exc_type, ImpossibleDice)
+
+
+class TestSumTables(unittest.TestCase):
+    def test_alias_table_exact(self):
+        weights = distribution.pool(4, 6, 3, dicecore.Mode.KEEP, dicecore.Target.HIGHEST)
+        table = AliasTable(weights)
+        # Every random integer lands on exactly one outcome, as often as its weight says.
+        columns = Counter()
+        for drawn in range(table.size):
+            column, height = divmod(drawn, table.total)
+            columns[table.values[column if height < table.thresholds[column] else table.aliases[column]]] += 1
+        self.assertEqual(columns, Counter({total: weight * len(table) for total, weight in weights.items()}))
+
+    def test_draws_match_distribution(self):
+        trials, tables = 20000, SumTables()
+        tables.weigh = distribution.pool
+        rng.current().seed(trials)
+        expected = distribution.pool(4, 6, 3, dicecore.Mode.KEEP, dicecore.Target.HIGHEST)
+        tables.draw(4, 6, 3, dicecore.Mode.KEEP, dicecore.Target.HIGHEST)
+        observed = Counter(tables.draw(4, 6, 3, dicecore.Mode.KEEP, dicecore.Target.HIGHEST) for _ in range(trials))
+        self.assertLessEqual(set(observed), set(expected))
+        chi_squared = sum((observed[total] - trials * weight / 6 ** 4) ** 2 / (trials * weight / 6 ** 4)
+                          for total, weight in expected.items())
+        df = len(expected) - 1
+        self.assertLess(chi_squared, df + 4 * math.sqrt(2 * df))
+
+    def test_used_on_second_roll(self):
+        tables = SumTables()
+        tables.weigh = distribution.pool
+        key = 3, 6, 3, dicecore.Mode.KEEP, dicecore.Target.HIGHEST
+        rng.current().seed(3)
+        self.assertIsNone(tables.draw(*key))
+        self.assertNotIn(key, tables)
+        self.assertTrue(3 <= tables.draw(*key) <= 18)
+        self.assertTrue(3 <= tables.draw(*key) <= 18)
+        self.assertIn(key, tables)
+        self.assertEqual(tables.stats(), {'entries': 1, 'outcomes': 16, 'hits': 1, 'misses': 1, 'evictions': 0,
+                                          'hit_rate': 0.5, 'enabled': True})
+        # A reseeded generator starts over, so its rolls don't depend on the cache.
+        rng.current().seed(3)
+        self.assertIsNone(tables.draw(*key))
+        self.assertEqual(tables.hits, 1)
+
+    def test_limits(self):
+        tables = SumTables(max_entries=2, max_pool=100)
+        rng.current().seed(2)
+        for key in ((2, 6), (2, 6)):
+            self.assertIsNone(tables.draw(*key, 2, dicecore.Mode.KEEP, dicecore.Target.HIGHEST))
+        tables.weigh = distribution.pool
+        for key in ((1, 20), (20, 6), (2.0, 6)):
+            with self.subTest(key=key):
+                for _ in range(3):
+                    self.assertIsNone(tables.draw(*key, 2, dicecore.Mode.KEEP, dicecore.Target.HIGHEST))
+        for sides in (4, 6, 8):
+            for _ in range(2):
+                tables.draw(2, sides, 2, dicecore.Mode.KEEP, dicecore.Target.HIGHEST)
+        self.assertEqual(len(tables), 2)
+        self.assertEqual(tables.evictions, 1)
+        tables.disable()
+        self.assertEqual(len(tables), 0)
+        self.assertIsNone(tables.draw(2, 8, 2, dicecore.Mode.KEEP, dicecore.Target.HIGHEST))
+
+    def test_kernel_replay(self):
+        tree = parser.parse('[4d6kh3 repeat 20, 3d8 repeat 20]')
+        first = di.execute(tree)
+        self.assertGreater(dicecore.sum_tables.hits, 0)
+        self.assertEqual(di.execute(tree, seed=first.seed).value, first.value)
+
+
+class TestBatch(unittest.TestCase):
+    @staticmethod
+    def repeated(code: str) -> Tree:
+        return next(parser.parse(f'{code} repeat 20').find_data('repetition')).children[0]
+
+    def test_planned(self):
+        for code in ('1d20 + 5 >= 15', '4d6kh3', '(3 + 1)d6xl1', '-1d4 * 2.5', '1 < 2d6 < 12 and 1d6 == 6'):
+            with self.subTest(code=code):
+                self.assertIsNotNone(compiler.batches.plan(self.repeated(code)))
+        for code in ('1r6', 'x d 6', '1d6 + f()', '1d6 ** 2', '[1d6]', '6'):
+            with self.subTest(code=code):
+                self.assertIsNone(compiler.batches.plan(self.repeated(code)))
+
+    def test_matches_distribution(self):
+        trials = 20000
+        random.seed(trials)
+        for code in ('1d20 + 5 >= 15', '4d6kh3', '5d4xh2', '3d6 * 2 - 1', '2d8 // 3', '1d300', '5 <= 1d20 <= 15 and 1d6 > 1'):
+            with self.subTest(code=code):
+                observed = Counter(execute(f'{code} repeat {trials}').unwrap())
+                expected = distribution.distributions.evaluate(code)
+                self.assertLessEqual(set(observed), set(expected.weights))
+                chi_squared = sum((observed[value] - trials * weight / expected.total) ** 2
+                                  / (trials * weight / expected.total) for value, weight in expected.weights.items())
+                df = len(expected.weights) - 1
+                self.assertLess(chi_squared, df + 4 * math.sqrt(2 * df))
+
+    def test_fallback(self):
+        self.assertEqual(len(execute('x = 3; x d 6 repeat 20').unwrap()), 20)
+        self.assertEqual(len(execute('1r6 repeat 20').unwrap()), 20)
+        self.assertEqual(execute('1d6 repeat -1').unwrap(), [])
+        for code in ('2.5d6', '1d0', '0d6', '1d6 / 0', '"a" + 1d6'):
+            with self.subTest(code=code):
+                expected = execute(f'{code} repeat 5').error
+                self.assertEqual(execute(f'{code} repeat 20').error, expected)
+
+    def test_short_circuit(self):
+        for code in ('0 and 1d6 // 0', '1d6 or 1d6 / 0', '1d6 > 6 and 1d6 / 0', '1d6 < 7 or 1 / 0',
+                     '(1d6 > 6 or 1d6 < 1) and 1d6 % 0'):
+            with self.subTest(code=code):
+                self.assertIsNone(execute(f'({code}) repeat 5').error)
+                self.assertIsNone(execute(f'({code}) repeat 20').error)
+                self.assertEqual(len(execute(f'({code}) repeat 20').unwrap()), 20)
+        self.assertEqual(execute('(0 and 1d6 // 0) repeat 20').unwrap(), [0] * 20)
+        self.assertEqual(set(execute('(1d2 - 1 and 1d6 + 10) repeat 200').unwrap()), {0, 11, 12, 13, 14, 15, 16})
+
+    def test_large_repeats(self):
+        start = datetime.datetime.now()
+        values = di.execute_test(parser.parse('1d20 repeat 1000000'))
+        self.assertLess(datetime.datetime.now() - start, datetime.timedelta(seconds=5))
+        self.assertEqual(len(values), 1000000)
+        self.assertEqual(set(values), set(range(1, 21)))
+
+
+class TestRange(unittest.TestCase):
+    def test_lazy(self):
+        huge = di.execute_test(parser.parse('[1 through 10 ** 12]'))
+        self.assertIsInstance(huge, Range)
+        self.assertTrue(huge.is_lazy())
+        self.assertEqual(execute('len([0 to 10 ** 15 by 3])').unwrap(), 333333333333334)
+        self.assertEqual(execute('[1 through 10 ** 12][-1]').unwrap(), 10 ** 12)
+        self.assertEqual(execute('[1 through 10 ** 12][5:8]').unwrap(), [6, 7, 8])
+        self.assertTrue(execute('10 ** 11 in [1 through 10 ** 12]').unwrap())
+        self.assertTrue(execute('5.0 in [1 to 9]').unwrap())
+        self.assertFalse(execute('5.5 in [1 to 9]').unwrap())
+        self.assertEqual(len(execute('3 @! [1 through 10 ** 9]').unwrap()), 3)
+
+    def test_behaves_like_list(self):
+        for code, expected in [('[1 to 4]', [1, 2, 3]), ('[9 to 1 by 3]', [9, 6, 3]), ('[1 to 4] == [1, 2, 3]', True),
+                               ('[1 to 3] + [5]', [1, 2, 5]), ('[5] + [1 to 3]', [5, 1, 2]), ('2 * [1 to 3]', [1, 2, 1, 2]),
+                               ('[2 through 6 by 2] / 4', [2, 6]), ('sorted([5 to 1])', [2, 3, 4, 5]),
+                               ('&[1 through 100]', 5050), ('typename([1 to 3])', 'list'),
+                               ('typeof([1 to 3]) == typeof([])', True), ('isinstance([1 to 3], list)', True),
+                               ('isinstance([1 to 3], (str, int))', False)]:
+            with self.subTest(code=code):
+                self.assertEqual(execute(code).unwrap(), expected)
+
+    def test_materialized_on_change(self):
+        self.assertEqual(execute('x = [1 to 5]; x[0] = 9; x').unwrap(), [9, 2, 3, 4])
+        r = execute('f = () -> begin x = [1 to 5]; x.append(7); x += [8]; x end; f()')
+        self.assertEqual(r.unwrap(), [1, 2, 3, 4, 7, 8])
+        lazy = Range(range(3))
+        lazy.insert(0, 5)
+        self.assertFalse(lazy.is_lazy())
+        self.assertEqual(lazy, [5, 0, 1, 2])
+
+    def test_stored_lazily(self):
+        store = BasicStore()
+        for _ in range(2):
+            store.put(IdentType.USER, 'owner', Range(range(10 ** 12)), 'r')
+            self.assertTrue(store.get(IdentType.USER, 'owner', 'r').is_lazy())
+        # The database holds values pickled, which keeps them lazy too.
+        self.assertTrue(pickle.loads(pickle.dumps(Range(range(10 ** 12)))).is_lazy())
+        self.assertEqual(pickle.loads(pickle.dumps(Range(range(3)))), [0, 1, 2])
+        start = time.monotonic()
+        r = execute('rr = [1 to 10 ** 7]; for i in rr do if i > 3 then break i else i')
+        self.assertEqual(r.unwrap(), [1, 2, 3, 4])
+        self.assertEqual(execute('rr[-1]').unwrap(), 10 ** 7 - 1)
+        self.assertLess(time.monotonic() - start, 1)
+        # Results outlive the execution, so they are lists, built within its memory budget.
+        self.assertIs(type(execute('[1 to 3]').unwrap()), list)
+
 
 class TestBitwise(unittest.TestCase):
     def test_bitwise_and(self):
@@ -309,6 +743,246 @@ class TestFlowControl(unittest.TestCase):
         self.assertTrue(r.unwrap_eq('bar'))
 
 
+class TestRuntimeLimits(unittest.TestCase):
+    @staticmethod
+    def interpreters(**limits):
+        return [DicelangInterpreter(CallStack(BasicStore()), engine=engine, **limits) for engine in ('tree', 'closure')]
+
+    def test_fuel_reported(self):
+        for interpreter in self.interpreters():
+            with self.subTest(engine=interpreter.engine):
+                short, long = (interpreter.execute(parser.parse(f'for i in [0 to {n}] do i * 2')) for n in (10, 1000))
+                self.assertGreater(short.fuel, 0)
+                self.assertGreater(long.fuel, 50 * short.fuel)
+
+    def test_fuel_limit(self):
+        for interpreter in self.interpreters(fuel_limit=10000):
+            for code in ('while True do 1', 'f = (n) -> if n then f(n - 1) + f(n - 1) else 0; f(20)',
+                         '1d6 repeat 1000000', '[1 to 3] repeat 100000', 'x = 0; while x < 1 do x *= 1'):
+                with self.subTest(engine=interpreter.engine, code=code):
+                    r = interpreter.execute(parser.parse(code))
+                    self.assertIs(r.exc_type, ExcessiveRuntime)
+                    self.assertGreater(r.fuel, 10000)
+            self.assertIsNone(interpreter.execute(parser.parse('1d6 repeat 100')).error)
+
+    def test_batched_fuel(self):
+        # A batch is charged for the dice it rolls and the values it computes, not for a walk of the tree per repetition.
+        for interpreter in self.interpreters(fuel_limit=10 ** 6):
+            with self.subTest(engine=interpreter.engine):
+                r = interpreter.execute(parser.parse('1d20 + 5 repeat 10 ** 6'))
+                self.assertIsNone(r.error)
+                self.assertEqual(len(r.value), 10 ** 6)
+                self.assertLess(r.fuel, 3 * 10 ** 6 // compiler.batches.ElementsPerFuel)
+                self.assertGreater(r.fuel, 10 ** 6 // compiler.batches.ElementsPerFuel)
+
+    def test_compiled_fuel(self):
+        for code in ('f = (n) -> if n > 0 then n + f(n - 1) else 0; f(50)', 'f = (n) -> n > 0 and 1 + f(n - 1) or 0; f(50)',
+                     'x = 0; for i in [0 to 100] do if i % 2 then x += i else x -= 1; x',
+                     'x = 0; do x += 1 while x < 9 and (x > 5 or x < 20)', '[1, 2, 3][0] + 2 * 3 - 4',
+                     'f = () -> begin x = 0; while x < 5 and x > -1 do x += 1; do x -= 1 while x; x end; f() + f()'):
+            with self.subTest(code=code):
+                fuel = set()
+                for compile_after in (None, 1):
+                    for interpreter in self.interpreters():
+                        with mock.patch.object(UserFunction, 'compile_after', compile_after):
+                            fuel.add(interpreter.execute(parser.parse(code)).fuel)
+                self.assertEqual(len(fuel), 1)
+
+    def test_builtins_limited(self):
+        for interpreter in self.interpreters(time_limit_seconds=0.01):
+            with self.subTest(engine=interpreter.engine):
+                start = time.monotonic()
+                self.assertIs(interpreter.execute(parser.parse('mean("1d6 + 3 ** 2600000 % 2")')).exc_type,
+                              ExcessiveRuntime)
+                self.assertLess(time.monotonic() - start, 0.2)
+
+    def test_time_limit(self):
+        for interpreter in self.interpreters(time_limit_seconds=0.05):
+            for code in ('while True do 1', '(1 + 1) repeat 10000000'):
+                with self.subTest(engine=interpreter.engine, code=code):
+                    start = time.monotonic()
+                    r = interpreter.execute(parser.parse(code))
+                    self.assertIs(r.exc_type, ExcessiveRuntime)
+                    self.assertLess(time.monotonic() - start, 5)
+            self.assertIsNone(interpreter.execute(parser.parse('for i in [0 to 1000] do i')).error)
+
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_refused_before_allocating(self):
+        for code in ('[1] * 10 ** 10', '10 ** 12 * "x"', '"é" * 10 ** 8', '[1 to 10 ** 10] - 1',
+                     'x = [1 through 10 ** 9]', '[1 to 10 ** 9]', '[1, 2] << 3 if False else [0] * 10 ** 9',
+                     '1 << 10 ** 12', '(10 ** 9) r 6', '(10 ** 8) d (10 ** 9)', '1d6 repeat 10 ** 10',
+                     '"x" * 10 ** 8 + "y" * 10 ** 8 + "z" * 10 ** 8'):
+            with self.subTest(code=code):
+                self.assertIs(execute(code).exc_type, ExcessiveSize)
+
+    def test_augmented_assignment(self):
+        closure = DicelangInterpreter(CallStack(BasicStore()), engine='closure')
+        for initial, augment, argument in (('[1]', '*=', '10 ** 9'), ('"a"', '*=', '10 ** 10'),
+                                           ('1', '<<=', '10 ** 12'), ('[0]', '+=', '[1 to 10 ** 10]')):
+            code = f'x = {initial}; x {augment} {argument}'
+            function = f'f = (n) -> begin x = {initial}; if n then x {augment} {argument} else x end; f(0); f(1)'
+            with self.subTest(code=code):
+                self.assertIs(execute(code).exc_type, ExcessiveSize)
+                self.assertIs(closure.execute(parser.parse(code)).exc_type, ExcessiveSize)
+                with mock.patch.object(UserFunction, 'compile_after', 1):
+                    self.assertIs(execute(function).exc_type, ExcessiveSize)
+        self.assertEqual(execute('x = [1, 2, 1]; x -= 1; x <<= 3; x >>= 0; x').value, [0, 2, 1, 3])
+
+    def test_running_total(self):
+        r = execute('x = [0] * 10 ** 6; y = x + x; len(y)')
+        self.assertEqual(r.value, 2 * 10 ** 6)
+        self.assertEqual(r.allocated, 3 * 8 * 10 ** 6)
+        self.assertEqual(execute('[0] * 100').allocated, 0)
+        interpreter = DicelangInterpreter(CallStack(BasicStore()), memory_limit=3 * 8 * 10 ** 6 - 1)
+        self.assertIs(interpreter.execute(parser.parse('x = [0] * 10 ** 6; y = x + x')).exc_type, ExcessiveSize)
+        self.assertIsNone(interpreter.execute(parser.parse('x = [0] * 10 ** 6; y = x + [1]')).error)
+
+    def test_budget(self):
+        budget = memory.Budget(1 << 20)
+        budget.reserve(memory.LargeAllocation - 1, 'small')
+        self.assertEqual(budget.allocated, 0)
+        budget.reserve(1 << 19, 'large')
+        self.assertRaises(ExcessiveSize, budget.reserve, 1 << 19 + 1, 'larger')
+        self.assertEqual(budget.allocated, 1 << 19)
+        with memory.budgeted(None) as unlimited:
+            self.assertIs(memory.current(), unlimited)
+            memory.reserve(1 << 40, 'huge')
+        self.assertIsNot(memory.current(), unlimited)
+        self.assertEqual(unlimited.allocated, 1 << 40)
+        self.assertEqual(memory.footprint(Range(range(10))), 10 * (memory.Pointer + memory.Int))
+        self.assertEqual(memory.footprint(Range(range(10)) + [1]), 11 * memory.Pointer)
+
+
+class TestWorkerPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.pool = WorkerPool(2, db_location=Path(cls.directory.name) / 'workers.db')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.directory.cleanup()
+
+    def test_results(self):
+        r = self.pool.execute('tester', 'server', 'channel', '4d6kh3 repeat 6', seed=5)
+        self.assertIsNone(r.error)
+        self.assertEqual(len(r.value), 6)
+        self.assertEqual(r.value, self.pool.execute('tester', 'server', 'channel', '4d6kh3 repeat 6', seed=5).value)
+        r = self.pool.execute('tester', 'server', 'channel', '1 / 0')
+        self.assertIsInstance(r.error, str)
+
+    def test_shared_variables(self):
+        self.pool.execute('tester', 'server', 'channel', 'my shared = 1')
+        for i in range(2, 6):
+            r = self.pool.execute('tester', 'server', 'channel', 'my shared += 1; my shared')
+            self.assertEqual(r.value, i)
+
+    def test_timeout(self):
+        respawned = self.pool.respawned
+        with mock.patch.object(self.pool, 'timeout', 0.5):
+            r = self.pool.execute('tester', 'server', 'channel', 'while True do 1')
+        self.assertIs(r.exc_type, ExcessiveRuntime)
+        self.assertEqual(self.pool.respawned, respawned + 1)
+        self.assertEqual(self.pool.execute('tester', 'server', 'channel', '2 + 2').value, 4)
+
+    def test_cpu_limit(self):
+        with WorkerPool(1, cpu_limit=1) as pool:
+            r = pool.execute('tester', 'server', 'channel', 'while True do 1')
+            self.assertIs(r.exc_type, ExcessiveRuntime)
+            self.assertEqual(pool.respawned, 1)
+            pool.workers[0].process.kill()
+            self.assertIs(pool.execute('tester', 'server', 'channel', '1').exc_type, WorkerLost)
+            self.assertEqual(pool.execute('tester', 'server', 'channel', '1').value, 1)
+
+    def test_spawn_failure(self):
+        with WorkerPool(1, timeout=0.5) as pool:
+            with mock.patch.object(pool, 'spawn', side_effect=OSError('cannot fork')):
+                self.assertIs(pool.execute('tester', 'server', 'channel', 'while True do 1').exc_type, ExcessiveRuntime)
+                self.assertEqual(pool.workers, [])
+                self.assertIs(pool.execute('tester', 'server', 'channel', '1').exc_type, WorkerLost)
+            self.assertEqual(pool.execute('tester', 'server', 'channel', '1').value, 1)
+            self.assertEqual(len(pool.workers), 1)
+
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dispatcher = Dispatcher(2, Path(self.directory.name) / 'dispatch.db')
+
+    def tearDown(self):
+        self.dispatcher.close()
+        self.directory.cleanup()
+
+    def test_owner_in_order(self):
+        async def commands():
+            first = self.dispatcher.execute('tester', 'server', 'channel', 'my n = 0')
+            increments = (self.dispatcher.execute('tester', f'server{i}', 'channel', 'my n += 1; my n') for i in range(5))
+            return await asyncio.gather(first, *increments)
+
+        results = asyncio.run(commands())
+        self.assertEqual([r.value for r in results[1:]], [1, 2, 3, 4, 5])
+        stats = self.dispatcher.stats()
+        self.assertEqual((stats['completed'], stats['waiting'], stats['running']), (6, 0, 0))
+        # The first command runs at once; the others wait for its owner's lock.
+        self.assertEqual(stats['peak_waiting'], 5)
+        self.assertEqual(len(self.dispatcher.locks), 0)
+
+    def test_render(self):
+        result = asyncio.run(self.dispatcher.execute('tester', 'server', 'channel', '1 + 1'))
+        self.assertEqual(asyncio.run(self.dispatcher.render(repr, result.value)), '2')
+
+
+class TestExecutionContext(unittest.TestCase):
+    code = ('f = (n) -> begin t = 0; for i in [1 to n] do t += 1d20; t end;'
+            ' total = 0; for i in [1 to 300] do begin println(i, f(3)); total += i end; [total, f(10), 4d6kh3]')
+
+    def test_concurrent_executions(self):
+        for engine in DicelangInterpreter.Engines:
+            interpreter = DicelangInterpreter(CallStack(BasicStore()), engine=engine)
+            tree = parser.parse_flattened(self.code, optimizer=interpreter.optimizer)
+
+            def run(i: int):
+                r = interpreter.execute(tree, as_owner=f'owner{i}', on_server=f'server{i}', seed=i)
+                return r.value, r.console, r.error, r.fuel
+
+            expected = [run(i) for i in range(16)]
+            with ThreadPoolExecutor(8) as executor:
+                actual = list(executor.map(run, range(16)))
+            with self.subTest(engine=engine):
+                self.assertEqual(actual, expected)
+                self.assertTrue(all(error is None for _, _, error, _ in actual))
+
+    def test_isolated(self):
+        queue, budget, generator = native.print_queue(), memory.current(), rng.current()
+        r = di.execute(parser.parse('println("hello"); len([0] * 100000)'))
+        self.assertEqual(r.console, 'hello\n')
+        self.assertGreater(r.allocated, 0)
+        self.assertEqual(queue.queued, [])
+        self.assertEqual((native.print_queue(), memory.current(), rng.current()), (queue, budget, generator))
+
+    def test_concurrent_parses(self):
+        scripts = [f'x{i} = {i}; if x{i} > 3 then x{i} else -x{i}' if i % 200 == 0 else
+                   f'{i} + 2d{i % 20 + 1} * [{i}, {i + 1}][0] - f{i}(x, {i})' for i in range(4000)]
+        expected = [parser.parse(code) for code in scripts]
+        cache = ParseCache(max_entries=64)
+        with ThreadPoolExecutor(8) as executor:
+            actual = list(executor.map(partial(parser.parse_flattened, cache=cache), scripts))
+        self.assertEqual(actual, expected)
+        self.assertEqual(len(cache), 64)
+
+    def test_entered(self):
+        context = ExecutionContext(Ownership('tester', 'server'), CallStack(BasicStore()), native.PrintQueue(),
+                                   memory.Budget(None), rng.DiceRandom(3))
+        with context.entered():
+            native.println('inside')
+            self.assertIs(rng.current(), context.generator)
+            self.assertIs(memory.current(), context.budget)
+        self.assertEqual(context.print_queue.flush(), 'inside\n')
+        self.assertIsNot(rng.current(), context.generator)
+
+
 class TestFunctions(unittest.TestCase):
     def test_functions(self):
         r = execute('(() -> "")()')
@@ -317,5 +991,391 @@ class TestFunctions(unittest.TestCase):
         self.assertTrue(r.unwrap_eq(3))
 
 
+class TestParseCache(unittest.TestCase):
+    def test_hit(self):
+        cache = ParseCache()
+        first = parser.parse_flattened('1d20+7', cache=cache)
+        second = parser.parse_flattened('1d20+7', cache=cache)
+        self.assertIs(first, second)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_matches_uncached(self):
+        cache = ParseCache()
+        self.assertEqual(parser.parse_flattened('4d6kh3 repeat 6', cache=cache),
+                         fl.transform(parser.parse('4d6kh3 repeat 6')))
+
+    def test_parsed_flat(self):
+        code = 'x = 0; for i in [1 through 10] do x += i if i > 2 else 0 repeat 2; not x or 1d6 ** 2'
+        tree = parser.parse(code)
+        self.assertEqual(fl.transform(tree), tree)
+        self.assertFalse(Flattener.passthrough_rules & {t.data for t in tree.iter_subtrees()})
+
+    def test_eviction(self):
+        cache = ParseCache(max_entries=2)
+        for code in ('1', '2', '3'):
+            parser.parse_flattened(code, cache=cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertNotIn(('start', '1'), cache)
+
+    def test_node_budget(self):
+        size = tree_size(parser.parse_flattened('1 + 2', cache=None))
+        cache = ParseCache(max_nodes=size * 2)
+        for code in ('1 + 2', '3 + 4', '5 + 6'):
+            parser.parse_flattened(code, cache=cache)
+        self.assertLessEqual(cache.nodes, size * 2)
+        self.assertEqual(len(cache), 2)
+
+    def test_disabled(self):
+        cache = ParseCache(enabled=False)
+        parser.parse_flattened('1', cache=cache)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits + cache.misses, 0)
+
+
+class TestFastParser(unittest.TestCase):
+    common = ['1d20+7', '4d6kh3', '10d3kl5', '3d6xh1', '8r8xl4', '2d6 + 3 * -1', '(1d4)d6',
+              'max(1d20, 1d20) + 5', 'f(1, y=2)', 'x.y[0](2).z', '[1, 2, [3],]', '1 < 2 <= 3 != 4',
+              '"a" $ \'b\'; 0x1F ** 2 // 1e3 % 1.5j; True; Undefined']
+
+    @staticmethod
+    def corpus():
+        for path in (Path(__file__).parent / 'tests.py', Path(__file__).parent / 'dicelang' / 'langtest.py'):
+            for node in ast.walk(ast.parse(path.read_text())):
+                if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'execute':
+                    if node.args and isinstance(node.args[0], ast.Constant):
+                        yield node.args[0].value
+
+    @classmethod
+    def normalized(cls, tree):
+        # Earley picks nested or flat trees for `x.y.z` depending on hash seed.
+        if not isinstance(tree, Tree):
+            return tree
+        children = [cls.normalized(c) for c in tree.children]
+        if tree.data == 'retrieval_atomic' and isinstance(children[0], Tree) and children[0].data == tree.data:
+            children = children[0].children + children[1:]
+        return Tree(tree.data, children)
+
+    def test_conformance(self):
+        for code in [*self.corpus(), *self.common]:
+            with self.subTest(code=code):
+                try:
+                    fast = parser.fast.parse(code)
+                except Unsupported:
+                    continue
+                self.assertEqual(self.normalized(fast), self.normalized(parser.kernel.parse(code, start='start')))
+
+    def test_common_commands_accepted(self):
+        for code in self.common:
+            with self.subTest(code=code):
+                parser.fast.parse(code)
+
+    def test_fallback(self):
+        for code in ['x = 1', '2d6 repeat 3', '[1 to 9]', '(x) -> x', '1 if True else 2', "R'raw'", '1 +']:
+            with self.subTest(code=code):
+                self.assertRaises(Unsupported, parser.fast.parse, code)
+
+
+class TestKernelCache(unittest.TestCase):
+    def test_shared_kernel(self):
+        self.assertIs(parser.kernel, UserFunction.parser.kernel)
+
+    def test_round_trip(self):
+        grammar = DicelangParser.read_grammar()
+        original = DicelangParser.CacheDirectory
+        with tempfile.TemporaryDirectory() as directory:
+            DicelangParser.CacheDirectory = Path(directory)
+            try:
+                built, _ = compiled = DicelangParser.build_kernel(grammar)
+                DicelangParser.save_kernel(compiled, path := DicelangParser.kernel_path(grammar))
+                self.assertTrue(path.exists())
+                DicelangParser._kernels.clear()
+                loaded, errors = DicelangParser.load_kernel(grammar)
+            finally:
+                DicelangParser.CacheDirectory = original
+        self.assertIsNot(loaded, built)
+        self.assertEqual(set(errors), set(DicelangParser.StartRules))
+        for code, start in [('x = [1 to 3]; for i in x do i', 'start'), ('(a, b=2) -> a + b', 'function')]:
+            self.assertEqual(loaded.parse(code, start=start), built.parse(code, start=start))
+
+    def test_corrupt_cache(self):
+        grammar = DicelangParser.read_grammar()
+        original = DicelangParser.CacheDirectory
+        with tempfile.TemporaryDirectory() as directory:
+            DicelangParser.CacheDirectory = Path(directory)
+            try:
+                DicelangParser.kernel_path(grammar).write_bytes(b'not a pickle')
+                DicelangParser._kernels.clear()
+                with self.assertWarns(RuntimeWarning):
+                    kernel, _ = DicelangParser.load_kernel(grammar)
+            finally:
+                DicelangParser.CacheDirectory = original
+        self.assertEqual(kernel.parse('1', start='start'), parser.kernel.parse('1', start='start'))
+
+    def test_untrusted_cache(self):
+        grammar = DicelangParser.read_grammar()
+        original = DicelangParser.CacheDirectory
+        with tempfile.TemporaryDirectory() as directory:
+            DicelangParser.CacheDirectory = Path(directory) / 'cache'
+            try:
+                DicelangParser._kernels.clear()
+                DicelangParser.load_kernel(grammar)
+                path = DicelangParser.kernel_path(grammar)
+                self.assertEqual(DicelangParser.CacheDirectory.stat().st_mode & 0o777, 0o700)
+                self.assertEqual(path.stat().st_mode & 0o777, 0o600)
+                for target, mode in ((path, 0o666), (DicelangParser.CacheDirectory, 0o777)):
+                    with self.subTest(target=target.name):
+                        target.chmod(mode)
+                        DicelangParser._kernels.clear()
+                        with mock.patch('dicelang.parser._KernelUnpickler') as unpickler, \
+                                self.assertWarns(RuntimeWarning):
+                            DicelangParser.load_kernel(grammar)
+                        unpickler.assert_not_called()
+                        target.chmod(mode & 0o700)
+            finally:
+                DicelangParser.CacheDirectory = original
+                DicelangParser._kernels.clear()
+
+
+class TestSyntaxErrors(unittest.TestCase):
+    def test_examples_classified(self):
+        for error_type, examples in DicelangParser.make_examples().items():
+            for example in examples:
+                with self.subTest(example=example):
+                    with self.assertRaises(DicelangSyntaxError) as caught:
+                        parser.parse(example)
+                    self.assertIs(type(caught.exception), error_type)
+
+    def test_matches_lark(self):
+        for code in ['1 +', '* 1', '[1 2]', '(1, ', '{1: 5', 'q.r', '1 + * 2', 'f(1,', '((1)', 'x +=']:
+            with self.subTest(code=code):
+                try:
+                    parser.kernel.parse(code, start='start')
+                except UnexpectedInput as u:
+                    expected = u.match_examples(partial(parser.kernel.parse, start='start'),
+                                                DicelangParser.make_examples(), use_accepts=True)
+                    self.assertIs(parser.errors.classify(u), expected)
+
+    def test_counters(self):
+        before = parser.counters.copy()
+        self.assertRaises(DicelangSyntaxError, parser.parse, '1 +')
+        parser.parse('1 if True else 2')
+        parser.parse('1 + 2')
+        self.assertEqual(parser.counters['failed'] - before['failed'], 1)
+        self.assertEqual(parser.counters['classified'] - before['classified'], 1)
+        self.assertEqual(parser.counters['earley'] - before['earley'], 1)
+        self.assertEqual(parser.counters['fast'] - before['fast'], 1)
+        self.assertGreater(parser.counters['failure_seconds'], before['failure_seconds'])
+
+
+class TestFunctionSerialization(unittest.TestCase):
+    source = '(a, b=2) -> begin x = a; for i in [0 to b] do x *= 2; x end'
+
+    def setUp(self):
+        self.function = execute(f'f = {self.source}; f').value
+
+    def test_pickle_without_parsing(self):
+        with mock.patch.object(UserFunction, 'parser', None):
+            loaded = pickle.loads(pickle.dumps(self.function))
+        self.assertEqual(UserFunction.pack(loaded.code), UserFunction.pack(self.function.code))
+        self.assertEqual(repr(loaded.params), repr(self.function.params))
+        self.assertEqual(loaded.closed_over, self.function.closed_over)
+
+    def test_store_without_parsing(self):
+        store = BasicStore()
+        store.put(IdentType.USER, 'owner', 0, 'f')
+        with mock.patch.object(UserFunction, 'parser', None):
+            store.put(IdentType.USER, 'owner', self.function, 'f')
+        self.assertEqual(UserFunction.pack(store.get(IdentType.USER, 'owner', 'f').code),
+                         UserFunction.pack(self.function.code))
+
+    def test_version_change_reparses(self):
+        function, args, closure = self.function.__reduce__()
+        with mock.patch.object(UserFunction, 'FormatVersion', UserFunction.FormatVersion + 1):
+            loaded = function(*args, closure)
+        self.assertEqual(loaded.source, self.function.source)
+        self.assertEqual(loaded.code, UserFunction(self.function.source).code)
+
+    def test_unversioned_pickle(self):
+        loaded = object.__new__(UserFunction)
+        loaded.__setstate__(dict(self.function.__dict__))
+        self.assertIs(loaded.code, self.function.code)
+
+
+class TestOptimizer(unittest.TestCase):
+    @staticmethod
+    def optimized(code):
+        return parser.parse_flattened(code, cache=None, optimizer=di.optimizer)
+
+    @staticmethod
+    def rules(tree):
+        """Count the rules that will be evaluated, skipping the subtrees folded into constants."""
+        rules, pending = Counter(), [tree]
+        while pending:
+            node = pending.pop()
+            rules[node.data] += 1
+            if node.data != 'constant':
+                pending.extend(c for c in node.children if isinstance(c, Tree))
+        return rules
+
+    def test_conformance(self):
+        for code in TestFastParser.corpus():
+            try:
+                tree = parser.parse(code)
+            except (UnexpectedInput, DicelangSyntaxError):
+                continue
+            with self.subTest(code=code):
+                random.seed(code)
+                expected = di.execute(tree)
+                random.seed(code)
+                actual = di.execute(self.optimized(code))
+                self.assertEqual(repr(actual.value), repr(expected.value))
+                self.assertEqual(repr(actual.error), repr(expected.error))
+
+    def test_folds(self):
+        rules = self.rules(self.optimized('for i in [1 through 20] do i * 2 ** 10 + 1d6'))
+        self.assertEqual(rules['list_closed'] + rules['exponent'] + rules['number'], 0)
+        self.assertEqual(rules['constant'], 4)
+        self.assertEqual(rules['die_binary'], 1)
+        self.assertEqual(rules['multiplication'], 1)
+
+    def test_random_not_folded(self):
+        for code in ('1 ! 2', '@[1, 2]', '2 @! [1, 2, 3]', '1 is 1'):
+            with self.subTest(code=code):
+                self.assertEqual(self.optimized(code).children[0].data, parser.parse(code).children[0].data)
+
+    def test_large_not_folded(self):
+        for code in ('[1 through 100000]', '2 ** 100000', '"a" * 100000', '1 << 100000', '[1 through 4096] * 4096'):
+            with self.subTest(code=code):
+                self.assertNotEqual(self.optimized(code).children[0].data, 'constant')
+        # Folds that get past `affordable` are still refused by their budget before anything is built.
+        allocated = memory.current().allocated
+        with mock.patch.object(Optimizer, 'affordable', return_value=True):
+            self.assertNotEqual(self.optimized('[1 through 4096] * 4096').children[0].data, 'constant')
+        self.assertEqual(memory.current().allocated, allocated)
+
+    def test_constants_not_shared(self):
+        code = 'for i in [0 to 3] do begin z = [[1], 2]; y = z[0]; y += [i]; z end'
+        self.assertEqual(di.execute(self.optimized(code)).value, execute(code).value)
+        code = 'for i in [0 to 3] do begin z = [1, 2]; z += [i]; z end'
+        self.assertEqual(di.execute(self.optimized(code)).value, [[1, 2, 0], [1, 2, 1], [1, 2, 2]])
+
+    def test_reconstruct(self):
+        code = 'f = (a, b=[1, 2]) -> (a + 2 ** 3) * -b[0]; f'
+        self.assertEqual(repr(di.execute(self.optimized(code)).value), repr(execute(code).value))
+
+    def test_discarded_loops(self):
+        tree = self.optimized('for i in [0 to 3] do for j in [0 to 2] do j; if 1 then while 0 do 1;'
+                              ' for k in [0 to 2] do do k while 0')
+        loops = [loop for loop in tree.iter_subtrees_topdown() if loop.data.endswith('_loop')]
+        self.assertEqual([loop.data for loop in loops], ['for_loop', 'for_loop', 'while_loop', 'for_loop', 'do_while_loop'])
+        self.assertEqual([getattr(loop, 'discarded', False) for loop in loops], [True, True, True, False, False])
+        code = 'f = () -> begin s = 0; for i in [0 to 5] do s += i; do s += 1 while s < 20; s end; f()'
+        with mock.patch.object(Discarded, 'append') as append:
+            self.assertEqual(di.execute(self.optimized(code)).value, 20)
+        self.assertEqual(append.call_count, 15)
+        self.assertEqual(di.execute(self.optimized('for i in [0 to 3] do i * 2')).value, [0, 2, 4])
+
+    def test_cached_separately(self):
+        cache = ParseCache()
+        plain = parser.parse_flattened('1 + 2', cache=cache)
+        optimized = parser.parse_flattened('1 + 2', cache=cache, optimizer=di.optimizer)
+        self.assertIs(parser.parse_flattened('1 + 2', cache=cache, optimizer=di.optimizer), optimized)
+        self.assertEqual(plain.children[0].data, 'addition')
+        self.assertEqual(optimized.children[0].data, 'constant')
+
+
+class TestClosureEngine(unittest.TestCase):
+    closure = DicelangInterpreter(CallStack(BasicStore()), engine='closure')
+    tree = DicelangInterpreter(CallStack(BasicStore()), engine='tree')
+
+    def test_conformance(self):
+        for code in TestFastParser.corpus():
+            try:
+                plain = parser.parse(code)
+            except (UnexpectedInput, DicelangSyntaxError):
+                continue
+            for tree in (plain, self.tree.optimizer.transform(plain)):
+                with self.subTest(code=code, optimized=tree is not plain):
+                    random.seed(code)
+                    expected = self.tree.execute(tree)
+                    random.seed(code)
+                    actual = self.closure.execute(tree)
+                    self.assertEqual(repr(actual.value), repr(expected.value))
+                    self.assertEqual(repr(actual.error), repr(expected.error))
+
+    def test_compiled_once(self):
+        tree = parser.parse('x = 0; for i in [1 through 10] do x += i; x')
+        self.assertEqual(self.closure.execute(tree).value, 55)
+        closure = tree.closure
+        self.assertEqual(self.closure.execute(tree).value, 55)
+        self.assertIs(tree.closure, closure)
+
+    def test_user_functions(self):
+        code = 'f = (n) -> begin a = 0; b = 1; for i in [0 to n] do begin t = b; b = a + b; a = t end; a end; f(10)'
+        self.assertEqual(self.closure.execute(parser.parse(code)).value, 55)
+
+    def test_loop_signals(self):
+        code = 'x = 0; while True do begin x += 1; if x > 3 then break x else x end'
+        self.assertEqual(self.closure.execute(parser.parse(code)).value, self.tree.execute(parser.parse(code)).value)
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, DicelangInterpreter, CallStack(BasicStore()), engine='jit')
+
+
+class TestBytecode(unittest.TestCase):
+    interpreter = DicelangInterpreter(CallStack(BasicStore()))
+
+    def run_function(self, code: str, compile_after):
+        random.seed(code)
+        with mock.patch.object(UserFunction, 'compile_after', compile_after):
+            return self.interpreter.execute(parser.parse(code))
+
+    def test_conformance(self):
+        for body in TestFastParser.corpus():
+            code = f'f = () -> begin {body} end; [f(), f()]'
+            try:
+                UserFunction.reconstruct(parser.parse(code))
+            except (UnexpectedInput, DicelangSyntaxError, AttributeError):
+                continue
+            with self.subTest(code=body):
+                expected = self.run_function(code, None)
+                actual = self.run_function(code, 1)
+                self.assertEqual(repr(actual.value), repr(expected.value))
+                self.assertEqual(repr(actual.error), repr(expected.error))
+
+    def test_compiled_after_calls(self):
+        for calls, compiled in ((UserFunction.compile_after - 1, 0), (UserFunction.compile_after * 2, 1)):
+            code = f'f = (n) -> n * 2 + 1d1; for i in [0 to {calls}] do f(i)'
+            with mock.patch.object(UserFunction.lowering, 'compile', wraps=UserFunction.lowering.compile) as compile:
+                self.assertEqual(self.interpreter.execute(parser.parse(code)).value, [i * 2 + 1 for i in range(calls)])
+            self.assertEqual(compile.call_count, compiled)
+
+    def test_shared_between_copies(self):
+        f = UserFunction('(n) -> n ** 2 - n')
+        self.assertIs(UserFunction.lowering.compile(f.code), UserFunction.lowering.compile(deepcopy(f).code))
+
+    def test_fallback_nodes(self):
+        code = ('f = (n) -> begin g = (m) -> m + n; t = 0;'
+                ' for i in [0 to n] do if i > 5 then break t else t += g(i); t end;'
+                ' f(3) $ f(10)')
+        self.assertEqual(self.run_function(code, 1).value, self.run_function(code, None).value)
+
+    def test_discarded_loops(self):
+        function = '() -> begin t = 0; for i in [0 to 9] do t += i; while t > 5 do t -= 5; t end'
+        self.assertNotIn('.append(', Lowering(compiler).source(UserFunction(function).code.children[0]))
+        self.assertEqual(self.run_function(f'f = {function}; f()', 1).value, 1)
+
+    def test_no_builtins(self):
+        body = UserFunction.lowering.compile(UserFunction('(n) -> [n, n + 3]').code)
+        self.assertEqual(body.__globals__['__builtins__'], {})
+
+    def test_runtime_limit(self):
+        code = 'f = () -> begin t = 0; while True do t += 1; t end; f()'
+        with mock.patch.object(self.interpreter, 'time_limit', 1e-6):
+            result = self.run_function(code, 1)
+        self.assertIs(result.exc_type, ExcessiveRuntime)
+
+
 if __name__ == '__main__':
     unittest.main()